@@ -49,6 +49,8 @@ class CoreMain(object):
             composite_logger.log_debug("Obtaining execution configuration...")
             execution_config = container.get('execution_config')
             patch_operation_requested = execution_config.operation.lower()
+            if execution_config.package_manager_settings.get(Constants.PKG_MGR_SETTING_SHELL_COPROCESS, False):
+                container.get('env_layer').set_shell_coprocess_enabled(True)
             patch_assessor = container.get('patch_assessor')
             package_manager = container.get('package_manager')
 
@@ -97,6 +99,9 @@ class CoreMain(object):
             composite_logger.log_debug("Completed exception handling.\n")
 
         finally:
+            if status_handler is not None:
+                status_handler.flush_status_file(log_write_counts=True)
+
             if lifecycle_manager is not None:
                 lifecycle_manager.update_core_sequence(completed=True)
 
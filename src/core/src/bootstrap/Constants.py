@@ -34,6 +34,7 @@ class Constants(object):
     DEV = 'Dev'
     PROD = 'Prod'
     LPE_ENV_VARIABLE = "LPE_ENV"    # Overrides environment setting
+    LPE_PKG_MGR_SETTINGS_VARIABLE = "LPE_PKG_MGR_SETTINGS"     # Overrides opt-in package manager settings (json object)
 
     # Execution Arguments
     ARG_SEQUENCE_NUMBER = '-sequenceNumber'
@@ -58,9 +59,11 @@ class Constants(object):
         PATCHES_TO_INCLUDE = 'patchesToInclude'
         PATCHES_TO_EXCLUDE = 'patchesToExclude'
         MAINTENANCE_RUN_ID = 'maintenanceRunId'
+        INTERNAL_SETTINGS = 'internalSettings'
 
     # File to save default settings for auto OS updates
     IMAGE_DEFAULT_PATCH_CONFIGURATION_BACKUP_PATH = "ImageDefaultPatchConfiguration.bak"
+    ASSESSMENT_SNAPSHOT_FILE = "AssessmentSnapshot.json"
 
     # Operations
     ASSESSMENT = "Assessment"
@@ -109,6 +112,18 @@ class Constants(object):
     MAX_FILE_OPERATION_RETRY_COUNT = 5
     MAX_ASSESSMENT_RETRY_COUNT = 5
     MAX_INSTALLATION_RETRY_COUNT = 3
+    INSTALLATION_RETRY_BASE_DELAY_IN_SECONDS = 2       # doubled after every failed attempt
+    INSTALLATION_RETRY_MAX_DELAY_IN_SECONDS = 30
+    INSTALLATION_BATCH_SIZE = 20     # packages per transaction in batch installation
+    DOWNLOAD_PREFETCH_CHUNK_SIZE = 20
+    DOWNLOAD_PREFETCH_MIN_FREE_DISK_SPACE_IN_MB = 1024
+    PRESTAGE_DOWNLOADS_MAX_SIZE_IN_MB = 2048
+    PRESTAGE_DOWNLOADS_MAX_TIME_IN_MINUTES = 15
+    REPO_REFRESH_TTL_IN_MINUTES = 30     # repo metadata refreshed by the same operation within this is not refreshed again
+    MAX_ASSESSMENT_SNAPSHOT_AGE_IN_HOURS = 24     # reused only while the package state fingerprint is unchanged, and never past this age
+    ASSESSMENT_RESULT_ALL_UPDATES = 'AllUpdates'     # assessment result cache keys
+    ASSESSMENT_RESULT_SECURITY_UPDATES = 'SecurityUpdates'
+    COMMAND_OUTPUT_TAIL_LINE_COUNT = 100     # lines of streamed command output kept for error reporting
 
     # Package Classifications
     PACKAGE_CLASSIFICATIONS = {
@@ -120,6 +135,22 @@ class Constants(object):
     PKG_MGR_SETTING_FILTER_CRITSEC_ONLY = 'FilterCritSecOnly'
     PKG_MGR_SETTING_IDENTITY = 'PackageManagerIdentity'
     PKG_MGR_SETTING_IGNORE_PKG_FILTER = 'IgnorePackageFilter'
+    PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN = 'ClassifyByOrigin'
+    PKG_MGR_SETTING_NATIVE_ASSESSMENT = 'NativeAssessment'
+    PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT = 'CrossCheckNativeAssessment'
+    PKG_MGR_SETTING_XML_OUTPUT = 'XmlOutput'
+    PKG_MGR_SETTING_CONCURRENT_DISCOVERY = 'ConcurrentDiscovery'
+    PKG_MGR_SETTING_BATCH_INSTALLATION = 'BatchInstallation'
+    PKG_MGR_SETTING_DOWNLOAD_PREFETCH = 'DownloadPrefetch'
+    PKG_MGR_SETTING_PRESTAGE_DOWNLOADS = 'PrestageDownloads'
+    PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES = 'RepoRefreshTtlInMinutes'
+    PKG_MGR_SETTING_ASSESSMENT_SNAPSHOT = 'AssessmentSnapshot'
+    PKG_MGR_SETTING_SHELL_COPROCESS = 'ShellCoprocess'
+
+    # Opt-in settings that can be configured (all off unless set), via ConfigSettings.INTERNAL_SETTINGS or LPE_PKG_MGR_SETTINGS_VARIABLE
+    CONFIGURABLE_PKG_MGR_SETTINGS = [PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, PKG_MGR_SETTING_NATIVE_ASSESSMENT, PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, PKG_MGR_SETTING_XML_OUTPUT,
+                                     PKG_MGR_SETTING_CONCURRENT_DISCOVERY, PKG_MGR_SETTING_BATCH_INSTALLATION, PKG_MGR_SETTING_DOWNLOAD_PREFETCH, PKG_MGR_SETTING_PRESTAGE_DOWNLOADS,
+                                     PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES, PKG_MGR_SETTING_ASSESSMENT_SNAPSHOT, PKG_MGR_SETTING_SHELL_COPROCESS]
 
     # Reboot Manager
     REBOOT_NEVER = 'Never reboot'
@@ -143,10 +174,15 @@ class Constants(object):
 
     # Maintenance Window
     PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES = 5
+    MAX_COMMAND_TIMEOUT_IN_MINUTES = 30                 # no single command may use up more of the maintenance window than this
+    MIN_COMMAND_TIMEOUT_IN_MINUTES = 1                  # even once the maintenance window is used up
 
     # Package Manager Setting
     PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION = "RepeatUpdateRun"
 
+    # Status file writes
+    STATUS_FILE_MIN_WRITE_INTERVAL_IN_SECONDS = 5   # transitioning status updates within this interval are coalesced into one write
+
     # Settings for Error Objects logged in status file
     STATUS_ERROR_MSG_SIZE_LIMIT_IN_CHARACTERS = 128
     STATUS_ERROR_LIMIT = 5
@@ -176,3 +212,4 @@ class Constants(object):
         PRIVILEGED_OP_MARKER = "Privileged_Op_e6df678d-d09b-436a-a08a-65f2f70a6798"
         PRIVILEGED_OP_REBOOT = PRIVILEGED_OP_MARKER + "Reboot_Exception"
         PRIVILEGED_OP_EXIT = PRIVILEGED_OP_MARKER + "Exit_"
+        TIMED_OUT_COMMAND_CODE = 124    # same as coreutils 'timeout'
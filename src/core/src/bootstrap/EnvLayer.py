@@ -16,15 +16,20 @@
 
 from __future__ import print_function
 import base64
+import collections
 import datetime
 import json
 import os
 import platform
+import select
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import uuid
 from core.src.bootstrap.Constants import Constants
 from core.src.external_dependencies import distro
 
@@ -49,6 +54,12 @@ class EnvLayer(object):
         elif self.__emulator_enabled:
             self.__record_reader_init()
 
+        # Command execution
+        self.shell_coprocess = None                 # opt-in persistent shell that commands are multiplexed over, instead of starting a process each
+        self.shell_coprocess_lock = threading.Lock()    # the shell runs one command at a time; commands on other threads meanwhile run in fresh processes
+        self.command_timeout_provider = None        # returns the default timeout in seconds for commands run without one, or None
+        self.command_timed_out_handler = None       # called with (cmd, timeout) when a command is killed on timeout
+
         # Discrete components
         self.platform = self.Platform(recorder_enabled, emulator_enabled, self.__write_record, self.__read_record)
         self.datetime = self.DateTime(recorder_enabled, emulator_enabled, self.__write_record, self.__read_record)
@@ -79,87 +90,211 @@ class EnvLayer(object):
 
         return ret
 
-    def run_command_output(self, cmd, no_output=False, chk_err=False):
+    def run_command_output(self, cmd, no_output=False, chk_err=False, timeout=None):
+        """ Runs a command. If it runs longer than the timeout (in seconds, defaulting to the command timeout provider), its whole process group is killed and TIMED_OUT_COMMAND_CODE is returned. """
         operation = "RUN_CMD_OUT"
         if not self.__emulator_enabled:
+            if timeout is None and self.command_timeout_provider is not None:
+                timeout = self.command_timeout_provider()
             start = time.time()
-            code, output = self.__run_command_output_raw(cmd, no_output, chk_err)
+            code, output = self.__run_command_output_over_shell_coprocess(cmd, no_output, timeout) if self.shell_coprocess is not None else (None, None)
+            if code is None:
+                code, output = self.__run_command_output_raw(cmd, no_output, chk_err, timeout)
             self.__write_record(operation, code, output, delay=(time.time()-start))
             return code, output
         else:
             return self.__read_record(operation)
 
-    def __run_command_output_raw(self, cmd, no_output, chk_err=True):
+    def set_shell_coprocess_enabled(self, enabled):
+        """ Opts in to (or out of) running commands over a persistent shell coprocess. Commands fall back to fresh processes whenever it fails. """
+        if self.shell_coprocess is not None:
+            self.shell_coprocess.stop()
+        self.shell_coprocess = self.ShellCoprocess() if enabled else None
+
+    def __run_command_output_over_shell_coprocess(self, cmd, no_output, timeout):
+        """ Returns (code, output) from the shell coprocess, or (None, None) if it is busy or failed and the command needs to run in a fresh process """
+        if not self.shell_coprocess_lock.acquire(False):
+            return None, None
+        try:
+            code, raw_output = self.shell_coprocess.run_command(cmd, timeout)
+        except Exception as error:
+            print("Shell coprocess failed. Falling back to a fresh process. [Error={0}]".format(repr(error)))
+            self.shell_coprocess.stop()
+            return None, None
+        finally:
+            self.shell_coprocess_lock.release()
+
+        if code is None:
+            return self.__get_timed_out_command_result(cmd, timeout, no_output, raw_output)
+        return code, (None if no_output else self.__convert_process_output_to_ascii(raw_output))
+
+    def set_command_timeout_provider(self, command_timeout_provider, command_timed_out_handler=None):
+        """ Sets (or clears, with None) the source of the default timeout for commands and the handler notified of timeouts """
+        self.command_timeout_provider = command_timeout_provider
+        self.command_timed_out_handler = command_timed_out_handler
+
+    def run_command_stream(self, cmd, timeout=None):
+        """ Runs a command and returns a CommandOutputStream that yields its decoded output lines as they arrive. Only a bounded tail of the output is retained. Timeouts work as in run_command_output. """
+        operation = "RUN_CMD_OUT"
+        if self.__emulator_enabled:
+            code, output = self.__read_record(operation)
+            return self.CommandOutputStream.from_output(code, output)
+
+        if timeout is None and self.command_timeout_provider is not None:
+            timeout = self.command_timeout_provider()
+        start = time.time()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, preexec_fn=(os.setsid if timeout is not None else None))
+        timed_out = []
+        timer = self.__start_command_timer(process, timeout, timed_out) if timeout is not None else None
+        recorded_lines = [] if self.__recorder_enabled else None    # recordings hold full outputs
+
+        def read_lines():
+            for raw_line in iter(process.stdout.readline, b''):
+                line = self.__decode_process_output(raw_line)
+                if recorded_lines is not None:
+                    recorded_lines.append(line)
+                yield line
+
+        def complete():
+            process.stdout.close()
+            code = process.wait()
+            if timer is not None:
+                timer.cancel()
+            if len(timed_out) != 0:
+                code = self.__get_timed_out_command_result(cmd, timeout, True, None)[0]
+            if recorded_lines is not None:
+                self.__write_record(operation, code, '\n'.join(recorded_lines), delay=(time.time()-start))
+            return code
+
+        return self.CommandOutputStream(read_lines(), complete)
+
+    class CommandOutputStream(object):
+        """ Output lines of a command, consumable once. The return code is set once every line has been read. """
+        def __init__(self, lines, complete_delegate, tail_line_count=Constants.COMMAND_OUTPUT_TAIL_LINE_COUNT):
+            self.code = None
+            self.tail = collections.deque(maxlen=tail_line_count)
+            self.__lines = lines
+            self.__complete = complete_delegate
+
+        def __iter__(self):
+            for line in self.__lines:
+                self.tail.append(line)
+                yield line
+            if self.code is None:
+                self.code = self.__complete()
+
+        def read_to_end(self):
+            """ Drains any lines the consumer did not read, so the command can complete """
+            for line in self:
+                pass
+            return self.code
+
+        def get_tail(self):
+            return '\n'.join(self.tail)
+
+        @staticmethod
+        def from_output(code, output):
+            return EnvLayer.CommandOutputStream(iter(output.splitlines()), lambda: code)
+
+    def run_command_outputs_concurrently(self, cmds, no_output=False, chk_err=False):
+        """ Runs independent, read-only commands in parallel threads and returns their (code, output) in order. Sequential while recording or emulating, as records are ordered. """
+        if self.__recorder_enabled or self.__emulator_enabled or len(cmds) < 2:
+            return [self.run_command_output(cmd, no_output, chk_err) for cmd in cmds]
+
+        results = [None] * len(cmds)
+
+        def run_command_output_into_results(index):
+            try:
+                results[index] = self.run_command_output(cmds[index], no_output, chk_err)
+            except Exception as error:
+                results[index] = error
+
+        threads = [threading.Thread(target=run_command_output_into_results, args=(index,)) for index in range(0, len(cmds))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def __run_command_output_raw(self, cmd, no_output, chk_err=True, timeout=None):
         """
-        Wrapper for subprocess.check_output. Execute 'cmd'.
+        Executes 'cmd' in a fresh process, with stderr merged into stdout.
         Returns return code and STDOUT, trapping expected exceptions.
         Reports exceptions to Error if chk_err parameter is True
+        Everything is local to the call (the subprocess module is left as is), so commands can run on several threads at once.
         """
-
-        def check_output(no_output, *popenargs, **kwargs):
-            """
-            Backport from subprocess module from python 2.7
-            """
-            if 'stdout' in kwargs:
-                raise ValueError('stdout argument not allowed, it will be overridden.')
-            if no_output is True:
-                out_file = None
-            else:
-                out_file = subprocess.PIPE
-
-            process = subprocess.Popen(stdout=out_file, *popenargs, **kwargs)
-            output, unused_err = process.communicate()
-            retcode = process.poll()
-
-            if retcode:
-                cmd = kwargs.get("args")
-                if cmd is None:
-                    cmd = popenargs[0]
-                raise subprocess.CalledProcessError(retcode, cmd, output=output)
-            return output
-
-        # noinspection PyShadowingNames,PyShadowingNames
-        class CalledProcessError(Exception):
-            """Exception classes used by this module."""
-
-            def __init__(self, return_code, cmd, output=None):
-                self.return_code = return_code
-                self.cmd = cmd
-                self.output = output
-
-            def __str__(self):
-                return "Command '%s' returned non-zero exit status %d" \
-                       % (self.cmd, self.return_code)
-
-        subprocess.check_output = check_output
-        subprocess.CalledProcessError = CalledProcessError
+        timed_out = []
         try:
-            output = subprocess.check_output(no_output, cmd, stderr=subprocess.STDOUT, shell=True)
-        except subprocess.CalledProcessError as e:
-            if chk_err:
-                print("Error: CalledProcessError.  Error Code is: " + str(e.returncode), file=sys.stdout)
-                print("Error: CalledProcessError.  Command string was: " + e.cmd, file=sys.stdout)
-                print("Error: CalledProcessError.  Command result was: " + self.__convert_process_output_to_ascii(e.output[:-1]), file=sys.stdout)
-            if no_output:
-                return e.return_code, None
-            else:
-                return e.return_code, self.__convert_process_output_to_ascii(e.output)
+            process = subprocess.Popen(cmd, stdout=(None if no_output is True else subprocess.PIPE), stderr=subprocess.STDOUT, shell=True, preexec_fn=(os.setsid if timeout is not None else None))
+            timer = self.__start_command_timer(process, timeout, timed_out) if timeout is not None else None
+            try:
+                output, unused_err = process.communicate()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            return_code = process.poll()
         except Exception as error:
-            message = "Exception during cmd execution. [Exception={0}][Cmd={1}]".format(repr(error),str(cmd))
+            message = "Exception during cmd execution. [Exception={0}][Cmd={1}]".format(repr(error), str(cmd))
             print(message)
-            raise message
+            raise Exception(message)
+
+        if return_code and len(timed_out) != 0:
+            return self.__get_timed_out_command_result(cmd, timeout, no_output, output)
+
+        if return_code and chk_err:
+            print("Error: CalledProcessError.  Error Code is: " + str(return_code), file=sys.stdout)
+            print("Error: CalledProcessError.  Command string was: " + cmd, file=sys.stdout)
+            if output is not None:
+                print("Error: CalledProcessError.  Command result was: " + self.__convert_process_output_to_ascii(output[:-1]), file=sys.stdout)
 
         if no_output:
-            return 0, None
+            return return_code, None
         else:
-            return 0, self.__convert_process_output_to_ascii(output)
+            return return_code, self.__convert_process_output_to_ascii(output)
+
+    @staticmethod
+    def __start_command_timer(process, timeout, timed_out):
+        """ Kills the process group of a command started in its own session once the timeout expires. This includes anything it started, e.g. dpkg under apt-get. """
+        def kill_process_group():
+            timed_out.append(True)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass    # already exited
+
+        timer = threading.Timer(max(timeout, 0), kill_process_group)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def __get_timed_out_command_result(self, cmd, timeout, no_output, output):
+        message = "Command timed out and was terminated. [Timeout={0}s][Cmd={1}]".format(str(int(timeout)), str(cmd))
+        print(message)
+        if self.command_timed_out_handler is not None:
+            self.command_timed_out_handler(cmd, timeout)
+        if no_output:
+            return Constants.EnvLayer.TIMED_OUT_COMMAND_CODE, None
+        return Constants.EnvLayer.TIMED_OUT_COMMAND_CODE, self.__decode_process_output(output or b'') + "\n" + message
+
+    @staticmethod
+    def __decode_process_output(raw_output):
+        """ Decodes raw process output to an ascii str on either python version, dropping trailing line breaks """
+        output = raw_output.decode('utf8', 'ignore').rstrip('\r\n')
+        if sys.version_info.major == 2:
+            return output.encode('ascii', 'ignore')
+        return output.encode('ascii', 'ignore').decode('ascii')
 
     @staticmethod
     def __convert_process_output_to_ascii(output):
         if sys.version_info.major == 2:
             return output.decode('utf8', 'ignore').encode("ascii", "ignore")
         elif sys.version_info.major == 3:
-            return output.encode("ascii", "ignore")
+            return output.decode('utf8', 'ignore').encode("ascii", "ignore").decode("ascii")
         else:
             raise Exception("Unknown version of python encountered.")
 
@@ -211,6 +346,66 @@ class EnvLayer(object):
             self.__read_record(operation)   # will throw if it's not the expected operation
             raise Exception(Constants.EnvLayer.PRIVILEGED_OP_EXIT + str(code))
 
+# region - Shell coprocess
+    class ShellCoprocess(object):
+        """ A long-lived shell that runs commands one at a time, each in a subshell, delimiting their output and exit codes with a sentinel.
+            This saves a process (and, when running as root, a sudo) start per command. It is restarted on demand after any failure. """
+        def __init__(self, shell_path='/bin/sh'):
+            self.shell_path = shell_path
+            self.process = None
+            self.sentinel = None
+            self.strip_sudo = hasattr(os, 'geteuid') and os.geteuid() == 0    # the shell already runs privileged
+            self.command_count = 0
+
+        def run_command(self, cmd, timeout=None):
+            """ Returns (code, raw output). The code is None if the command timed out, in which case the shell is killed along with it. """
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+
+            if self.strip_sudo and cmd.startswith('sudo '):
+                cmd = cmd[len('sudo '):]
+            # eval confines malformed commands to the subshell. stdin is redirected so that commands cannot consume the stream the shell reads from.
+            quoted_cmd = "'" + cmd.replace("'", "'\\''") + "'"
+            self.process.stdin.write(("( eval {0} ) < /dev/null 2>&1; printf '\\n%s %d\\n' '{1}' $?\n".format(quoted_cmd, self.sentinel)).encode('utf8'))
+            self.process.stdin.flush()
+            self.command_count += 1
+
+            marker = ('\n' + self.sentinel + ' ').encode('utf8')
+            deadline = time.time() + timeout if timeout is not None else None
+            output = b''
+            while True:
+                marker_index = output.find(marker)
+                if marker_index > -1 and output.endswith(b'\n'):
+                    return int(output[marker_index + len(marker):].strip()), output[:marker_index]
+
+                wait_time = max(deadline - time.time(), 0) if deadline is not None else None
+                if len(select.select([self.process.stdout], [], [], wait_time)[0]) == 0:
+                    self.stop()
+                    return None, output
+                data = os.read(self.process.stdout.fileno(), 65536)
+                if len(data) == 0:
+                    raise Exception("Shell coprocess exited unexpectedly.")
+                output += data
+
+        def start(self):
+            self.stop()
+            self.sentinel = "__SHELL_COPROCESS_" + str(uuid.uuid4()).replace('-', '') + "__"
+            self.process = subprocess.Popen([self.shell_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+
+        def stop(self):
+            """ Kills the shell along with anything still running in it """
+            if self.process is None:
+                return
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass    # already exited
+            self.process.wait()
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process = None
+# endregion - Shell coprocess
+
 # region - Platform emulation and extensions
     class Platform(object):
         def __init__(self, recorder_enabled=True, emulator_enabled=False, write_record_delegate=None, read_record_delegate=None):
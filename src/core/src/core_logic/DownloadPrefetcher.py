@@ -0,0 +1,65 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Downloads update payloads into the package manager's cache ahead of installation"""
+import time
+from core.src.bootstrap.Constants import Constants
+
+
+class DownloadPrefetcher(object):
+    """Fetches packages in chunks with download-only package manager invocations, stopping at the time or byte budget or when free disk space runs low"""
+
+    def __init__(self, composite_logger, telemetry_writer, package_manager):
+        self.composite_logger = composite_logger
+        self.telemetry_writer = telemetry_writer
+        self.package_manager = package_manager
+
+    def prefetch(self, packages, package_versions, time_budget_in_seconds, byte_budget=None):
+        """ Returns the packages whose payloads were fetched, the bytes added to the package cache and the time it took.
+            Download sizes are not known up front, so the byte budget can be overrun by at most one chunk. """
+        self.composite_logger.log("\nPrefetching package downloads... [Packages={0}][TimeBudget={1}s][ByteBudget={2}]".format(str(len(packages)), str(int(time_budget_in_seconds)), str(byte_budget)))
+        start_time = time.time()
+        initial_cache_size = self.package_manager.get_package_cache_size()
+        prefetched_packages = []
+
+        for index in range(0, len(packages), Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE):
+            remaining_time_in_seconds = time_budget_in_seconds - (time.time() - start_time)
+            if remaining_time_in_seconds <= 0:
+                self.composite_logger.log_debug(" - Stopped prefetching as its time budget is used up.")
+                break
+
+            if byte_budget is not None and self.package_manager.get_package_cache_size() - initial_cache_size >= byte_budget:
+                self.composite_logger.log_debug(" - Stopped prefetching as its byte budget is used up.")
+                break
+
+            free_space = self.package_manager.get_package_cache_free_space()
+            if free_space is not None and free_space < Constants.DOWNLOAD_PREFETCH_MIN_FREE_DISK_SPACE_IN_MB * 1024 * 1024:
+                self.composite_logger.log_debug(" - Stopped prefetching as free disk space is low. [FreeSpace={0}]".format(str(free_space)))
+                break
+
+            chunk_packages = packages[index:index + Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE]
+            code = self.package_manager.download_updates(chunk_packages, package_versions[index:index + Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE], remaining_time_in_seconds)
+            if code == 0:
+                prefetched_packages += chunk_packages
+
+        bytes_fetched = max(self.package_manager.get_package_cache_size() - initial_cache_size, 0)
+        duration = round(time.time() - start_time, 2)
+
+        prefetch_info = "Download prefetch completed. [Packages={0}][Prefetched={1}][BytesFetched={2}][Duration={3}s]".format(
+            str(len(packages)), str(len(prefetched_packages)), str(bytes_fetched), str(duration))
+        self.composite_logger.log(prefetch_info)
+        self.telemetry_writer.send_info(prefetch_info)
+        return prefetched_packages, bytes_fetched, duration
@@ -56,6 +56,7 @@ class ExecutionConfig(object):
             self.reboot_setting = self.config_settings[Constants.ConfigSettings.REBOOT_SETTING]     # expected to throw if not present
         else:
             self.reboot_setting = self.__get_execution_configuration_value_safely(self.config_settings, Constants.ConfigSettings.REBOOT_SETTING, Constants.REBOOT_NEVER)     # safe extension-level default
+        self.package_manager_settings = self.__get_package_manager_settings()
 
         # Derived Settings
         self.composite_logger.log_debug(" - Establishing data publishing paths...")
@@ -99,6 +100,29 @@ class ExecutionConfig(object):
                 self.composite_logger.log_debug('Warning: Config JSON did not contain ' + key + '. Using default value (' + str(default_value) + ') instead.')
                 return default_value
 
+    def __get_package_manager_settings(self):
+        """ Returns the opt-in package manager settings requested in internal settings (a json object), with any set in the LPE_PKG_MGR_SETTINGS environment variable taking precedence. Other keys are ignored. """
+        requested_settings = {}
+        for source, settings in (("internal settings", self.__get_execution_configuration_value_safely(self.config_settings, Constants.ConfigSettings.INTERNAL_SETTINGS, {})),
+                                 ("environment", os.getenv(Constants.LPE_PKG_MGR_SETTINGS_VARIABLE))):
+            if settings is None:
+                continue
+            try:
+                settings = json.loads(settings) if not isinstance(settings, dict) else settings
+                if not isinstance(settings, dict):
+                    raise ValueError("A json object is expected.")
+            except (TypeError, ValueError) as error:
+                self.composite_logger.log_debug(" - Ignoring package manager settings from {0}. [Settings={1}][Error={2}]".format(source, str(settings), repr(error)))
+                continue
+            requested_settings.update(settings)
+
+        package_manager_settings = {}
+        for setting_key, setting_value in requested_settings.items():
+            if setting_key in Constants.CONFIGURABLE_PKG_MGR_SETTINGS:
+                package_manager_settings[setting_key] = setting_value
+        self.composite_logger.log_debug(" - Package manager settings: " + str(package_manager_settings))
+        return package_manager_settings
+
     def __convert_iso8601_duration_to_timedelta_str(self, duration):
         """
             Supports only a subset of the spec as applicable to patch management.
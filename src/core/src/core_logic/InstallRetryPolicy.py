@@ -0,0 +1,73 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Retry policy for package installation attempts"""
+import time
+from core.src.bootstrap.Constants import Constants
+
+
+class InstallRetryPolicy(object):
+    """Retries failed package installations that may succeed on another attempt, with a bounded backoff that stays within the maintenance window"""
+
+    def __init__(self, composite_logger, maintenance_window, max_attempts=Constants.MAX_INSTALLATION_RETRY_COUNT):
+        self.composite_logger = composite_logger
+        self.maintenance_window = maintenance_window
+        self.max_attempts = max_attempts
+
+        # install_update_and_dependencies code path markers of failures that another attempt will not fix
+        self.terminal_code_path_markers = [" > Timed out",                         # would only use up more of the maintenance window
+                                           "(no operation; return 'not started')",  # needs an older version installed first, by another package
+                                           "but return code: 0. (failed)"]          # the package manager does not consider this a failure
+
+    def install_with_retries(self, install_delegate, code_path_delegate):
+        """ Calls install_delegate (returns an install result) until it succeeds, fails terminally or runs out of attempts or time.
+            Returns the last install result and the (result, duration) of every attempt. """
+        attempts = []
+        while True:
+            start_time = time.time()
+            install_result = install_delegate()
+            attempts.append((install_result, round(time.time() - start_time, 2)))
+
+            if not self.is_retry_required(install_result, code_path_delegate(), len(attempts)):
+                return install_result, attempts
+
+            retry_delay = self.get_retry_delay_in_seconds(len(attempts))
+            self.composite_logger.log_warning("Retrying installation of package in " + str(retry_delay) + " seconds. [Attempt={0}]".format(str(len(attempts) + 1)))
+            time.sleep(retry_delay)
+
+    def is_retry_required(self, install_result, code_path, attempt_count):
+        if install_result == Constants.INSTALLED:
+            return False
+
+        if not self.is_retryable(code_path):
+            self.composite_logger.log_debug(" - Installation failure is not retryable. [CodePath={0}]".format(str(code_path)))
+            return False
+
+        if attempt_count >= self.max_attempts:
+            return False
+
+        remaining_time_after_delay = self.maintenance_window.get_remaining_time_in_minutes() - self.get_retry_delay_in_seconds(attempt_count) / 60.0
+        if not self.maintenance_window.is_package_install_time_available(remaining_time_after_delay):
+            self.composite_logger.log_debug(" - Not retrying installation as there is not enough time left in the maintenance window.")
+            return False
+        return True
+
+    def is_retryable(self, code_path):
+        return not any(marker in str(code_path) for marker in self.terminal_code_path_markers)
+
+    @staticmethod
+    def get_retry_delay_in_seconds(attempt_count):
+        return min(Constants.INSTALLATION_RETRY_BASE_DELAY_IN_SECONDS * (2 ** (attempt_count - 1)), Constants.INSTALLATION_RETRY_MAX_DELAY_IN_SECONDS)
@@ -31,7 +31,7 @@ class MaintenanceWindow(object):
         self.env_layer = env_layer
         self.status_handler = status_handler
 
-    def get_remaining_time_in_minutes(self, current_time=None, log_to_stdout=False):
+    def get_remaining_time_in_minutes(self, current_time=None, log_to_stdout=False, log_utilization=True):
         """Calculate time remaining base on the given job start time"""
         try:
             if current_time is None:
@@ -45,9 +45,9 @@ class MaintenanceWindow(object):
 
             log_line = "Maintenance Window Utilization: " + str(timedelta(seconds=int(elapsed_time_in_minutes*60))) + " / " + self.duration + "\
                         [Job start: " + str(start_time) + ", Current time: " + str(current_time.strftime("%Y-%m-%d %H:%M:%S")) + "]"
-            if log_to_stdout:
+            if log_utilization and log_to_stdout:
                 self.composite_logger.log(log_line)
-            else:
+            elif log_utilization:
                 self.composite_logger.log_debug(log_line)
         except ValueError as error:
             error_msg = "Error calculating time remaining. Check patch operation input parameters."
@@ -59,9 +59,18 @@ class MaintenanceWindow(object):
 
         return remaining_time_in_minutes
 
+    def get_command_timeout_in_seconds(self, package_count=1):
+        """Default timeout for commands: whatever remains of the window ahead of the reboot buffer, bounded so that one hung command cannot consume it all.
+           Commands that install several packages at once get a bound that scales with the package count. The reboot buffer can be used for one install's expected duration,
+           but never beyond the end of the window (or a minimum that lets the last read-only queries of an overrun window complete)."""
+        remaining_time_in_minutes = self.get_remaining_time_in_minutes(log_utilization=False)
+        timeout_in_minutes = min(max(remaining_time_in_minutes - Constants.REBOOT_BUFFER_IN_MINUTES, Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES), Constants.MAX_COMMAND_TIMEOUT_IN_MINUTES * package_count)
+        timeout_in_minutes = max(min(timeout_in_minutes, remaining_time_in_minutes), Constants.MIN_COMMAND_TIMEOUT_IN_MINUTES)
+        return int(timeout_in_minutes * 60)
+
     def is_package_install_time_available(self, remaining_time_in_minutes=None):
         """Check if time still available for package installation"""
-        cutoff_time_in_minutes = Constants.REBOOT_BUFFER_IN_MINUTES + Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES
+        cutoff_time_in_minutes = self.get_package_install_cutoff_time_in_minutes()
         if remaining_time_in_minutes is None:
             remaining_time_in_minutes = self.get_remaining_time_in_minutes()
 
@@ -71,3 +80,8 @@ class MaintenanceWindow(object):
         else:
             self.composite_logger.log_warning("Time Remaining: " + str(timedelta(seconds=int(remaining_time_in_minutes * 60))) + ", Cutoff time: " + str(timedelta(minutes=cutoff_time_in_minutes)) + " [Out of time!]")
             return False
+
+    @staticmethod
+    def get_package_install_cutoff_time_in_minutes():
+        """Remaining time below which no further package install is started: one install's expected duration ahead of the reboot buffer"""
+        return Constants.REBOOT_BUFFER_IN_MINUTES + Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES
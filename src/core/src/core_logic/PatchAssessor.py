@@ -15,8 +15,11 @@
 # Requires Python 2.7+
 
 """ A patch assessment """
+import json
+import os
 import time
 from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.DownloadPrefetcher import DownloadPrefetcher
 
 
 class PatchAssessor(object):
@@ -30,6 +33,7 @@ class PatchAssessor(object):
         self.status_handler = status_handler
 
         self.package_manager = package_manager
+        self.assessment_snapshot_path = os.path.join(self.execution_config.config_folder, Constants.ASSESSMENT_SNAPSHOT_FILE)
 
     def start_assessment(self):
         """ Start an update assessment """
@@ -45,18 +49,41 @@ class PatchAssessor(object):
         self.package_manager.refresh_repo()
         self.status_handler.reset_assessment_data()
 
+        # assessment snapshot (opt-in): an unchanged package state since the last assessment gets the same result without rediscovery
+        is_snapshot_enabled = self.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_ASSESSMENT_SNAPSHOT, False)
+        snapshot = self.report_assessment_snapshot() if is_snapshot_enabled else None
+        if snapshot is None:
+            packages, package_versions = self.assess_available_updates(is_snapshot_enabled)
+        else:
+            packages, package_versions = snapshot['packages'], snapshot['packageVersions']
+
+        # download pre-staging (opt-in): warms the package cache so that a later installation does not spend its maintenance window on downloads
+        if self.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_PRESTAGE_DOWNLOADS, False) and self.execution_config.operation.lower() == Constants.ASSESSMENT.lower():
+            self.prestage_downloads(packages, package_versions)
+
+        self.composite_logger.log("\nPatch assessment completed.\n")
+        return True
+
+    def assess_available_updates(self, is_snapshot_enabled):
+        """ Discovers and reports all and security updates, retrying on failure. Raises once the retries are exhausted. """
         for i in range(0, Constants.MAX_ASSESSMENT_RETRY_COUNT):
             try:
+                self.package_manager.prefetch_discovery_outputs()
                 packages, package_versions = self.package_manager.get_all_updates()
                 self.telemetry_writer.send_debug_info("Full assessment: " + str(packages))
                 self.status_handler.set_package_assessment_status(packages, package_versions)
                 sec_packages, sec_package_versions = self.package_manager.get_security_updates()
                 self.telemetry_writer.send_debug_info("Security assessment: " + str(sec_packages))
                 self.status_handler.set_package_assessment_status(sec_packages, sec_package_versions, "Security")
+                if is_snapshot_enabled:
+                    self.save_assessment_snapshot(packages, package_versions, sec_packages, sec_package_versions)
+                    self.status_handler.set_assessment_snapshot(False, 0)
                 self.status_handler.set_assessment_substatus_json(status=Constants.STATUS_SUCCESS)
-                break
+                self.package_manager.discard_prefetched_outputs()
+                return packages, package_versions
             except Exception as error:
-                if i < Constants.MAX_ASSESSMENT_RETRY_COUNT:
+                self.package_manager.discard_prefetched_outputs()
+                if i < Constants.MAX_ASSESSMENT_RETRY_COUNT - 1:
                     error_msg = 'Retryable error retrieving available patches: ' + repr(error)
                     self.composite_logger.log_warning(error_msg)
                     self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.DEFAULT_ERROR)
@@ -70,5 +97,72 @@ class PatchAssessor(object):
                     self.status_handler.set_assessment_substatus_json(status=Constants.STATUS_ERROR)
                     raise
 
-        self.composite_logger.log("\nPatch assessment completed.\n")
-        return True
+    # region - Assessment snapshot
+    def report_assessment_snapshot(self):
+        """ Reports the persisted result of an earlier assessment if the package state has not changed since. Returns the reported snapshot, or None if there is no usable snapshot. """
+        snapshot = self.load_assessment_snapshot()
+        if snapshot is None:
+            return None
+
+        age_in_seconds = int(time.time() - snapshot['timestamp'])
+        self.composite_logger.log("Reusing the result of an earlier assessment as the package state is unchanged. [SnapshotAge={0}s]".format(str(age_in_seconds)))
+        self.telemetry_writer.send_debug_info("Assessment snapshot reused. [SnapshotAge={0}s]".format(str(age_in_seconds)))
+        self.status_handler.set_package_assessment_status(snapshot['packages'], snapshot['packageVersions'])
+        self.status_handler.set_package_assessment_status(snapshot['securityPackages'], snapshot['securityPackageVersions'], "Security")
+        self.status_handler.set_assessment_snapshot(True, age_in_seconds)
+        self.status_handler.set_assessment_substatus_json(status=Constants.STATUS_SUCCESS)
+        return snapshot
+
+    def load_assessment_snapshot(self):
+        """ Returns the persisted snapshot if it matches the current package state fingerprint and is not too old, or None """
+        fingerprint = self.get_package_state_fingerprint()
+        if fingerprint is None or not os.path.exists(self.assessment_snapshot_path):
+            return None
+
+        try:
+            snapshot = json.loads(self.env_layer.file_system.read_with_retry(self.assessment_snapshot_path))
+            age_in_seconds = time.time() - snapshot['timestamp']
+            if snapshot['fingerprint'] != fingerprint or not 0 <= age_in_seconds <= Constants.MAX_ASSESSMENT_SNAPSHOT_AGE_IN_HOURS * 3600:
+                self.composite_logger.log_debug("Assessment snapshot is out of date. [SnapshotAge={0}s]".format(str(int(age_in_seconds))))
+                return None
+            return snapshot
+        except Exception as error:
+            self.composite_logger.log_debug("Unable to load assessment snapshot. [Error={0}]".format(repr(error)))
+            return None
+
+    def save_assessment_snapshot(self, packages, package_versions, sec_packages, sec_package_versions):
+        fingerprint = self.get_package_state_fingerprint()
+        if fingerprint is None:
+            return
+
+        snapshot = {
+            "fingerprint": fingerprint,
+            "timestamp": time.time(),
+            "packages": packages,
+            "packageVersions": package_versions,
+            "securityPackages": sec_packages,
+            "securityPackageVersions": sec_package_versions
+        }
+        try:
+            self.env_layer.file_system.write_with_retry_using_temp_file(self.assessment_snapshot_path, json.dumps(snapshot), mode='w+')
+        except Exception as error:
+            self.composite_logger.log_debug("Unable to save assessment snapshot. [Error={0}]".format(repr(error)))
+
+    def get_package_state_fingerprint(self):
+        """ Returns the package state fingerprint in its persisted form (tuples become lists), or None if the package state cannot be fingerprinted """
+        if self.package_manager.assessment_result_cache is None:
+            return None
+        fingerprint = self.package_manager.assessment_result_cache.get_fingerprint()
+        return json.loads(json.dumps(fingerprint)) if fingerprint is not None else None
+    # endregion
+
+    def prestage_downloads(self, packages, package_versions):
+        """ Pre-stages the payloads of assessed updates into the package manager's cache, within byte and time budgets. Failures do not fail the assessment. """
+        try:
+            prefetcher = DownloadPrefetcher(self.composite_logger, self.telemetry_writer, self.package_manager)
+            prestaged_packages, bytes_fetched, duration = prefetcher.prefetch(packages, package_versions, Constants.PRESTAGE_DOWNLOADS_MAX_TIME_IN_MINUTES * 60,
+                                                                              Constants.PRESTAGE_DOWNLOADS_MAX_SIZE_IN_MB * 1024 * 1024)
+            self.status_handler.set_prestaged_downloads(len(prestaged_packages), bytes_fetched)
+            self.status_handler.set_assessment_substatus_json(status=Constants.STATUS_SUCCESS)
+        except Exception as error:
+            self.composite_logger.log_warning("Unable to pre-stage downloads: " + repr(error))
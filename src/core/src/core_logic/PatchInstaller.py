@@ -19,6 +19,9 @@ import datetime
 import os
 import time
 from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.DownloadPrefetcher import DownloadPrefetcher
+from core.src.core_logic.InstallRetryPolicy import InstallRetryPolicy
+from core.src.package_managers.PackageSet import PackageSet
 
 
 class PatchInstaller(object):
@@ -36,9 +39,11 @@ class PatchInstaller(object):
         self.package_filter = package_filter
         self.maintenance_window = maintenance_window
         self.reboot_manager = reboot_manager
+        self.install_retry_policy = InstallRetryPolicy(composite_logger, maintenance_window)
 
         self.last_still_needed_packages = None  # Used for 'Installed' status records
         self.last_still_needed_package_versions = None
+        self.reconciliation_baseline = None  # installed package versions as of the last reconciliation; None if reconciliation is not incremental
         self.progress_template = "[Time available: {0} | A: {1}, S: {2}, F: {3} | D: {4}]\t {5}"
 
         # Constants
@@ -68,21 +73,26 @@ class PatchInstaller(object):
                 self.composite_logger.log_debug("Attempting to reboot the machine prior to patch installation as there is a reboot pending...")
                 reboot_manager.start_reboot_if_required_and_time_available(maintenance_window.get_remaining_time_in_minutes(None, False))
 
-        # Install Updates
-        installed_update_count, update_run_successful, maintenance_window_exceeded = self.install_updates(maintenance_window, package_manager, simulate)
-
-        # Repeat patch installation if flagged as required and time is available
-        if not maintenance_window_exceeded and package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False):
-            self.composite_logger.log("\nInstalled update count (first round): " + str(installed_update_count))
-            self.composite_logger.log("\nPatch installation run will be repeated as the package manager recommended it --------------------------------------------->")
-            package_manager.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False)  # Resetting
-            new_installed_update_count, update_run_successful, maintenance_window_exceeded = self.install_updates(maintenance_window, package_manager, simulate)
-            installed_update_count += new_installed_update_count
-
-            if package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False):  # We should not see this again
-                error_msg = "Unexpected repeated package manager update occurred. Please re-run the update deployment."
-                self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
-                raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
+        # Bound every command of the install phase by the maintenance window, so that a hung package manager cannot stall the run past it
+        self.env_layer.set_command_timeout_provider(maintenance_window.get_command_timeout_in_seconds, self.report_command_timeout)
+        try:
+            # Install Updates
+            installed_update_count, update_run_successful, maintenance_window_exceeded = self.install_updates(maintenance_window, package_manager, simulate)
+
+            # Repeat patch installation if flagged as required and time is available
+            if not maintenance_window_exceeded and package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False):
+                self.composite_logger.log("\nInstalled update count (first round): " + str(installed_update_count))
+                self.composite_logger.log("\nPatch installation run will be repeated as the package manager recommended it --------------------------------------------->")
+                package_manager.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False)  # Resetting
+                new_installed_update_count, update_run_successful, maintenance_window_exceeded = self.install_updates(maintenance_window, package_manager, simulate)
+                installed_update_count += new_installed_update_count
+
+                if package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False):  # We should not see this again
+                    error_msg = "Unexpected repeated package manager update occurred. Please re-run the update deployment."
+                    self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
+                    raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
+        finally:
+            self.env_layer.set_command_timeout_provider(None)
 
         self.composite_logger.log("\nInstalled update count: " + str(installed_update_count) + " (including dependencies)")
 
@@ -116,7 +126,7 @@ class PatchInstaller(object):
     def install_updates(self, maintenance_window, package_manager, simulate=False):
         """wrapper function of installing updates"""
         self.composite_logger.log("\n\nGetting available updates...")
-        package_manager.refresh_repo()
+        package_manager.refresh_repo(security_only=self.package_filter.is_msft_critsec_classification_only() and not self.package_filter.is_inclusion_list_present())
 
         packages, package_versions = package_manager.get_available_updates(self.package_filter)  # Initial, ignoring exclusions
         self.telemetry_writer.send_debug_info("Initial package list: " + str(packages))
@@ -153,8 +163,32 @@ class PatchInstaller(object):
         self.telemetry_writer.send_debug_info("All available packages list: " + str(all_packages))
         self.last_still_needed_packages = all_packages
         self.last_still_needed_package_versions = all_package_versions
+        self.reconciliation_baseline = package_manager.installed_package_snapshot.get_installed_packages() if package_manager.installed_package_snapshot is not None and not simulate else None
+        update_set = PackageSet(packages, package_versions)  # version and multilib lookups in the install loop
+
+        # download prefetch (opt-in): payloads are fetched in bulk up front, so that installations work from the local cache
+        is_prefetch_enabled = package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH, False) and not simulate
+        if is_prefetch_enabled:
+            prefetched_packages, download_duration = self.prefetch_downloads(maintenance_window, package_manager, packages, package_versions)
+        install_start_time = time.time()
+
+        # batch installation (opt-in): packages installed in transactions are accounted for here, and the rest are installed one by one below
+        batch_installed_packages = set()
+        if package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_BATCH_INSTALLATION, False):
+            batch_installed_packages = set(self.install_updates_in_batches(maintenance_window, package_manager, packages, package_versions, simulate))
+            for package in batch_installed_packages:
+                attempted_parent_update_count += 1
+                successful_parent_update_count += 1
+                if package in self.last_still_needed_packages:
+                    index = self.last_still_needed_packages.index(package)
+                    self.last_still_needed_packages.pop(index)
+                    self.last_still_needed_package_versions.pop(index)
+                    installed_update_count += 1
 
         for package, version in zip(packages, package_versions):
+            if package in batch_installed_packages:
+                continue
+
             # Extension state check
             if self.lifecycle_manager is not None:
                 self.lifecycle_manager.lifecycle_status_check()     # may terminate the code abruptly, as designed
@@ -178,32 +212,28 @@ class PatchInstaller(object):
             # include all dependencies (with specified versions) explicitly
             package_and_dependencies = [package]
             package_and_dependency_versions = [version]
-            dependencies = package_manager.get_dependent_list(package)
+            dependencies = package_manager.resolve_dependency_graph([package])[package]   # resolved just in time, as installs change what is needed; reused if already resolved since the last install
             for dependency in dependencies:
                 if dependency not in all_packages:
                     continue
                 package_and_dependencies.append(dependency)
-                package_and_dependency_versions.append(package_versions[packages.index(dependency)] if dependency in packages else Constants.DEFAULT_UNSPECIFIED_VALUE)
+                package_and_dependency_versions.append(update_set.get_version(dependency, Constants.DEFAULT_UNSPECIFIED_VALUE))
 
             # multilib resolution for yum
             if package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY) == Constants.YUM:
-                package_name_without_arch = package_manager.get_product_name_without_arch(package)
-                for possible_arch_dependency, possible_arch_dependency_version in zip(packages, package_versions):
-                    if package_manager.get_product_name_without_arch(possible_arch_dependency) == package_name_without_arch and possible_arch_dependency not in package_and_dependencies:
+                for possible_arch_dependency in update_set.get_packages_with_base_name(PackageSet.get_base_name(package)):
+                    if possible_arch_dependency not in package_and_dependencies:
                         package_and_dependencies.append(possible_arch_dependency)
-                        package_and_dependency_versions.append(possible_arch_dependency_version)
+                        package_and_dependency_versions.append(update_set.get_version(possible_arch_dependency))
 
             # remove duplicates
             package_and_dependencies, package_and_dependency_versions = package_manager.dedupe_update_packages(package_and_dependencies, package_and_dependency_versions)
 
             # parent package install (+ dependencies) and parent package result management
-            install_result = Constants.FAILED
-            for i in range(0, Constants.MAX_INSTALLATION_RETRY_COUNT):
-                install_result = package_manager.install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate)
-                if install_result != Constants.INSTALLED:
-                    if i <= Constants.MAX_INSTALLATION_RETRY_COUNT:
-                        time.sleep(i + 1)
-                        self.composite_logger.log_warning("Retrying installation of package. [Package={0}]".format(package_manager.get_product_name(package_and_dependencies[0])))
+            self.status_handler.flush_status_file()     # status updates deferred by the status file writer should not wait on a long-running install
+            install_result, install_attempts = self.install_retry_policy.install_with_retries(lambda: package_manager.install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate),
+                                                                                              lambda: package_manager.last_install_code_path)
+            self.report_install_attempts(package_manager.get_product_name(str(package_and_dependencies[0])), str(package_and_dependency_versions[0]), install_result, install_attempts)
 
             # Update reboot pending status in status_handler
             self.status_handler.set_reboot_pending(self.is_reboot_pending())
@@ -248,6 +278,13 @@ class PatchInstaller(object):
         self.composite_logger.log(progress_status)
         self.telemetry_writer.send_info(progress_status)
 
+        if is_prefetch_enabled:
+            # the time spent downloading up front next to the time installations took after it, so that the saving can be checked against installs without prefetch
+            prefetch_info = "Download prefetch and installation durations: [Packages={0}][Prefetched={1}][DownloadDuration={2}s][InstallDuration={3}s]".format(
+                str(len(packages)), str(len(prefetched_packages)), str(download_duration), str(round(time.time() - install_start_time, 2)))
+            self.composite_logger.log(prefetch_info)
+            self.telemetry_writer.send_info(prefetch_info)
+
         self.composite_logger.log_debug("\nPerforming final system state reconciliation...")
         installed_update_count += self.perform_status_reconciliation_conditionally(package_manager, True)  # final reconciliation
 
@@ -260,6 +297,71 @@ class PatchInstaller(object):
 
         return installed_update_count, patch_installation_successful, maintenance_window_exceeded
 
+    def prefetch_downloads(self, maintenance_window, package_manager, packages, package_versions):
+        """ Prefetches package downloads, stopping where the maintenance window would no longer allow a package install. Returns the prefetched packages and the time it took. """
+        time_budget_in_seconds = (maintenance_window.get_remaining_time_in_minutes() - maintenance_window.get_package_install_cutoff_time_in_minutes()) * 60
+        if time_budget_in_seconds <= 0:
+            self.composite_logger.log_debug("Skipping download prefetch as there is no time for it in the maintenance window.")
+            return [], 0
+
+        self.status_handler.flush_status_file()
+        prefetched_packages, bytes_fetched, duration = DownloadPrefetcher(self.composite_logger, self.telemetry_writer, package_manager).prefetch(packages, package_versions, time_budget_in_seconds)
+        return prefetched_packages, duration
+
+    def install_updates_in_batches(self, maintenance_window, package_manager, packages, package_versions, simulate=False):
+        """ Installs packages in transactions of up to INSTALLATION_BATCH_SIZE packages. Packages a transaction did not install are bisected into
+            smaller transactions to isolate the failing ones, which are left to be installed (and diagnosed) individually. Returns the installed packages. """
+        self.composite_logger.log("\nInstalling patches in batches of up to " + str(Constants.INSTALLATION_BATCH_SIZE) + " packages...")
+        installed_packages = []
+        package_and_versions = list(zip(packages, package_versions))
+        pending_batches = [package_and_versions[index:index + Constants.INSTALLATION_BATCH_SIZE] for index in range(0, len(package_and_versions), Constants.INSTALLATION_BATCH_SIZE)]
+
+        while len(pending_batches) != 0:
+            batch = pending_batches.pop(0)
+            if len(batch) < 2:
+                continue    # isolated
+
+            if self.lifecycle_manager is not None:
+                self.lifecycle_manager.lifecycle_status_check()     # may terminate the code abruptly, as designed
+            if maintenance_window.is_package_install_time_available(maintenance_window.get_remaining_time_in_minutes()) is False:
+                break   # reported by the individual installation that follows
+
+            batch_packages = [package for package, version in batch]
+            batch_package_versions = [version for package, version in batch]
+            start_time = time.time()
+            self.status_handler.flush_status_file()     # status updates deferred by the status file writer should not wait on a long-running install
+            code = package_manager.install_updates_in_transaction(batch_packages, batch_package_versions, simulate, maintenance_window.get_command_timeout_in_seconds(len(batch)))
+
+            not_installed = []
+            for package, version in batch:
+                if package_manager.is_package_version_installed(package, version):
+                    self.status_handler.set_package_install_status(package_manager.get_product_name(str(package)), str(version), Constants.INSTALLED)
+                    installed_packages.append(package)
+                else:
+                    not_installed.append((package, version))
+
+            batch_info = "Batch installation: [Packages={0}][Installed={1}][Code={2}][Duration={3}s]".format(str(len(batch)), str(len(batch) - len(not_installed)), str(code), str(round(time.time() - start_time, 2)))
+            self.composite_logger.log(batch_info)
+            self.telemetry_writer.send_debug_info(batch_info)
+
+            if len(not_installed) != 0 and not simulate:     # a simulation installs nothing, so there is nothing to isolate
+                split_index = (len(not_installed) + 1) // 2
+                pending_batches[0:0] = [not_installed[:split_index], not_installed[split_index:]]
+
+        return installed_packages
+
+    def report_install_attempts(self, package, version, install_result, install_attempts):
+        """ Reports how many attempts installing a package took, and how long each one ran """
+        attempts_info = "Package installation attempts: [Package={0}][Version={1}][Result={2}][Attempts={3}][Durations={4}]".format(
+            package, version, str(install_result), str(len(install_attempts)), ", ".join(str(duration) + "s" for result, duration in install_attempts))
+        self.composite_logger.log_debug(" - " + attempts_info)
+        self.telemetry_writer.send_debug_info(attempts_info)
+
+    def report_command_timeout(self, cmd, timeout):
+        """ Called by the env layer when a command is killed for running past its timeout """
+        self.composite_logger.log_warning("Command was terminated as it ran past its timeout of " + str(datetime.timedelta(seconds=int(timeout))) + ". [Command={0}]".format(str(cmd)))
+        self.telemetry_writer.send_execution_error(cmd, Constants.EnvLayer.TIMED_OUT_COMMAND_CODE, "Command timed out. [Timeout={0}s]".format(str(int(timeout))))
+
     def is_reboot_pending(self):
         """ Checks if there is a pending reboot on the machine. """
         try:
@@ -276,7 +378,14 @@ class PatchInstaller(object):
         """Periodically based on the condition check, writes out success records as required; returns count of detected installs.
            This is mostly to capture the dependencies that get silently installed recorded.
            VERY IMPORTANT NOTE: THIS ONLY WORKS IF EACH DEPENDENCY INSTALLED WAS THE VERY LATEST VERSION AVAILABLE.
-           So it's only here as a fall back method and shouldn't normally be required with newer code - it will be removed in the future."""
+           So it's only here as a fall back method and shouldn't normally be required with newer code - it will be removed in the future.
+           With an installed package snapshot, reconciliation is incremental and cheap enough to run regardless of the condition."""
+        if self.reconciliation_baseline is not None:
+            installed_packages = package_manager.installed_package_snapshot.get_installed_packages()
+            if installed_packages is not None:
+                return self.perform_incremental_status_reconciliation(package_manager, installed_packages)
+            self.reconciliation_baseline = None
+
         if not condition:
             return 0
 
@@ -295,6 +404,28 @@ class PatchInstaller(object):
         self.last_still_needed_package_versions = still_needed_package_versions
         self.composite_logger.log_debug("Completed status reconciliation. Time taken: " + str(time.time() - start_time) + " seconds.")
         return len(successful_packages)
+
+    def perform_incremental_status_reconciliation(self, package_manager, installed_packages):
+        """Marks still needed packages as installed if their version was installed since the last reconciliation, going by installed package snapshot deltas instead of a full re-simulation"""
+        self.composite_logger.log_debug("\nStarting incremental status reconciliation...")
+        start_time = time.time()
+        changes = package_manager.installed_package_snapshot.get_changes(self.reconciliation_baseline, installed_packages)
+        successful_packages = []
+        successful_package_versions = []
+        for package, version in zip(self.last_still_needed_packages, self.last_still_needed_package_versions):
+            if package_manager.installed_package_snapshot.normalize_version(version) in changes.get(package, ()):
+                successful_packages.append(package)
+                successful_package_versions.append(version)
+
+        for package in successful_packages:
+            index = self.last_still_needed_packages.index(package)
+            self.last_still_needed_packages.pop(index)
+            self.last_still_needed_package_versions.pop(index)
+
+        self.status_handler.set_package_install_status(successful_packages, successful_package_versions, Constants.INSTALLED)
+        self.reconciliation_baseline = installed_packages   # snapshots are replaced on refresh, never modified
+        self.composite_logger.log_debug("Completed incremental status reconciliation. [Installed={0}][Duration={1}s]".format(str(len(successful_packages)), str(round(time.time() - start_time, 2))))
+        return len(successful_packages)
     # endregion
 
     # region Package List Manipulation @ Update Run level
@@ -302,12 +433,7 @@ class PatchInstaller(object):
         """Returns the list of updates not included given any list of packages that will be included"""
         self.composite_logger.log_debug("\nEvaluating for 'not included' packages...")
         all_packages, all_package_versions = package_manager.get_all_updates(True)  # cached is fine
-        not_included_packages = []
-        not_included_package_versions = []
-        for i in range(0, len(all_packages)):
-            if all_packages[i] not in included_packages:
-                not_included_packages.append(all_packages[i])
-                not_included_package_versions.append(all_package_versions[i])
+        not_included_packages, not_included_package_versions = PackageSet(all_packages, all_package_versions).difference(included_packages).to_lists()
 
         self.composite_logger.log_debug(str(len(not_included_packages)) + " out of " + str(len(all_packages)) + " packages will be 'not included'.")
         return not_included_packages, not_included_package_versions
@@ -321,13 +447,22 @@ class PatchInstaller(object):
         if not self.package_filter.is_exclusion_list_present():
             return excluded_packages, excluded_package_versions
 
+        # directly excluded packages are left out of dependency resolution, so any dependency on them shows up in the graph.
+        # a single simulation of all the candidates tells if any of them depends on an excluded package before resolving them individually.
+        candidate_packages = [package for package in packages if not self.package_filter.check_for_exclusion(package)]
+        if len(candidate_packages) != 0 and not self.package_filter.check_for_exclusion(package_manager.get_dependent_list(candidate_packages)):
+            self.composite_logger.log_debug(" - No candidate package depends on an excluded package.")
+            dependency_graph = dict((package, []) for package in candidate_packages)
+        else:
+            dependency_graph = package_manager.resolve_dependency_graph(candidate_packages)
+
         for package, package_version in zip(packages, package_versions):
-            if self.package_filter.check_for_exclusion(package):
+            if package not in dependency_graph:
                 excluded_packages.append(package)  # package is excluded, no need to check for dependency exclusion
                 excluded_package_versions.append(package_version)
                 continue
 
-            dependency_list = package_manager.get_dependent_list(package)
+            dependency_list = dependency_graph[package]
             if dependency_list and self.package_filter.check_for_exclusion(dependency_list):
                 self.composite_logger.log_debug(" - Exclusion list match on dependency list for package '{0}': {1}".format(str(package), str(dependency_list)))
                 excluded_packages.append(package)  # one of the package's dependencies are excluded, so exclude the package
@@ -339,15 +474,11 @@ class PatchInstaller(object):
     def filter_out_excluded_updates(self, included_packages, included_package_versions, excluded_packages):
         """Returns list of included packages with all the excluded packages removed"""
         self.composite_logger.log_debug("\nFiltering out 'excluded' packages from included packages...")
-        new_included_packages = []
-        new_included_package_versions = []
-
-        for package, version in zip(included_packages, included_package_versions):
-            if package not in excluded_packages:
-                new_included_packages.append(package)
-                new_included_package_versions.append(version)
-            else:
+        included_package_set = PackageSet(included_packages, included_package_versions)
+        for package in excluded_packages:
+            if package in included_package_set:
                 self.composite_logger.log_debug(" - Package '" + str(package) + "' is being filtered out.")
+        new_included_packages, new_included_package_versions = included_package_set.difference(excluded_packages).to_lists()
 
         self.composite_logger.log_debug(str(len(new_included_packages)) + " out of " + str(len(included_packages)) + " packages will remain included in the run.")
         return new_included_packages, new_included_package_versions
@@ -0,0 +1,336 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Reads the dpkg database and the apt package lists directly to assess available updates without invoking apt"""
+import glob
+import os
+import re
+
+
+class AptPackageIndex(object):
+    """Native apt assessment engine: installed packages from the dpkg status file, candidates from the apt list files.
+       Package states that need apt's own policy or resolver to assess (pinning, phased updates, compressed lists, virtual dependencies) raise, so that apt is invoked instead."""
+
+    def __init__(self, env_layer, composite_logger, dpkg_status_path='/var/lib/dpkg/status', apt_lists_path='/var/lib/apt/lists', apt_preferences_paths=('/etc/apt/preferences', '/etc/apt/preferences.d')):
+        self.env_layer = env_layer
+        self.composite_logger = composite_logger
+        self.dpkg_status_path = dpkg_status_path
+        self.apt_lists_path = apt_lists_path
+        self.apt_preferences_paths = apt_preferences_paths
+        self.installed_names = set()    # names and provided names of all installed packages, as of the last get_installed_packages
+
+        self.relation_field_names = ('Pre-Depends', 'Depends', 'Recommends')    # apt installs recommended packages by default
+        self.list_field_names = ('Package', 'Version', 'Architecture', 'Provides', 'Phased-Update-Percentage') + self.relation_field_names
+        self.compressed_list_extensions = ('.lz4', '.gz', '.xz', '.bz2', '.zst')
+
+    # region Assessment
+    def get_upgradable_packages(self):
+        """ Returns packages, versions and origins of the newest candidate of every installed package and of every package those candidates newly need,
+            matching the shape of a dist-upgrade simulation parse """
+        self.check_package_state_is_supported()
+        installed_packages, native_architecture = self.get_installed_packages()
+        candidates = self.get_candidate_versions(installed_packages)
+        candidates.update(self.get_new_dependencies(candidates, installed_packages, native_architecture))
+        self.check_phasing(candidates)
+
+        packages = []
+        versions = []
+        origins = []
+        for key in sorted(candidates.keys()):
+            package_name, architecture = key
+            candidate_version, candidate_origins, candidate_stanza = candidates[key]
+            is_foreign_architecture = native_architecture is not None and architecture not in (native_architecture, 'all')
+            packages.append(package_name + ':' + architecture if is_foreign_architecture else package_name)
+            versions.append(candidate_version)
+            origins.append(', '.join(candidate_origins))
+
+        self.composite_logger.log_debug(" - Native apt assessment found " + str(len(packages)) + " upgradable packages.")
+        return packages, versions, origins
+
+    def get_installed_packages(self):
+        """ Returns (name, architecture) -> installed stanza for packages that can be upgraded (held packages are excluded, as dist-upgrade keeps them back), and the native architecture.
+            Held packages still satisfy dependencies, so they are kept in installed_names. """
+        installed_packages = {}
+        native_architecture = None
+        self.installed_names = set()
+        for stanza in self.read_control_stanzas(self.dpkg_status_path, ('Package', 'Status', 'Version', 'Architecture', 'Provides', 'Recommends')):
+            status = stanza.get('Status', '').split(' ')
+            if len(status) != 3 or status[2] != 'installed' or 'Version' not in stanza:
+                continue
+            self.installed_names.update([stanza['Package']] + self.get_provided_names(stanza))
+            architecture = stanza.get('Architecture', 'all')
+            if stanza['Package'] == 'dpkg':
+                native_architecture = architecture   # dpkg itself is always installed for the native architecture
+            if status[0] == 'hold':
+                continue
+            installed_packages[(stanza['Package'], architecture)] = stanza
+        return installed_packages, native_architecture
+
+    def get_candidate_versions(self, installed_packages):
+        """ Returns (name, architecture) -> (newest version, [origins offering it], stanza) for installed packages that have a newer version available """
+        installed_keys_by_name = {}
+        for key in installed_packages:
+            installed_keys_by_name.setdefault(key[0], []).append(key)
+
+        def get_upgrade_key(stanza):
+            if stanza['Package'] not in installed_keys_by_name:
+                return None
+            key = self.__get_installed_key(installed_keys_by_name[stanza['Package']], stanza.get('Architecture', 'all'))
+            return key if key is not None and self.compare_versions(stanza['Version'], installed_packages[key]['Version']) > 0 else None
+
+        return self.get_newest_versions(get_upgrade_key)
+
+    def get_new_dependencies(self, candidates, installed_packages, native_architecture):
+        """ Returns (name, architecture) -> (newest version, [origins offering it], stanza) for packages that are not installed but that dist-upgrade installs for the candidates,
+            e.g. the image of a new kernel ABI. Like apt, the first real package of each unsatisfied alternative is taken, and only recommendations added since the installed version count. """
+        new_dependencies = {}
+        pending_stanzas = [(candidates[key][2], installed_packages[key]) for key in candidates]     # (stanza, installed stanza it upgrades)
+        while len(pending_stanzas) != 0:
+            available_names = set(self.installed_names)
+            for version, origins, stanza in list(candidates.values()) + list(new_dependencies.values()):
+                available_names.update([stanza['Package']] + self.get_provided_names(stanza))
+
+            unsatisfied_groups = []
+            for stanza, installed_stanza in pending_stanzas:
+                unsatisfied_groups += [group for group in self.get_required_relation_groups(stanza, installed_stanza) if len(available_names.intersection(group)) == 0]
+            if len(unsatisfied_groups) == 0:
+                break
+
+            wanted_names = set(name for group in unsatisfied_groups for name in group)
+            architectures = (native_architecture, 'all') if native_architecture is not None else None
+            found = self.get_newest_versions(lambda stanza: (stanza['Package'], stanza.get('Architecture', 'all')) if stanza['Package'] in wanted_names and (architectures is None or stanza.get('Architecture', 'all') in architectures) else None)
+            found_names = set(key[0] for key in found)
+
+            pending_stanzas = []
+            for group in unsatisfied_groups:
+                name = next((name for name in group if name in found_names), None)
+                if name is None:
+                    raise Exception("Dependency can only be satisfied by a virtual or unavailable package, which needs apt's resolver. [Alternatives={0}]".format(" | ".join(group)))
+                for key in [key for key in found if key[0] == name and key not in new_dependencies]:
+                    self.composite_logger.log_debug(" - Native apt assessment: new package needed by an upgrade. [Package={0}][Version={1}]".format(name, found[key][0]))
+                    new_dependencies[key] = found[key]
+                    pending_stanzas.append((found[key][2], None))
+        return new_dependencies
+
+    def get_required_relation_groups(self, stanza, installed_stanza=None):
+        """ Returns the alternatives (lists of names) of each dependency of a candidate that dist-upgrade has to satisfy. Recommendations already made by the installed version are not
+            reinstated if they were removed, so for upgrades only new ones are included. """
+        installed_recommends = [tuple(group) for group in self.parse_relation_groups(installed_stanza.get('Recommends', ''))] if installed_stanza is not None else []
+        groups = []
+        for field_name in self.relation_field_names:
+            for group in self.parse_relation_groups(stanza.get(field_name, '')):
+                if field_name != 'Recommends' or tuple(group) not in installed_recommends:
+                    groups.append(group)
+        return groups
+
+    def get_newest_versions(self, get_key):
+        """ Returns key -> (newest version, [origins offering it], stanza) over the candidate lists, for the stanzas get_key maps to a key (None skips the stanza) """
+        newest_versions = {}
+        for list_path in self.get_package_list_paths():
+            origin = os.path.basename(list_path)[:-len('_Packages')]
+            for stanza in self.read_control_stanzas(list_path, self.list_field_names):
+                if 'Package' not in stanza or 'Version' not in stanza:
+                    continue
+                key = get_key(stanza)
+                if key is None:
+                    continue
+
+                if key not in newest_versions or self.compare_versions(stanza['Version'], newest_versions[key][0]) > 0:
+                    newest_versions[key] = (stanza['Version'], [origin], stanza)
+                elif newest_versions[key][0] == stanza['Version'] and origin not in newest_versions[key][1]:
+                    newest_versions[key][1].append(origin)
+        return newest_versions
+
+    @staticmethod
+    def __get_installed_key(installed_keys, architecture):
+        """ Matches an available package to the installed one it can upgrade. Packages can move between 'all' and a specific architecture across versions. """
+        for key in installed_keys:
+            if key[1] == architecture:
+                return key
+        for key in installed_keys:
+            if architecture == 'all' or key[1] == 'all':
+                return key
+        return None
+
+    def get_package_list_paths(self):
+        """ Returns the apt list files of sources that are candidates for automatic upgrades (NotAutomatic sources, e.g. backports, are skipped) """
+        list_paths = []
+        for list_path in sorted(glob.glob(os.path.join(self.apt_lists_path, '*_Packages'))):
+            if self.is_not_automatic_source(list_path):
+                self.composite_logger.log_debug(" - Skipping list of NotAutomatic source: " + list_path)
+                continue
+            list_paths.append(list_path)
+        return list_paths
+
+    def is_not_automatic_source(self, list_path):
+        """ Reads the Release file of the suite a list file belongs to, e.g. archive.ubuntu.com_ubuntu_dists_focal-backports_main_binary-amd64_Packages """
+        file_name = os.path.basename(list_path)
+        if '_dists_' not in file_name:
+            return False    # flat repository
+
+        suite_prefix = file_name[:file_name.index('_dists_') + len('_dists_')]
+        suite_prefix += file_name[len(suite_prefix):].split('_')[0] + '_'
+        for release_file_name in (suite_prefix + 'InRelease', suite_prefix + 'Release'):
+            release_path = os.path.join(os.path.dirname(list_path), release_file_name)
+            if os.path.exists(release_path):
+                release = {}
+                for stanza in self.read_control_stanzas(release_path, ('NotAutomatic',)):
+                    release = stanza
+                    break
+                return release.get('NotAutomatic', '').lower() == 'yes'   # pinned at 100 or lower, so never a candidate for packages installed from elsewhere
+        return False
+    # endregion
+
+    # region Unsupported package states
+    def check_package_state_is_supported(self):
+        """ Raises if candidates depend on configuration that only apt's policy applies: pinning preferences, or lists kept compressed (Acquire::GzipIndexes, lz4 on recent Ubuntu) """
+        for preferences_path in self.apt_preferences_paths:
+            preferences_file_paths = [os.path.join(preferences_path, file_name) for file_name in os.listdir(preferences_path)] if os.path.isdir(preferences_path) else [preferences_path]
+            for preferences_file_path in preferences_file_paths:
+                if os.path.isfile(preferences_file_path) and self.has_pin_entries(preferences_file_path):
+                    raise Exception("Apt pinning is configured, which needs apt's policy. [Preferences={0}]".format(preferences_file_path))
+
+        compressed_list_paths = [list_path for list_path in glob.glob(os.path.join(self.apt_lists_path, '*_Packages.*')) if list_path.endswith(self.compressed_list_extensions)]
+        if len(compressed_list_paths) != 0:
+            raise Exception("Apt lists are stored compressed, which needs apt to read. [Example={0}]".format(compressed_list_paths[0]))
+
+    def has_pin_entries(self, preferences_file_path):
+        for stanza in self.read_control_stanzas(preferences_file_path, ('Pin',)):
+            return True
+        return False
+
+    @staticmethod
+    def check_phasing(candidates):
+        """ Raises if any candidate is still being phased in, as whether this machine gets it is decided by apt against the machine id """
+        for key in candidates:
+            phased_update_percentage = candidates[key][2].get('Phased-Update-Percentage')
+            if phased_update_percentage is not None and phased_update_percentage != '100':
+                raise Exception("Update is being phased in, which needs apt's policy. [Package={0}][Version={1}][PhasedUpdatePercentage={2}]".format(key[0], candidates[key][0], phased_update_percentage))
+    # endregion
+
+    # region Package relations
+    @staticmethod
+    def parse_relation_groups(relations):
+        """ Returns the alternatives of each relation in a Depends-style field as lists of names, without version constraints, architecture qualifiers or restrictions,
+            e.g. 'libc6 (>= 2.14), debconf (>= 0.5) | debconf-2.0' -> [['libc6'], ['debconf', 'debconf-2.0']] """
+        groups = []
+        for relation in relations.split(','):
+            group = []
+            for alternative in relation.split('|'):
+                alternative = re.sub(r'\(.*?\)|\[.*?\]|<.*?>', '', alternative).strip()
+                if alternative != '':
+                    group.append(alternative.split(':')[0])
+            if len(group) != 0:
+                groups.append(group)
+        return groups
+
+    @staticmethod
+    def get_provided_names(stanza):
+        return [group[0] for group in AptPackageIndex.parse_relation_groups(stanza.get('Provides', ''))]
+    # endregion
+
+    # region Control file parsing
+    def read_control_stanzas(self, file_path, field_names):
+        """ Streams the stanzas of a dpkg control-style file, yielding only the requested fields. Continuation lines (e.g. descriptions) are never decoded. """
+        stanza = {}
+        file_handle = self.env_layer.file_system.open(file_path, 'rb')
+        try:
+            for raw_line in file_handle:
+                if raw_line[:1] in (b' ', b'\t'):
+                    continue
+                line = raw_line.decode('utf-8', 'replace').rstrip('\r\n')
+                if line == '':
+                    if len(stanza) != 0:
+                        yield stanza
+                        stanza = {}
+                    continue
+                separator = line.find(':')
+                if separator > 0 and line[:separator] in field_names:
+                    stanza[line[:separator]] = str(line[separator + 1:].strip())
+            if len(stanza) != 0:
+                yield stanza
+        finally:
+            file_handle.close()
+    # endregion
+
+    # region Version comparison
+    @staticmethod
+    def compare_versions(version_a, version_b):
+        """ Compares two Debian package versions ([epoch:]upstream[-revision]) the way dpkg does. Returns -1, 0 or 1. """
+        epoch_a, upstream_a, revision_a = AptPackageIndex.__split_version(version_a)
+        epoch_b, upstream_b, revision_b = AptPackageIndex.__split_version(version_b)
+        if epoch_a != epoch_b:
+            return 1 if epoch_a > epoch_b else -1
+
+        result = AptPackageIndex.__compare_version_part(upstream_a, upstream_b)
+        if result == 0:
+            result = AptPackageIndex.__compare_version_part(revision_a, revision_b)
+        return (result > 0) - (result < 0)
+
+    @staticmethod
+    def __split_version(version):
+        epoch = 0
+        if ':' in version:
+            epoch_str, version = version.split(':', 1)
+            epoch = int(epoch_str) if epoch_str.isdigit() else 0
+        revision = ''
+        if '-' in version:
+            version, revision = version.rsplit('-', 1)
+        return epoch, version, revision
+
+    @staticmethod
+    def __get_character_order(character):
+        """ dpkg order(): letters sort before non-letters and '~' sorts before everything, even the end of the part. Digits (the start of the next digit run) order like the end of the part. """
+        if character == '' or character.isdigit():
+            return 0
+        if character.isalpha():
+            return ord(character)
+        if character == '~':
+            return -1
+        return ord(character) + 256
+
+    @staticmethod
+    def __compare_version_part(part_a, part_b):
+        """ dpkg verrevcmp: alternately compares non-digit runs (by character order) and digit runs (numerically) """
+        index_a = index_b = 0
+        while index_a < len(part_a) or index_b < len(part_b):
+            while (index_a < len(part_a) and not part_a[index_a].isdigit()) or (index_b < len(part_b) and not part_b[index_b].isdigit()):
+                order_a = AptPackageIndex.__get_character_order(part_a[index_a] if index_a < len(part_a) else '')
+                order_b = AptPackageIndex.__get_character_order(part_b[index_b] if index_b < len(part_b) else '')
+                if order_a != order_b:
+                    return order_a - order_b
+                index_a += 1
+                index_b += 1
+
+            # digit runs are compared as numbers: strip leading zeros, then the longer run is larger, then the first differing digit decides
+            while index_a < len(part_a) and part_a[index_a] == '0':
+                index_a += 1
+            while index_b < len(part_b) and part_b[index_b] == '0':
+                index_b += 1
+            first_difference = 0
+            while index_a < len(part_a) and part_a[index_a].isdigit() and index_b < len(part_b) and part_b[index_b].isdigit():
+                if first_difference == 0:
+                    first_difference = ord(part_a[index_a]) - ord(part_b[index_b])
+                index_a += 1
+                index_b += 1
+            if index_a < len(part_a) and part_a[index_a].isdigit():
+                return 1
+            if index_b < len(part_b) and part_b[index_b].isdigit():
+                return -1
+            if first_difference != 0:
+                return first_difference
+        return 0
+    # endregion
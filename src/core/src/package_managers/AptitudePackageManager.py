@@ -15,10 +15,16 @@
 # Requires Python 2.7+
 
 """The is Aptitude package manager implementation"""
+import glob
 import json
 import os
 import re
+from core.src.package_managers.AptPackageIndex import AptPackageIndex
+from core.src.package_managers.AssessmentResultCache import AssessmentResultCache
+from core.src.package_managers.InstalledPackageSnapshot import InstalledPackageSnapshot
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.PackageSet import PackageSet
+from core.src.package_managers.RepoRefreshCoordinator import RepoRefreshCoordinator
 from core.src.bootstrap.Constants import Constants
 
 
@@ -30,21 +36,35 @@ class AptitudePackageManager(PackageManager):
         super(AptitudePackageManager, self).__init__(env_layer, execution_config, composite_logger, telemetry_writer, status_handler)
         # Repo refresh
         self.repo_refresh = 'sudo apt-get -q update'
+        self.security_repo_refresh = 'sudo apt-get -q update -oDir::Etc::Sourcelist=<SOURCES> -oDir::Etc::SourceParts=- -oAPT::Get::List-Cleanup=0'  # List-Cleanup=0 keeps the lists of the other sources
+        self.repo_refresh_coordinator = RepoRefreshCoordinator(composite_logger)
 
         # Support to get updates and their dependencies
         self.security_sources_list = '/tmp/az-update-security.list'
-        self.prep_security_sources_list_cmd = 'sudo grep security /etc/apt/sources.list > ' + self.security_sources_list
+        self.prep_security_sources_list_cmd = 'sudo grep -hs security /etc/apt/sources.list /etc/apt/sources.list.d/*.list > ' + self.security_sources_list
+        self.deb822_sources_path_pattern = '/etc/apt/sources.list.d/*.sources'     # deb822 sources (the default from Ubuntu 24.04 and Debian 12 on), converted into the security sources list
+        self.package_policy_cmd = 'LANG=en_US.UTF8 apt-cache policy <PACKAGES>'
+        self.security_origin_marker = 'security'  # classification by origin mirrors the sources that the security sources list is prepared from
+        self.all_update_origins_cached = []  # origins of the candidate versions in all_updates_cached
         self.dist_upgrade_simulation_cmd_template = 'LANG=en_US.UTF8 sudo apt-get -s dist-upgrade <SOURCES> '  # Dist-upgrade simulation template - <SOURCES> needs to be replaced before use; sudo is used as sometimes the sources list needs sudo to be readable
         self.single_package_check_versions = 'apt-cache madison <PACKAGE-NAME>'
         self.single_package_find_installed_dpkg = 'sudo dpkg -s <PACKAGE-NAME>'
         self.single_package_find_installed_apt = 'sudo apt list --installed <PACKAGE-NAME>'
+        self.installed_packages_query_cmd = "dpkg-query -W -f='${Package}\\t${Version}\\t${Status}\\t${Architecture}\\n'"
+        self.installed_package_snapshot = InstalledPackageSnapshot(env_layer, composite_logger, self.installed_packages_query_cmd, ['/var/lib/dpkg/status'])
         self.single_package_upgrade_simulation_cmd = '''DEBIAN_FRONTEND=noninteractive apt-get -y --only-upgrade true -s install '''
         self.single_package_dependency_resolution_template = 'DEBIAN_FRONTEND=noninteractive LANG=en_US.UTF8 apt-get -y --only-upgrade true -s install <PACKAGE-NAME> '
+        self.native_assessment_engine = AptPackageIndex(env_layer, composite_logger)
+        self.assessment_result_cache = AssessmentResultCache(composite_logger, ['/var/lib/dpkg/status', '/var/lib/apt/lists', '/etc/apt/sources.list', '/etc/apt/sources.list.d', '/etc/apt/preferences', '/etc/apt/preferences.d'])
 
         # Install update
         # --only-upgrade: upgrade only single package (only if it is installed)
         self.single_package_upgrade_cmd = '''sudo DEBIAN_FRONTEND=noninteractive apt-get -y --only-upgrade true install '''
 
+        # Download update (into the package cache, without installing)
+        self.download_only_cmd = '''sudo DEBIAN_FRONTEND=noninteractive apt-get -y --only-upgrade true --download-only install '''
+        self.package_cache_paths = ['/var/cache/apt/archives']
+
         # Package manager exit code(s)
         self.apt_exitcode_ok = 0
 
@@ -60,15 +80,93 @@ class AptitudePackageManager(PackageManager):
         self.set_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY, Constants.APT)
         self.STR_DPKG_WAS_INTERRUPTED = "E: dpkg was interrupted, you must manually run 'sudo dpkg --configure -a' to correct the problem."
 
-    def refresh_repo(self):
+    def refresh_repo(self, force=False, security_only=False):
+        if security_only:
+            self.repo_refresh_coordinator.refresh(self.__refresh_security_repo, self.get_repo_refresh_ttl_in_minutes(), force, partial=True)
+        else:
+            self.repo_refresh_coordinator.refresh(self.__refresh_repo, self.get_repo_refresh_ttl_in_minutes(), force)
+
+    def __refresh_repo(self):
         self.composite_logger.log("\nRefreshing local repo...")
         self.invoke_package_manager(self.repo_refresh)
+        self.invalidate_package_state_caches()
+
+    def __refresh_security_repo(self):
+        """Refreshes only the sources that security updates are discovered from. Falls back to a full refresh if there are none."""
+        if not self.prepare_security_sources_list():
+            self.__refresh_repo()
+            return
+
+        self.composite_logger.log("\nRefreshing local repo (security sources only)...")
+        self.invoke_package_manager(self.security_repo_refresh.replace('<SOURCES>', self.security_sources_list))
+        self.invalidate_package_state_caches()
+
+    def prepare_security_sources_list(self):
+        """Writes the sources list that security discovery and refreshes use: the security entries of the one-line lists, plus those of the deb822 sources converted to one-line entries.
+        Returns False if there are no security sources."""
+        code, out = self.env_layer.run_command_output(self.prep_security_sources_list_cmd, False, False)
+        deb822_entries = self.get_security_entries_from_deb822_sources()
+        if len(deb822_entries) != 0:
+            self.env_layer.file_system.write_with_retry(self.security_sources_list, "\n" + "\n".join(deb822_entries) + "\n", mode='a+')
+        elif code != 0:
+            self.composite_logger.log_warning(" - SLP:: Return code: " + str(code) + ", Output: \n|\t" + "\n|\t".join(out.splitlines()))
+            return False
+        return True
+
+    def get_security_entries_from_deb822_sources(self):
+        """Returns one-line entries for the enabled deb822 source combinations whose URI or suite is a security source. Keys given inline (rather than as a path) cannot be carried over."""
+        entries = []
+        for sources_path in sorted(glob.glob(self.deb822_sources_path_pattern)):
+            try:
+                stanzas = self.parse_deb822_stanzas(self.env_layer.file_system.read_with_retry(sources_path))
+            except Exception as error:
+                self.composite_logger.log_debug(" - Unable to read deb822 sources. [Path={0}][Error={1}]".format(sources_path, repr(error)))
+                continue
+
+            for stanza in stanzas:
+                if stanza.get('enabled', 'yes').lower() == 'no':
+                    continue
+                options = []
+                for field_name, option_name in (('architectures', 'arch'), ('signed-by', 'signed-by'), ('trusted', 'trusted')):
+                    if field_name in stanza:
+                        if '\n' in stanza[field_name]:
+                            self.composite_logger.log_debug(" - Skipping deb822 option that cannot be expressed in a one-line entry. [Path={0}][Field={1}]".format(sources_path, field_name))
+                            continue
+                        options.append(option_name + '=' + ','.join(stanza[field_name].split()))
+                for source_type in stanza.get('types', '').split():
+                    for uri in stanza.get('uris', '').split():
+                        for suite in stanza.get('suites', '').split():
+                            if self.security_origin_marker in uri.lower() or self.security_origin_marker in suite.lower():
+                                entries.append(' '.join([source_type] + (['[' + ' '.join(options) + ']'] if len(options) != 0 else []) + [uri, suite] + ([] if suite.endswith('/') else stanza.get('components', '').split())))
+        return entries
+
+    @staticmethod
+    def parse_deb822_stanzas(content):
+        """Returns the stanzas of a deb822 file as dicts keyed by lower-cased field name. Continuation lines (e.g. inline keys) are kept on separate lines of the value."""
+        stanzas = []
+        stanza = {}
+        field_name = None
+        for line in content.splitlines() + ['']:
+            if line.startswith('#'):
+                continue
+            if line.strip() == '':
+                if len(stanza) != 0:
+                    stanzas.append(stanza)
+                stanza = {}
+                field_name = None
+            elif line[:1] in (' ', '\t'):
+                if field_name is not None:
+                    stanza[field_name] += '\n' + line.strip()
+            elif ':' in line:
+                field_name = line[:line.index(':')].strip().lower()
+                stanza[field_name] = line[line.index(':') + 1:].strip()
+        return stanzas
 
     # region Get Available Updates
-    def invoke_package_manager(self, command):
-        """Get missing updates using the command input"""
+    def invoke_package_manager(self, command, output_parser=None):
+        """Get missing updates using the command input. With an output parser, the output is parsed as it streams in and the parsed result is returned instead."""
         self.composite_logger.log_debug('\nInvoking package manager using: ' + command)
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out, parsed_out = self.run_command_output_or_stream(command, output_parser)
 
         if code != self.apt_exitcode_ok and self.STR_DPKG_WAS_INTERRUPTED in out:
             self.composite_logger.log_error('[ERROR] YOU NEED TO TAKE ACTION TO PROCEED. The package manager on this machine is not in a healthy state, and '
@@ -93,7 +191,7 @@ class AptitudePackageManager(PackageManager):
             self.composite_logger.log_debug(" - Return code from package manager: " + str(code))
             self.composite_logger.log_debug(" - Output from package manager: \n|\t" + "\n|\t".join(out.splitlines()))
             self.composite_logger.log_debug("==========================================================================\n\n")
-        return out
+        return parsed_out if output_parser is not None else out
 
     def invoke_apt_cache(self, command):
         """Invoke apt-cache using the command input"""
@@ -122,40 +220,114 @@ class AptitudePackageManager(PackageManager):
             self.composite_logger.log_debug(" - Returning cached package data.")
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        cmd = self.dist_upgrade_simulation_cmd_template.replace('<SOURCES>', '')
-        out = self.invoke_package_manager(cmd)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES)
+        if cached_result is not None:
+            self.all_updates_cached, self.all_update_versions_cached, self.all_update_origins_cached = cached_result
+            return self.all_updates_cached, self.all_update_versions_cached
 
+        native_updates = None
+        if self.get_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, False):
+            native_updates = self.get_all_updates_from_native_engine()
+
+        if native_updates is None or self.get_package_manager_setting(Constants.PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, False):
+            cmd = self.dist_upgrade_simulation_cmd_template.replace('<SOURCES>', '')
+            self.all_updates_cached, self.all_update_versions_cached, self.all_update_origins_cached = self.invoke_package_manager(cmd, self.extract_packages_versions_and_origins)
+            if native_updates is not None:
+                self.cross_check_native_assessment(native_updates[0], native_updates[1])
+        else:
+            self.all_updates_cached, self.all_update_versions_cached, self.all_update_origins_cached = native_updates
+
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES, (self.all_updates_cached, self.all_update_versions_cached, self.all_update_origins_cached))
         self.composite_logger.log_debug("Discovered " + str(len(self.all_updates_cached)) + " package entries.")
         return self.all_updates_cached, self.all_update_versions_cached
 
     def get_security_updates(self):
-        """Get missing security updates"""
+        """Get missing security updates. Native assessment reports the origin of each candidate, so it always classifies by origin."""
+        if self.get_package_manager_setting(Constants.PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, False) or self.get_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, False):
+            return self.get_security_updates_by_origin()
+
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES)
+        if cached_result is not None:
+            return cached_result
+
         self.composite_logger.log("\nDiscovering 'security' packages...")
-        code, out = self.env_layer.run_command_output(self.prep_security_sources_list_cmd, False, False)
-        if code != 0:
-            self.composite_logger.log_warning(" - SLP:: Return code: " + str(code) + ", Output: \n|\t" + "\n|\t".join(out.splitlines()))
+        self.prepare_security_sources_list()
 
         cmd = self.dist_upgrade_simulation_cmd_template.replace('<SOURCES>', '-oDir::Etc::Sourcelist=' + self.security_sources_list)
-        out = self.invoke_package_manager(cmd)
-        security_packages, security_package_versions = self.extract_packages_and_versions(out)
+        security_packages, security_package_versions = self.invoke_package_manager(cmd, self.extract_packages_and_versions)
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES, (security_packages, security_package_versions))
+
+        self.composite_logger.log("Discovered " + str(len(security_packages)) + " 'security' package entries.")
+        return security_packages, security_package_versions
+
+    def prepare_concurrent_discovery(self):
+        """Both simulations are independent unless security updates are classified by origin, which needs only the one simulation"""
+        if self.get_package_manager_setting(Constants.PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, False) or self.get_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, False):
+            return []
+
+        self.prepare_security_sources_list()
+        return [self.dist_upgrade_simulation_cmd_template.replace('<SOURCES>', ''),
+                self.dist_upgrade_simulation_cmd_template.replace('<SOURCES>', '-oDir::Etc::Sourcelist=' + self.security_sources_list)]
+
+    def get_security_updates_by_origin(self):
+        """Get missing security updates by classifying the (cached) results of the all-updates simulation using the origins of the versions newer than the installed one.
+        The candidate is cumulative, so a package whose candidate comes from elsewhere (e.g. -updates) still brings in the fix of any newer version from a security source."""
+        self.composite_logger.log("\nDiscovering 'security' packages by origin...")
+        security_packages = []
+        security_package_versions = []
+
+        all_packages, all_package_versions = self.get_all_updates(True)
+        candidate_security_packages = set(package for package, origin in zip(all_packages, self.all_update_origins_cached) if self.is_security_origin(origin))
+        other_packages = [package for package in all_packages if package not in candidate_security_packages]
+        newer_security_packages = self.get_packages_with_newer_security_versions(other_packages) if len(other_packages) != 0 else set()
+        for package, package_version in zip(all_packages, all_package_versions):
+            if package in candidate_security_packages or package in newer_security_packages:
+                security_packages.append(package)
+                security_package_versions.append(package_version)
 
         self.composite_logger.log("Discovered " + str(len(security_packages)) + " 'security' package entries.")
         return security_packages, security_package_versions
 
+    def is_security_origin(self, origin):
+        """Returns true if any of the (comma separated) origins of a candidate version is a security source, e.g. 'Ubuntu:16.10/yakkety-updates, Ubuntu:16.10/yakkety-security'"""
+        return any(self.security_origin_marker in entry.lower() for entry in str(origin).split(','))
+
+    def get_packages_with_newer_security_versions(self, packages):
+        """Returns those of the packages that have a version newer than the installed one in a security source, from a single apt-cache policy query for all of them"""
+        # sample output format (the version table is sorted newest first, and *** marks the installed version)
+        # coreutils:
+        #   Installed: 8.25-2ubuntu2
+        #   Candidate: 8.25-2ubuntu3~16.10
+        #   Version table:
+        #      8.25-2ubuntu3~16.10 500
+        #         500 http://archive.ubuntu.com/ubuntu yakkety-updates/main amd64 Packages
+        #      8.25-2ubuntu2.1 500
+        #         500 http://security.ubuntu.com/ubuntu yakkety-security/main amd64 Packages
+        #  *** 8.25-2ubuntu2 100
+        #         100 /var/lib/dpkg/status
+        output = self.invoke_apt_cache(self.package_policy_cmd.replace('<PACKAGES>', ' '.join(packages)))
+        newer_security_packages = set()
+        package = None
+        is_newer_version = is_installed_version_seen = False
+        for line in output.splitlines():
+            if not line.startswith(' ') and line.endswith(':'):
+                package = line[:-1]
+                is_newer_version = is_installed_version_seen = False
+            elif re.match(r'^ (\*\*\*| {3}) \S+ -?\d+$', line):
+                is_installed_version_seen = is_installed_version_seen or line.startswith(' ***')
+                is_newer_version = not is_installed_version_seen
+            elif is_newer_version and package in packages and re.match(r'^ +-?\d+ ', line) and self.security_origin_marker in line.lower():
+                newer_security_packages.add(package)
+        self.composite_logger.log_debug(" - Packages with a newer version from a security source than their candidate's origin shows: " + str(sorted(newer_security_packages)))
+        return newer_security_packages
+
     def get_other_updates(self):
         """Get missing other updates"""
         self.composite_logger.log("\nDiscovering 'other' packages...")
-        other_packages = []
-        other_package_versions = []
-
         all_packages, all_package_versions = self.get_all_updates(True)
         security_packages, security_package_versions = self.get_security_updates()
 
-        for index, package in enumerate(all_packages):
-            if package not in security_packages:
-                other_packages.append(package)
-                other_package_versions.append(all_package_versions[index])
+        other_packages, other_package_versions = PackageSet(all_packages, all_package_versions).difference(security_packages).to_lists()
 
         self.composite_logger.log("Discovered " + str(len(other_packages)) + " 'other' package entries.")
         return other_packages, other_package_versions
@@ -168,20 +340,26 @@ class AptitudePackageManager(PackageManager):
         # Inst python3-update-manager [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-updates [all]) [update-manager-core:amd64 ]
         # Inst update-manager-core [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-updates [all])
 
+        packages, versions, origins = self.extract_packages_versions_and_origins(output)
+        return packages, versions
+
+    def extract_packages_versions_and_origins(self, output):
+        """Returns packages, versions and the origins (archive/pocket) the candidate versions come from. Output is read line by line, so a streamed output is parsed as it arrives."""
         self.composite_logger.log_debug("\nExtracting package and version data...")
         packages = []
         versions = []
+        origins = []
 
         search_text = r'Inst[ ](.*?)[ ].*?[(](.*?)[ ](.*?)[ ]\[(.*?)\]'
-        search = re.compile(search_text, re.M | re.S)
-        package_list = search.findall(str(output))
-
-        for package in package_list:
-            packages.append(package[0])
-            versions.append(package[1])
+        search = re.compile(search_text)
+        for line in self.get_output_lines(output):
+            for package in search.findall(str(line)):
+                packages.append(package[0])
+                versions.append(package[1])
+                origins.append(package[2])
 
         self.composite_logger.log_debug("Extracted package and version data for " + str(len(packages)) + " packages.")
-        return packages, versions
+        return packages, versions, origins
     # endregion
     # endregion
 
@@ -222,6 +400,10 @@ class AptitudePackageManager(PackageManager):
 
         self.composite_logger.log_debug("\nCHECKING PACKAGE INSTALL STATUS FOR: " + str(package_name) + " (" + str(package_version) + ")")
 
+        is_installed = self.get_install_status_from_snapshot(package_name, package_version)
+        if is_installed is not None:
+            return is_installed
+
         # DEFAULT METHOD
         self.composite_logger.log_debug(" - [1/2] Verifying install status with Dpkg.")
         cmd = self.single_package_find_installed_dpkg.replace('<PACKAGE-NAME>', package_name)
@@ -322,18 +504,20 @@ class AptitudePackageManager(PackageManager):
         self.composite_logger.log_debug("   - Package version specified was determined to NOT be installed.")
         return False
 
-    def get_dependent_list(self, package_name):
-        """Returns dependent List of the package"""
-        cmd = self.single_package_dependency_resolution_template.replace('<PACKAGE-NAME>', package_name)
+    def get_dependent_list(self, package_names):
+        """Returns dependent List of the package (or of a batch of packages, excluding the packages in the batch)"""
+        if type(package_names) is str:
+            package_names = [package_names]
+
+        cmd = self.single_package_dependency_resolution_template.replace('<PACKAGE-NAME>', ' '.join(package_names))
 
         self.composite_logger.log_debug("\nRESOLVING DEPENDENCIES USING COMMAND: " + str(cmd))
         output = self.invoke_package_manager(cmd)
 
         packages, package_versions = self.extract_packages_and_versions(output)
-        if package_name in packages:
-            packages.remove(package_name)
+        packages = [package for package in packages if package not in package_names]
 
-        self.composite_logger.log_debug(str(len(packages)) + " dependent updates were found for package '" + package_name + "'.")
+        self.composite_logger.log_debug(str(len(packages)) + " dependent updates were found for package(s) '" + ', '.join(package_names) + "'.")
         return packages
 
     def get_product_name(self, package_name):
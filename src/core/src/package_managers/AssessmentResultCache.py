@@ -0,0 +1,92 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Assessment results cached for as long as the package database and repo metadata are unchanged on disk"""
+import os
+
+
+class AssessmentResultCache(object):
+    """Caches assessment results against a fingerprint of the package state. Any change to the fingerprinted files drops every cached result."""
+
+    def __init__(self, composite_logger, fingerprint_paths):
+        self.composite_logger = composite_logger
+        self.fingerprint_paths = fingerprint_paths    # package database files, repo metadata directories and repo configuration
+
+        self.__results = {}     # key -> result
+        self.__fingerprint = None
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, key):
+        """ Returns a copy of the cached result, or None if there is none for the current package state """
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None or fingerprint != self.__fingerprint:
+            self.__results = {}
+            self.__fingerprint = fingerprint
+        if key not in self.__results:
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        self.composite_logger.log_debug(" - Returning assessment result cached for the current package state. [Key={0}]".format(str(key)))
+        return self.__copy_result(self.__results[key])
+
+    def set(self, key, result):
+        """ Caches a copy of the result against the current package state. Nothing is cached if the package state cannot be fingerprinted. """
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None:
+            return
+        if fingerprint != self.__fingerprint:
+            self.__results = {}
+            self.__fingerprint = fingerprint
+        self.__results[key] = self.__copy_result(result)
+
+    def invalidate(self):
+        self.__results = {}
+        self.__fingerprint = None
+
+    def get_fingerprint(self):
+        """ Returns (path, mtime, size) for every fingerprinted file and (path, newest mtime) for every directory present, or None if none are """
+        fingerprint = []
+        for fingerprint_path in self.fingerprint_paths:
+            try:
+                if os.path.isdir(fingerprint_path):
+                    fingerprint.append((fingerprint_path, self.__get_newest_mtime(fingerprint_path)))
+                else:
+                    stat = os.stat(fingerprint_path)
+                    fingerprint.append((fingerprint_path, stat.st_mtime, stat.st_size))
+            except OSError:
+                continue
+        return tuple(fingerprint) if len(fingerprint) != 0 else None
+
+    @staticmethod
+    def __get_newest_mtime(directory_path):
+        """ Metadata refreshes replace files (write, then rename), which updates the mtime of the directory holding them, so below the top level only directories are inspected.
+            Files directly in the directory (e.g. apt lists, repo configuration that may be edited in place) are inspected too. """
+        newest_mtime = os.path.getmtime(directory_path)
+        for directory, sub_directories, file_names in os.walk(directory_path):
+            entry_names = sub_directories + file_names if directory == directory_path else sub_directories
+            for entry_name in entry_names:
+                try:
+                    newest_mtime = max(newest_mtime, os.path.getmtime(os.path.join(directory, entry_name)))
+                except OSError:
+                    continue    # removed while walking
+        return newest_mtime
+
+    @staticmethod
+    def __copy_result(result):
+        """ Callers consume the returned lists (e.g. pop from them), so the cache never shares them """
+        return tuple(list(item) for item in result)
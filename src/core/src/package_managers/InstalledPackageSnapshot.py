@@ -0,0 +1,106 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Bulk installed package version oracle, backed by a single package database query"""
+import os
+
+
+class InstalledPackageSnapshot(object):
+    """Point-in-time index of installed package versions. It is only re-queried when the package database changes on disk."""
+
+    def __init__(self, env_layer, composite_logger, query_cmd, database_paths):
+        self.env_layer = env_layer
+        self.composite_logger = composite_logger
+        self.query_cmd = query_cmd              # must output one 'name<TAB>version[<TAB>status[<TAB>architecture]]' line per installed package
+        self.database_paths = database_paths    # files that change whenever the package database changes
+
+        self.__installed_packages = None        # package name (and name:architecture, if reported) -> set of installed versions; None if no usable snapshot exists
+        self.__database_fingerprint = None
+        self.refresh_count = 0
+
+    def is_package_version_installed(self, package_name, package_version):
+        """ Returns True/False if the snapshot can answer, or None if no snapshot could be taken (callers should fall back to a direct check) """
+        installed_packages = self.get_installed_packages()
+        if installed_packages is None:
+            return None
+        return package_name in installed_packages and self.normalize_version(package_version) in installed_packages[package_name]
+
+    def get_installed_packages(self):
+        """ Returns the map of package name -> set of installed versions (with no explicit epoch of 0), refreshing it first if the package database has changed """
+        database_fingerprint = self.get_database_fingerprint()
+        if self.__installed_packages is not None and database_fingerprint is not None and database_fingerprint == self.__database_fingerprint:
+            return self.__installed_packages
+
+        self.__installed_packages = self.__query_installed_packages()
+        self.__database_fingerprint = database_fingerprint if self.__installed_packages is not None else None
+        return self.__installed_packages
+
+    @staticmethod
+    def get_changes(baseline_packages, installed_packages):
+        """ Returns package name -> versions present in installed_packages that were not in baseline_packages (both as returned by get_installed_packages) """
+        changes = {}
+        for package_name, versions in installed_packages.items():
+            new_versions = versions - baseline_packages.get(package_name, set())
+            if len(new_versions) != 0:
+                changes[package_name] = new_versions
+        return changes
+
+    @staticmethod
+    def normalize_version(version):
+        """ Drops an explicit epoch of 0, which means the same as none: rpm's EPOCH query format prints it if it was set, but yum and zypper versions leave it out """
+        version = str(version).strip()
+        return version[2:] if version.startswith('0:') else version
+
+    def invalidate(self):
+        """ Forces the next lookup to re-query the package database """
+        self.__installed_packages = None
+        self.__database_fingerprint = None
+
+    def get_database_fingerprint(self):
+        """ Returns (path, mtime, size) for every package database file present, or None if none are """
+        fingerprint = []
+        for database_path in self.database_paths:
+            try:
+                stat = os.stat(database_path)
+                fingerprint.append((database_path, stat.st_mtime, stat.st_size))
+            except OSError:
+                continue
+        return tuple(fingerprint) if len(fingerprint) != 0 else None
+
+    def __query_installed_packages(self):
+        """ Runs the bulk query. Returns None on failure or on an empty result, as no real system has zero packages installed. """
+        self.composite_logger.log_debug("\nTaking installed package snapshot using: " + self.query_cmd)
+        code, output = self.env_layer.run_command_output(self.query_cmd, False, False)
+        if code != 0:
+            self.composite_logger.log_debug(" - Unable to take installed package snapshot. [Code={0}]".format(str(code)))
+            return None
+
+        installed_packages = {}
+        for line in output.strip().split('\n'):
+            package_details = line.split('\t')
+            if len(package_details) < 2:
+                continue
+            if len(package_details) > 2 and package_details[2].strip().split(' ')[-1] != 'installed':
+                continue    # e.g. dpkg 'deinstall ok config-files'
+            version = self.normalize_version(package_details[1])
+            installed_packages.setdefault(package_details[0].strip(), set()).add(version)
+            if len(package_details) > 3 and package_details[3].strip() != '':
+                # multi-arch: apt lists foreign architecture packages as name:arch, and the same name can be installed for several architectures
+                installed_packages.setdefault(package_details[0].strip() + ':' + package_details[3].strip(), set()).add(version)
+
+        self.refresh_count += 1
+        self.composite_logger.log_debug(" - Installed package snapshot taken. [PackageCount={0}]".format(str(len(installed_packages))))
+        return installed_packages if len(installed_packages) != 0 else None
@@ -19,6 +19,7 @@ import json
 import os
 from abc import ABCMeta, abstractmethod
 from core.src.bootstrap.Constants import Constants
+from core.src.package_managers.PackageSet import PackageSet
 import time
 
 
@@ -32,12 +33,35 @@ class PackageManager(object):
         self.status_handler = status_handler
         self.single_package_upgrade_cmd = ''
         self.single_package_upgrade_simulation_cmd = 'simulate-install'
-        self.package_manager_settings = {}
+        self.download_only_cmd = ''
+        self.package_cache_paths = []
+        self.package_manager_settings = dict(execution_config.package_manager_settings)    # opt-in settings from configuration
 
         # Enabling caching for high performance retrieval (only for code explicitly requesting it)
         self.all_updates_cached = []
         self.all_update_versions_cached = []
 
+        # Package -> dependent updates, as resolved by simulation; cleared by every install and repo refresh, as they change the package state
+        self.dependency_graph_cache = {}
+
+        # Bulk installed package version oracle (only for package managers that set it up)
+        self.installed_package_snapshot = None
+
+        # Assessment results reused while the package database and repo metadata are unchanged (only for package managers that set it up)
+        self.assessment_result_cache = None
+
+        # Assessment without invoking the package manager (opt-in via PKG_MGR_SETTING_NATIVE_ASSESSMENT, only for package managers that set it up)
+        self.native_assessment_engine = None
+
+        # Skips redundant repo refreshes within the freshness TTL (only for package managers that set it up)
+        self.repo_refresh_coordinator = None
+
+        # Outputs of read-only discovery commands run concurrently ahead of use (opt-in via PKG_MGR_SETTING_CONCURRENT_DISCOVERY)
+        self.prefetched_command_outputs = {}
+
+        # Code path taken by the last install_update_and_dependencies call (used to classify failures for retries)
+        self.last_install_code_path = None
+
         # auto OS updates
         self.image_default_patch_configuration_backup_path = os.path.join(execution_config.config_folder, Constants.IMAGE_DEFAULT_PATCH_CONFIGURATION_BACKUP_PATH)
 
@@ -50,13 +74,17 @@ class PackageManager(object):
     __metaclass__ = ABCMeta  # For Python 3.0+, it changes to class Abstract(metaclass=ABCMeta)
 
     @abstractmethod
-    def refresh_repo(self):
-        """Resynchronize the package index files from their sources."""
+    def refresh_repo(self, force=False, security_only=False):
+        """Resynchronize the package index files from their sources. Unless forced, this is skipped if the same operation already refreshed within the refresh TTL.
+        Package managers that can tell security sources apart refresh only those when security_only is set."""
         pass
 
+    def get_repo_refresh_ttl_in_minutes(self):
+        return self.get_package_manager_setting(Constants.PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES, Constants.REPO_REFRESH_TTL_IN_MINUTES)
+
     # region Get Available Updates
     @abstractmethod
-    def invoke_package_manager(self, command):
+    def invoke_package_manager(self, command, output_parser=None):
         pass
 
     def get_available_updates(self, package_filter):
@@ -81,7 +109,11 @@ class PackageManager(object):
         if package_filter.is_msft_critsec_classification_only():
             return self.get_security_updates()
         elif package_filter.is_msft_other_classification_only():
-            return self.get_other_updates()
+            self.prefetch_discovery_outputs()   # 'other' needs both the all and the security discovery
+            try:
+                return self.get_other_updates()
+            finally:
+                self.discard_prefetched_outputs()
         elif package_filter.is_msft_all_classification_included():
             return self.get_all_updates()
         else:
@@ -100,6 +132,107 @@ class PackageManager(object):
     @abstractmethod
     def get_other_updates(self):
         pass
+
+    def get_all_updates_from_native_engine(self):
+        """Get all missing updates from the native assessment engine. Returns None if it is unavailable or fails, so the package manager is invoked instead."""
+        if self.native_assessment_engine is None:
+            return None
+
+        self.composite_logger.log_debug(" - Using native assessment engine.")
+        try:
+            return self.native_assessment_engine.get_upgradable_packages()
+        except Exception as error:
+            self.composite_logger.log_warning(" - Native assessment failed, falling back to the package manager. [Error={0}]".format(repr(error)))
+            self.telemetry_writer.send_debug_info("[Native assessment] Failed: " + repr(error))
+            return None
+
+    def cross_check_native_assessment(self, native_packages, native_package_versions):
+        """Reports any disagreement between the native assessment engine and the (authoritative) package manager results in all_updates_cached"""
+        package_manager_updates = set(zip(self.all_updates_cached, self.all_update_versions_cached))
+        native_updates = set(zip(native_packages, native_package_versions))
+        if package_manager_updates == native_updates:
+            self.composite_logger.log_debug(" - Native assessment matches the package manager. [PackageCount={0}]".format(str(len(native_updates))))
+            return True
+
+        only_package_manager = sorted(package + "=" + version for package, version in package_manager_updates - native_updates)
+        only_native = sorted(package + "=" + version for package, version in native_updates - package_manager_updates)
+        mismatch_info = "[Native assessment] Mismatch with package manager. [OnlyInPackageManager={0}][OnlyInNative={1}]".format(", ".join(only_package_manager), ", ".join(only_native))
+        self.composite_logger.log_debug(" - " + mismatch_info)
+        self.telemetry_writer.send_debug_info(mismatch_info)
+        return False
+    # endregion
+
+    # region Concurrent discovery and query result reuse
+    def prepare_concurrent_discovery(self):
+        """Returns the read-only commands behind all and security discovery that can safely run at the same time, after running any prerequisites they need"""
+        return []
+
+    def prefetch_discovery_outputs(self):
+        """Runs the discovery commands concurrently so that the following get_all_updates/get_security_updates calls consume their outputs instead of running them one after the other"""
+        self.discard_prefetched_outputs()
+        if not self.get_package_manager_setting(Constants.PKG_MGR_SETTING_CONCURRENT_DISCOVERY, False):
+            return
+
+        commands = self.prepare_concurrent_discovery()
+        if len(commands) < 2:
+            return
+
+        self.composite_logger.log_debug("\nRunning discovery commands concurrently: " + ", ".join(commands))
+        start_time = time.time()
+        self.prefetched_command_outputs = dict(zip(commands, self.env_layer.run_command_outputs_concurrently(commands)))
+        self.composite_logger.log_debug(" - Concurrent discovery completed. [Duration={0}s]".format(str(round(time.time() - start_time, 2))))
+
+    def get_cached_assessment_result(self, key):
+        """Returns the cached assessment result for the current package state, or None"""
+        return self.assessment_result_cache.get(key) if self.assessment_result_cache is not None else None
+
+    def cache_assessment_result(self, key, result):
+        if self.assessment_result_cache is not None:
+            self.assessment_result_cache.set(key, result)
+
+    def discard_prefetched_outputs(self):
+        """Prefetched outputs are only valid for the discovery they were run for"""
+        self.prefetched_command_outputs = {}
+
+    def run_command_output_or_prefetched(self, command):
+        """Returns (code, output) of a command, using the prefetched result if there is one"""
+        if command in self.prefetched_command_outputs:
+            self.composite_logger.log_debug(" - Using concurrently prefetched output.")
+            return self.prefetched_command_outputs.pop(command)
+        return self.env_layer.run_command_output(command, False, False)
+
+    def invalidate_read_only_query_cache(self):
+        """Package managers that cache read-only query results drop them here whenever the package state changes"""
+        pass
+
+    def invalidate_package_state_caches(self):
+        """Drops everything cached against the package state. Called after installs and repo refreshes, as file fingerprints alone can miss changes where mtime granularity is coarse."""
+        self.invalidate_read_only_query_cache()
+        self.dependency_graph_cache = {}
+        if self.installed_package_snapshot is not None:
+            self.installed_package_snapshot.invalidate()
+        if self.assessment_result_cache is not None:
+            self.assessment_result_cache.invalidate()
+    # endregion
+
+    # region Output streaming
+    def run_command_output_or_stream(self, command, output_parser=None):
+        """Returns (code, output, parsed output). With an output parser, the command's output lines are parsed as they arrive and only their tail is returned for error reporting."""
+        if output_parser is None or command in self.prefetched_command_outputs:
+            code, out = self.run_command_output_or_prefetched(command)
+            return code, out, (output_parser(out) if output_parser is not None else None)
+
+        output_stream = self.env_layer.run_command_stream(command)
+        parsed_output = output_parser(output_stream)
+        code = output_stream.read_to_end()     # the parser may stop early
+        return code, output_stream.get_tail(), parsed_output
+
+    @staticmethod
+    def get_output_lines(output):
+        """Output parsers accept the full output of a command or a stream of its lines (see EnvLayer.run_command_stream)"""
+        if hasattr(output, 'strip'):
+            return output.strip().split('\n')
+        return output
     # endregion
 
     def get_updates_for_inclusions(self, package_filter):
@@ -153,17 +286,7 @@ class PackageManager(object):
     @staticmethod
     def dedupe_update_packages(packages, package_versions):
         """Remove duplicate packages and returns"""
-        deduped_packages = []
-        deduped_package_versions = []
-
-        for index, package in enumerate(packages):
-            if package in deduped_packages:
-                continue  # Already included
-
-            deduped_packages.append(package)
-            deduped_package_versions.append(package_versions[index])
-
-        return deduped_packages, deduped_package_versions
+        return PackageSet(packages, package_versions).to_lists()   # first occurrence wins
     # endregion
 
     # region Install Update
@@ -189,6 +312,33 @@ class PackageManager(object):
     def install_updates_fail_safe(self, excluded_packages):
         pass
 
+    def install_updates_in_transaction(self, packages, package_versions, simulate=False, timeout=None):
+        """Installs a group of packages in a single package manager invocation. Returns the return code; callers check the outcome per package.
+           The timeout (in seconds) defaults to the command timeout for a single package."""
+        cmd = self.single_package_upgrade_cmd if simulate is False else self.single_package_upgrade_simulation_cmd
+        exec_cmd = str(self.get_install_command(cmd, packages, package_versions))
+        start_time = time.time()
+
+        self.discard_prefetched_outputs()
+        self.composite_logger.log_debug("UPDATING PACKAGES IN A SINGLE TRANSACTION USING COMMAND: " + exec_cmd)
+        code, out = self.env_layer.run_command_output(exec_cmd, False, False, timeout)
+        if simulate is False:
+            self.invalidate_package_state_caches()
+        self.composite_logger.log_debug("\n<PackageInstallOutput>\n" + str(out) + "\n</PackageInstallOutput>")
+
+        if not simulate:
+            # per package telemetry, as for individual installs; the download size is only known for the transaction as a whole
+            install_duration = round(time.time() - start_time, 2)
+            code_path = "| Install in transaction" + (" > Timed out" if code == Constants.EnvLayer.TIMED_OUT_COMMAND_CODE else "") + " [Packages={0}][Code={1}]".format(str(len(packages)), str(code))
+            for package, package_version in zip(packages, package_versions):
+                if self.is_package_version_installed(package, package_version):
+                    error = self.telemetry_writer.send_package_info(package, package_version, Constants.UNKNOWN_PACKAGE_SIZE, install_duration, Constants.INSTALLED, code_path + " > Installed. (succeeded)", exec_cmd)
+                else:
+                    error = self.telemetry_writer.send_package_info(package, package_version, Constants.UNKNOWN_PACKAGE_SIZE, install_duration, Constants.FAILED, code_path + " > Not installed. (retried in a smaller transaction or individually)", exec_cmd, str(out))
+                if error is not None:
+                    self.composite_logger.log_debug('\nEXCEPTION writing package telemetry: ' + repr(error))
+        return code
+
     def install_update_and_dependencies(self, package_and_dependencies, package_and_dependency_versions, simulate=False):
         """Install a single package along with its dependencies (explicitly)"""
         install_result = Constants.INSTALLED
@@ -206,8 +356,13 @@ class PackageManager(object):
             cmd = self.single_package_upgrade_simulation_cmd
         exec_cmd = str(self.get_install_command(cmd, package_and_dependencies, package_and_dependency_versions))
 
+        self.discard_prefetched_outputs()
         self.composite_logger.log_debug("UPDATING PACKAGE (WITH DEPENDENCIES) USING COMMAND: " + exec_cmd)
         code, out = self.env_layer.run_command_output(exec_cmd, False, False)
+        if code == Constants.EnvLayer.TIMED_OUT_COMMAND_CODE:
+            code_path += " > Timed out"
+        if simulate is False:
+            self.invalidate_package_state_caches()
         package_size = self.get_package_size(out)
         self.composite_logger.log_debug("\n<PackageInstallOutput>\n" + out + "\n</PackageInstallOutput>")  # wrapping multi-line for readability
 
@@ -262,6 +417,7 @@ class PackageManager(object):
             else:
                 code_path += " > Info, Package installed, zero return. (succeeded)"
 
+        self.last_install_code_path = code_path
         if not simulate:
             if install_result == Constants.FAILED:
                 error = self.telemetry_writer.send_package_info(package_and_dependencies[0], package_and_dependency_versions[0], package_size, round(time.time() - start_time, 2), install_result, code_path, exec_cmd, str(out))
@@ -274,6 +430,37 @@ class PackageManager(object):
         return install_result
     # endregion
 
+    # region Download Update
+    def download_updates(self, packages, package_versions, timeout=None):
+        """Downloads packages (and their dependencies) into the package cache without installing them. Returns the return code."""
+        exec_cmd = str(self.get_install_command(self.download_only_cmd, packages, package_versions))
+        self.composite_logger.log_debug("DOWNLOADING PACKAGES USING COMMAND: " + exec_cmd)
+        code, out = self.env_layer.run_command_output(exec_cmd, False, False, timeout)
+        if code != 0:
+            self.composite_logger.log_debug(" - Download did not complete. [Code={0}][Output={1}]".format(str(code), "\n|\t".join(str(out).splitlines()[-5:])))
+        return code
+
+    def get_package_cache_size(self):
+        """Returns the total size in bytes of the files in the package cache"""
+        cache_size = 0
+        for cache_path in self.package_cache_paths:
+            for directory, sub_directories, file_names in os.walk(cache_path):
+                for file_name in file_names:
+                    try:
+                        cache_size += os.path.getsize(os.path.join(directory, file_name))
+                    except OSError:
+                        continue    # removed while walking
+        return cache_size
+
+    def get_package_cache_free_space(self):
+        """Returns the free bytes on the file system holding the package cache, or None if it cannot be determined"""
+        for cache_path in self.package_cache_paths:
+            if os.path.exists(cache_path) and hasattr(os, 'statvfs'):
+                file_system_stat = os.statvfs(cache_path)
+                return file_system_stat.f_bavail * file_system_stat.f_frsize
+        return None
+    # endregion
+
     # region Package Information
     @abstractmethod
     def get_all_available_versions_of_package(self, package_name):
@@ -286,11 +473,36 @@ class PackageManager(object):
         """ Returns true if the specific package version is installed """
         pass
 
+    def get_install_status_from_snapshot(self, package_name, package_version):
+        """ Returns True/False from the installed package snapshot, or None if the package manager needs to be queried for the package """
+        if self.installed_package_snapshot is None:
+            return None
+
+        is_installed = self.installed_package_snapshot.is_package_version_installed(package_name, package_version)
+        if is_installed is not None:
+            self.composite_logger.log_debug(" - Install status of " + str(package_name) + " (" + str(package_version) + ") from installed package snapshot: " + str(is_installed))
+        return is_installed
+
     @abstractmethod
-    def get_dependent_list(self, package_name):
+    def get_dependent_list(self, package_names):
         """Retrieve available updates. Expect an array being returned"""
         pass
 
+    def resolve_dependency_graph(self, packages):
+        """Returns a map of package -> dependent updates for all the packages given, including dependencies on each other.
+           Each package is simulated on its own, as dependencies cannot be attributed to individual packages from a batch simulation,
+           but only once until the package state changes, so callers that resolve overlapping sets share the simulations."""
+        self.composite_logger.log_debug("\nResolving dependency graph. [PackageCount={0}]".format(str(len(packages))))
+        dependency_graph = {}
+        simulation_count = 0
+        for package in packages:
+            if package not in self.dependency_graph_cache:
+                self.dependency_graph_cache[package] = self.get_dependent_list(package)
+                simulation_count += 1
+            dependency_graph[package] = self.dependency_graph_cache[package]
+        self.composite_logger.log_debug("Resolved dependency graph. [PackageCount={0}][SimulationCount={1}]".format(str(len(packages)), str(simulation_count)))
+        return dependency_graph
+
     @abstractmethod
     def get_product_name(self, package_name):
         """Retrieve package name """
@@ -0,0 +1,111 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Ordered set of packages with their versions, indexed by name and by name without architecture"""
+
+
+class PackageSet(object):
+    """Replaces parallel package / package version lists where membership or version lookups are needed. The first version added for a package wins, as in dedupe_update_packages."""
+    __slots__ = ('__packages', '__versions', '__index_by_name', '__index_by_base_name')
+
+    ARCHITECTURES = ('.x86_64', '.noarch', '.i686')     # if this is changed, review YumPackageManager.get_product_name_and_arch
+
+    def __init__(self, packages=(), package_versions=()):
+        self.__packages = []
+        self.__versions = []
+        self.__index_by_name = {}       # package -> position
+        self.__index_by_base_name = {}  # package name without architecture -> packages, in order
+        for package, package_version in zip(packages, package_versions):
+            self.add(package, package_version)
+
+    # region Access
+    def add(self, package, package_version):
+        """ Returns False if the package is already present (its version is kept) """
+        if package in self.__index_by_name:
+            return False
+        self.__index_by_name[package] = len(self.__packages)
+        self.__packages.append(package)
+        self.__versions.append(package_version)
+        self.__index_by_base_name.setdefault(self.get_base_name(package), []).append(package)
+        return True
+
+    def get_version(self, package, default=None):
+        position = self.__index_by_name.get(package)
+        return self.__versions[position] if position is not None else default
+
+    def get_packages_with_base_name(self, base_name):
+        """ Returns every architecture of a package (e.g. for yum multilib), in order """
+        return list(self.__index_by_base_name.get(base_name, ()))
+
+    def get_packages(self):
+        return list(self.__packages)
+
+    def get_versions(self):
+        return list(self.__versions)
+
+    def to_lists(self):
+        """ Returns (packages, package_versions) for interfaces built on parallel lists """
+        return self.get_packages(), self.get_versions()
+
+    def __len__(self):
+        return len(self.__packages)
+
+    def __contains__(self, package):
+        return package in self.__index_by_name
+
+    def __iter__(self):
+        """ Yields (package, version) in insertion order """
+        return iter(zip(self.__packages, self.__versions))
+
+    @staticmethod
+    def get_base_name(package):
+        for arch in PackageSet.ARCHITECTURES:
+            if package.endswith(arch):
+                return package[:-len(arch)]
+        return package
+    # endregion
+
+    # region Set algebra
+    def union(self, other):
+        """ Packages of this set followed by packages only in the other; versions from this set win """
+        result = PackageSet(self.__packages, self.__versions)
+        for package, package_version in other:
+            result.add(package, package_version)
+        return result
+
+    def intersection(self, packages):
+        """ Packages of this set (in order, with their versions) that are also in packages, which can be any iterable of names or a PackageSet """
+        packages = self.__get_name_lookup(packages)
+        return PackageSet(*self.__select(lambda package: package in packages))
+
+    def difference(self, packages):
+        """ Packages of this set (in order, with their versions) that are not in packages, which can be any iterable of names or a PackageSet """
+        packages = self.__get_name_lookup(packages)
+        return PackageSet(*self.__select(lambda package: package not in packages))
+
+    def __select(self, predicate):
+        selected_packages = []
+        selected_versions = []
+        for package, package_version in zip(self.__packages, self.__versions):
+            if predicate(package):
+                selected_packages.append(package)
+                selected_versions.append(package_version)
+        return selected_packages, selected_versions
+
+    @staticmethod
+    def __get_name_lookup(packages):
+        return packages if isinstance(packages, (PackageSet, set, frozenset, dict)) else set(packages)
+    # endregion
@@ -0,0 +1,63 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Skips repeated repo refreshes within an operation"""
+import time
+
+
+class RepoRefreshCoordinator(object):
+    """Tracks when this process last refreshed the repository metadata. The first refresh request of an operation always runs, as metadata
+       refreshed by anything else on the machine (e.g. a periodic apt update) may not cover the sources or the state this operation needs."""
+
+    def __init__(self, composite_logger):
+        self.composite_logger = composite_logger
+
+        self.__last_refresh_time = None
+        self.__last_partial_refresh_time = None
+        self.refresh_count = 0
+        self.skipped_refresh_count = 0
+
+    def refresh(self, refresh_delegate, ttl_in_minutes, force=False, partial=False):
+        """ Runs the refresh delegate unless this operation already refreshed within the TTL. A TTL of 0 or less refreshes every time.
+            A partial refresh (of some sources only) is skipped after a full or partial refresh, but never makes a later full refresh skippable. """
+        last_refresh_time = self.get_last_refresh_time(partial)
+        if not force and self.is_fresh(last_refresh_time, ttl_in_minutes):
+            self.skipped_refresh_count += 1
+            self.composite_logger.log_debug("Skipping repo refresh as it was already refreshed in this operation. [TTL={0}m][RefreshAge={1}s]".format(str(ttl_in_minutes), str(int(time.time() - last_refresh_time))))
+            return False
+
+        refresh_delegate()
+        if partial:
+            self.__last_partial_refresh_time = time.time()
+        else:
+            self.__last_refresh_time = time.time()
+        self.refresh_count += 1
+        return True
+
+    def invalidate(self):
+        """ Forgets the refreshes made by this process, so the next request refreshes again """
+        self.__last_refresh_time = None
+        self.__last_partial_refresh_time = None
+
+    def get_last_refresh_time(self, partial=False):
+        """ Returns when this process last made a refresh that covers the requested one, or None """
+        refresh_times = [self.__last_refresh_time] + ([self.__last_partial_refresh_time] if partial else [])
+        refresh_times = [refresh_time for refresh_time in refresh_times if refresh_time is not None]
+        return max(refresh_times) if len(refresh_times) != 0 else None
+
+    @staticmethod
+    def is_fresh(last_refresh_time, ttl_in_minutes):
+        return ttl_in_minutes > 0 and last_refresh_time is not None and 0 <= time.time() - last_refresh_time < ttl_in_minutes * 60
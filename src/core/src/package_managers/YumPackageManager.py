@@ -16,7 +16,11 @@
 
 """YumPackageManager for Redhat and CentOS"""
 import re
+from core.src.package_managers.AssessmentResultCache import AssessmentResultCache
+from core.src.package_managers.InstalledPackageSnapshot import InstalledPackageSnapshot
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.PackageSet import PackageSet
+from core.src.package_managers.YumRepodataIndex import YumRepodataIndex
 from core.src.bootstrap.Constants import Constants
 
 
@@ -34,12 +38,20 @@ class YumPackageManager(PackageManager):
         self.yum_check_security = 'sudo yum -q --security check-update'
         self.single_package_check_versions = 'sudo yum list available <PACKAGE-NAME> --showduplicates'
         self.single_package_check_installed = 'sudo yum list installed <PACKAGE-NAME>'
+        self.installed_packages_query_cmd = "rpm -qa --queryformat '%{NAME}.%{ARCH}\\t%|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
+        self.installed_package_snapshot = InstalledPackageSnapshot(env_layer, composite_logger, self.installed_packages_query_cmd, ['/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal'])
+        self.native_assessment_engine = YumRepodataIndex(env_layer, composite_logger, self.installed_package_snapshot)
+        self.assessment_result_cache = AssessmentResultCache(composite_logger, ['/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal', '/var/cache/yum', '/var/cache/dnf', '/etc/yum.repos.d'])
         self.single_package_upgrade_simulation_cmd = 'LANG=en_US.UTF8 sudo yum install --assumeno '
 
         # Install update
         self.single_package_upgrade_cmd = 'sudo yum -y install '
         self.all_but_excluded_upgrade_cmd = 'sudo yum -y update --exclude='
 
+        # Download update (into the package cache, without installing)
+        self.download_only_cmd = 'sudo yum -y install --downloadonly '
+        self.package_cache_paths = ['/var/cache/yum', '/var/cache/dnf']
+
         # Package manager exit code(s)
         self.yum_exitcode_no_applicable_packages = 0
         self.yum_exitcode_ok = 1
@@ -56,14 +68,14 @@ class YumPackageManager(PackageManager):
         self.set_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY, Constants.YUM)
         self.STR_TOTAL_DOWNLOAD_SIZE = "Total download size: "
 
-    def refresh_repo(self):
+    def refresh_repo(self, force=False, security_only=False):
         pass  # Refresh the repo is no ops in YUM
 
     # region Get Available Updates
-    def invoke_package_manager(self, command):
-        """Get missing updates using the command input"""
+    def invoke_package_manager(self, command, output_parser=None):
+        """Get missing updates using the command input. With an output parser, the output is parsed as it streams in and the parsed result is returned instead."""
         self.composite_logger.log_debug('\nInvoking package manager using: ' + command)
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out, parsed_out = self.run_command_output_or_stream(command, output_parser)
         if code not in [self.yum_exitcode_ok, self.yum_exitcode_no_applicable_packages, self.yum_exitcode_updates_available]:
             self.composite_logger.log('[ERROR] Package manager was invoked using: ' + command)
             self.composite_logger.log_warning(" - Return code from package manager: " + str(code))
@@ -78,7 +90,7 @@ class YumPackageManager(PackageManager):
             self.composite_logger.log_debug(" - Return code from package manager: " + str(code))
             self.composite_logger.log_debug(" - Output from package manager: \n|\t" + "\n|\t".join(out.splitlines()))
             self.composite_logger.log_debug("==========================================================================\n\n")
-        return out
+        return parsed_out if output_parser is not None else out
 
     # region Classification-based (incl. All) update check
     def get_all_updates(self, cached=False):
@@ -88,8 +100,23 @@ class YumPackageManager(PackageManager):
             self.composite_logger.log_debug(" - Returning cached package data.")
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.yum_check)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES)
+        if cached_result is not None:
+            self.all_updates_cached, self.all_update_versions_cached = cached_result
+            return self.all_updates_cached, self.all_update_versions_cached
+
+        native_updates = None
+        if self.get_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, False):
+            native_updates = self.get_all_updates_from_native_engine()
+
+        if native_updates is None or self.get_package_manager_setting(Constants.PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, False):
+            self.all_updates_cached, self.all_update_versions_cached = self.invoke_package_manager(self.yum_check, self.extract_packages_and_versions)
+            if native_updates is not None:
+                self.cross_check_native_assessment(native_updates[0], native_updates[1])
+        else:
+            self.all_updates_cached, self.all_update_versions_cached = native_updates
+
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES, (self.all_updates_cached, self.all_update_versions_cached))
         self.composite_logger.log_debug("Discovered " + str(len(self.all_updates_cached)) + " package entries.")
         return self.all_updates_cached, self.all_update_versions_cached
 
@@ -97,8 +124,12 @@ class YumPackageManager(PackageManager):
         """Get missing security updates"""
         self.composite_logger.log("\nDiscovering 'security' packages...")
         self.install_yum_security_prerequisite()
-        out = self.invoke_package_manager(self.yum_check_security)
-        security_packages, security_package_versions = self.extract_packages_and_versions(out)
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES)
+        if cached_result is not None:
+            return cached_result
+
+        security_packages, security_package_versions = self.invoke_package_manager(self.yum_check_security, self.extract_packages_and_versions)
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES, (security_packages, security_package_versions))
 
         if len(security_packages) == 0 and 'CentOS' in str(self.env_layer.platform.linux_distribution()):   # deliberately non-terminal
             self.composite_logger.log_warning("Classification-based patching is only supported on YUM if the machine is independently configured to receive classification information.")
@@ -109,9 +140,6 @@ class YumPackageManager(PackageManager):
     def get_other_updates(self):
         """Get missing other updates"""
         self.composite_logger.log("\nDiscovering 'other' packages...")
-        other_packages = []
-        other_package_versions = []
-
         all_packages, all_package_versions = self.get_all_updates(True)
         security_packages, security_package_versions = self.get_security_updates()
         if len(security_packages) == 0 and 'CentOS' in str(self.env_layer.platform.linux_distribution()):  # deliberately terminal - erring on the side of caution to avoid dissat in uninformed customers
@@ -121,14 +149,19 @@ class YumPackageManager(PackageManager):
             self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
             raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
 
-        for index, package in enumerate(all_packages):
-            if package not in security_packages:
-                other_packages.append(package)
-                other_package_versions.append(all_package_versions[index])
+        other_packages, other_package_versions = PackageSet(all_packages, all_package_versions).difference(security_packages).to_lists()
 
         self.composite_logger.log("Discovered " + str(len(other_packages)) + " 'other' package entries.")
         return other_packages, other_package_versions
 
+    def prepare_concurrent_discovery(self):
+        """check-update and its security variant are independent once the security plugin is present (yum 3 serializes them on its lock; dnf runs them side by side)"""
+        if self.get_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, False):
+            return []
+
+        self.install_yum_security_prerequisite()
+        return [self.yum_check, self.yum_check_security]
+
     def install_yum_security_prerequisite(self):
         """Not installed by default in versions prior to RHEL 7. This step is idempotent and fast, so we're not writing more complex code."""
         self.composite_logger.log_debug('Ensuring RHEL yum-plugin-security is present.')
@@ -154,14 +187,12 @@ class YumPackageManager(PackageManager):
             # Using a list comprehension to determine if chunk is a package
             return len([p for p in package_extensions if p in chunk]) == 1
 
-        lines = output.strip().split('\n')
-
-        for line_index in range(0, len(lines)):
-            line = re.split(r'\s+', lines[line_index].strip())
+        for line_index, (raw_line, raw_next_line) in enumerate(self.__pair_with_next_line(self.get_output_lines(output))):
+            line = re.split(r'\s+', raw_line.strip())
             next_line = []
 
-            if line_index < len(lines) - 1:
-                next_line = re.split(r'\s+', lines[line_index + 1].strip())
+            if raw_next_line is not None:
+                next_line = re.split(r'\s+', raw_next_line.strip())
 
             # If we run into a length of 3, we'll accept it and continue
             if len(line) == 3 and is_package(line[0]):
@@ -178,9 +209,20 @@ class YumPackageManager(PackageManager):
                 versions.append(line[1])
                 line_index += 1
             else:
-                self.composite_logger.log_debug(" - Inapplicable line (" + str(line_index) + "): " + lines[line_index])
+                self.composite_logger.log_debug(" - Inapplicable line (" + str(line_index) + "): " + raw_line)
 
         return packages, versions
+
+    @staticmethod
+    def __pair_with_next_line(lines):
+        """Yields (line, next line) pairs, looking only one line ahead so that a streamed output is parsed as it arrives"""
+        previous_line = None
+        for line in lines:
+            if previous_line is not None:
+                yield previous_line, line
+            previous_line = line
+        if previous_line is not None:
+            yield previous_line, None
     # endregion
     # endregion
 
@@ -221,6 +263,11 @@ class YumPackageManager(PackageManager):
         # Installed Packages
         # kernel.x86_64                                                                                   3.10.0-514.el7                                                                                    @anaconda/7.3
         self.composite_logger.log_debug("\nCHECKING PACKAGE INSTALL STATUS FOR: " + str(package_name) + " (" + str(package_version) + ")")
+
+        is_installed = self.get_install_status_from_snapshot(package_name, package_version)
+        if is_installed is not None:
+            return is_installed
+
         cmd = self.single_package_check_installed.replace('<PACKAGE-NAME>', package_name)
         output = self.invoke_package_manager(cmd)
         packages, package_versions = self.extract_packages_and_versions_including_duplicates(output)
@@ -237,7 +284,7 @@ class YumPackageManager(PackageManager):
 
         return False
 
-    def get_dependent_list(self, package_name):
+    def get_dependent_list(self, package_names):
         # Sample output for the cmd 'sudo yum update --assumeno selinux-policy.noarch' is :
         #
         # Loaded plugins: langpacks, product-id, search-disabled-repos
@@ -254,10 +301,14 @@ class YumPackageManager(PackageManager):
         # ---> Package selinux-policy-targeted.noarch 0:3.13.1-102.el7_3.16 will be an update
         # --> Finished Dependency Resolution
 
-        self.composite_logger.log_debug("\nRESOLVING DEPENDENCIES USING COMMAND: " + str(self.single_package_upgrade_simulation_cmd + package_name))
+        if type(package_names) is str:
+            package_names = [package_names]
+
+        cmd = self.single_package_upgrade_simulation_cmd + ' '.join(package_names)
+        self.composite_logger.log_debug("\nRESOLVING DEPENDENCIES USING COMMAND: " + str(cmd))
         dependent_updates = []
 
-        output = self.invoke_package_manager(self.single_package_upgrade_simulation_cmd + package_name)
+        output = self.invoke_package_manager(cmd)
         lines = output.strip().split('\n')
 
         for line in lines:
@@ -271,11 +322,11 @@ class YumPackageManager(PackageManager):
                 continue
 
             dependent_package_name = self.get_product_name(updates_line[2])
-            if len(dependent_package_name) != 0 and dependent_package_name != package_name:
+            if len(dependent_package_name) != 0 and dependent_package_name not in package_names and dependent_package_name not in dependent_updates:
                 self.composite_logger.log_debug(" - Dependency detected: " + dependent_package_name)
                 dependent_updates.append(dependent_package_name)
 
-        self.composite_logger.log_debug(str(len(dependent_updates)) + " dependent updates were found for package '" + package_name + "'.")
+        self.composite_logger.log_debug(str(len(dependent_updates)) + " dependent updates were found for package(s) '" + ', '.join(package_names) + "'.")
         return dependent_updates
 
     def get_product_name(self, package_name):
@@ -0,0 +1,250 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Reads cached yum/dnf repository metadata directly to assess available updates without invoking yum"""
+import glob
+import gzip
+import os
+import re
+import xml.etree.ElementTree as et
+
+
+class YumRepodataIndex(object):
+    """Native yum assessment engine: installed packages from the installed package snapshot, candidates from cached primary repodata"""
+
+    def __init__(self, env_layer, composite_logger, installed_package_snapshot, cache_roots=('/var/cache/yum', '/var/cache/dnf'), repo_config_path='/etc/yum.repos.d'):
+        self.env_layer = env_layer
+        self.composite_logger = composite_logger
+        self.installed_package_snapshot = installed_package_snapshot
+        self.cache_roots = cache_roots
+        self.repo_config_path = repo_config_path
+
+        self.primary_xml_namespace = '{http://linux.duke.edu/metadata/common}'
+
+    # region Assessment
+    def get_upgradable_packages(self):
+        """ Returns packages (name.arch) and versions ([epoch:]version-release) of the newest candidate of every installed package, as yum check-update lists them """
+        installed_packages = self.installed_package_snapshot.get_installed_packages()
+        if installed_packages is None:
+            raise Exception("Installed package snapshot is unavailable.")
+
+        installed_versions_by_name = {}     # name -> {arch: newest installed (epoch, version, release)}
+        for package, versions in installed_packages.items():
+            name, arch = package.rsplit('.', 1) if '.' in package else (package, None)
+            newest_version = None
+            for version in versions:
+                evr = self.split_version(version)
+                if newest_version is None or self.compare_evr(evr, newest_version) > 0:
+                    newest_version = evr
+            installed_versions_by_name.setdefault(name, {})[arch] = newest_version
+
+        candidates = {}
+        for primary_path in self.get_primary_metadata_paths():
+            for name, arch, evr in self.read_primary_metadata(primary_path):
+                if name not in installed_versions_by_name or arch == 'src':
+                    continue
+                installed_arch = self.__get_installed_arch(installed_versions_by_name[name], arch)
+                if installed_arch is None or self.compare_evr(evr, installed_versions_by_name[name][installed_arch]) <= 0:
+                    continue
+                key = (name, installed_arch)
+                if key not in candidates or self.compare_evr(evr, candidates[key]) > 0:
+                    candidates[key] = evr
+
+        packages = []
+        versions = []
+        for key in sorted(candidates.keys()):   # check-update orders by name, then arch
+            packages.append(key[0] + '.' + key[1])
+            versions.append(self.join_version(candidates[key]))
+        self.composite_logger.log_debug(" - Native yum assessment found " + str(len(packages)) + " upgradable packages.")
+        return packages, versions
+
+    @staticmethod
+    def __get_installed_arch(installed_arches, arch):
+        """ Matches an available package to the installed arch it can upgrade. Packages can move between noarch and a specific arch across versions. """
+        if arch in installed_arches:
+            return arch
+        for installed_arch in installed_arches:
+            if arch == 'noarch' or installed_arch == 'noarch':
+                return installed_arch
+        return None
+    # endregion
+
+    # region Repository metadata
+    def get_primary_metadata_paths(self):
+        """ Returns one primary metadata file per cached enabled repo, preferring sqlite over xml.gz. Layouts: yum <root>/<arch>/<ver>/<repo>/[gen/]*primary*.sqlite, dnf <root>/<repo>-<hash>/repodata/*primary.xml.gz """
+        enabled_repo_ids = self.get_enabled_repo_ids()
+        primary_paths_by_repo = {}
+        for cache_root in self.cache_roots:
+            for directory, sub_directories, file_names in os.walk(cache_root):
+                for file_name in sorted(file_names):
+                    if not (file_name.endswith('primary.sqlite') or file_name.endswith('primary_db.sqlite') or file_name.endswith('primary.xml.gz')):
+                        continue
+                    repo_id = self.get_repo_id(directory)
+                    if enabled_repo_ids is not None and repo_id not in enabled_repo_ids:
+                        continue
+                    known_path = primary_paths_by_repo.get((cache_root, repo_id))
+                    if known_path is None or (known_path.endswith('.xml.gz') and file_name.endswith('.sqlite')):
+                        primary_paths_by_repo[(cache_root, repo_id)] = os.path.join(directory, file_name)
+        return [primary_paths_by_repo[key] for key in sorted(primary_paths_by_repo.keys())]
+
+    @staticmethod
+    def get_repo_id(directory):
+        """ Derives the repo id from the cache directory holding its metadata """
+        directory = os.path.normpath(directory)
+        if os.path.basename(directory) in ('gen', 'repodata'):
+            directory = os.path.dirname(directory)
+        return re.sub(r'-[0-9a-f]{16}$', '', os.path.basename(directory))
+
+    def get_enabled_repo_ids(self):
+        """ Returns the ids of enabled repos in the yum repo configuration, or None if there is no configuration to filter by """
+        repo_ids = {}
+        for config_path in sorted(glob.glob(os.path.join(self.repo_config_path, '*.repo'))):
+            repo_id = None
+            file_handle = self.env_layer.file_system.open(config_path, 'r')
+            try:
+                for line in file_handle:
+                    line = line.strip()
+                    if line.startswith('[') and line.endswith(']'):
+                        repo_id = line[1:-1].strip()
+                        repo_ids[repo_id] = True
+                    elif repo_id is not None and re.match(r'^enabled\s*=', line):
+                        repo_ids[repo_id] = line.split('=', 1)[1].strip() not in ('0', 'false', 'no')
+            finally:
+                file_handle.close()
+        return set(repo_id for repo_id, enabled in repo_ids.items() if enabled) if len(repo_ids) != 0 else None
+
+    def read_primary_metadata(self, primary_path):
+        """ Yields (name, arch, (epoch, version, release)) for every package in a primary metadata file """
+        self.composite_logger.log_debug(" - Reading repository metadata: " + primary_path)
+        if primary_path.endswith('.sqlite'):
+            try:
+                import sqlite3
+            except ImportError:
+                self.composite_logger.log_debug("    - sqlite3 is unavailable. Skipping.")
+                return
+            connection = sqlite3.connect(primary_path)
+            try:
+                for name, arch, epoch, version, release in connection.execute('SELECT name, arch, epoch, version, release FROM packages'):
+                    yield str(name), str(arch), (str(epoch or '0'), str(version), str(release))
+            finally:
+                connection.close()
+        else:
+            file_handle = gzip.open(primary_path, 'rb')
+            try:
+                for event, element in et.iterparse(file_handle):
+                    if element.tag != self.primary_xml_namespace + 'package':
+                        continue
+                    version = element.find(self.primary_xml_namespace + 'version')
+                    if element.get('type') == 'rpm' and version is not None:
+                        yield (element.findtext(self.primary_xml_namespace + 'name'), element.findtext(self.primary_xml_namespace + 'arch'),
+                               (version.get('epoch') or '0', version.get('ver'), version.get('rel')))
+                    element.clear()
+            finally:
+                file_handle.close()
+    # endregion
+
+    # region Version comparison
+    @staticmethod
+    def split_version(version):
+        """ Splits [epoch:]version-release into (epoch, version, release) """
+        epoch = '0'
+        if ':' in version:
+            epoch, version = version.split(':', 1)
+        release = ''
+        if '-' in version:
+            version, release = version.rsplit('-', 1)
+        return epoch, version, release
+
+    @staticmethod
+    def join_version(evr):
+        """ Formats (epoch, version, release) the way yum prints it, omitting a zero epoch """
+        epoch, version, release = evr
+        return (epoch + ':' if epoch not in ('', '0') else '') + version + '-' + release
+
+    @staticmethod
+    def compare_evr(evr_a, evr_b):
+        """ Compares two (epoch, version, release) tuples the way rpm does. Returns -1, 0 or 1. """
+        epoch_a, epoch_b = int(evr_a[0] or 0), int(evr_b[0] or 0)
+        if epoch_a != epoch_b:
+            return 1 if epoch_a > epoch_b else -1
+        result = YumRepodataIndex.rpmvercmp(evr_a[1], evr_b[1])
+        if result == 0:
+            result = YumRepodataIndex.rpmvercmp(evr_a[2], evr_b[2])
+        return result
+
+    @staticmethod
+    def rpmvercmp(version_a, version_b):
+        """ Port of rpm's rpmvercmp: compares alternating numeric and alphabetic segments, with '~' sorting before and '^' after the end of a version """
+        if version_a == version_b:
+            return 0
+
+        index_a = index_b = 0
+        while index_a < len(version_a) or index_b < len(version_b):
+            while index_a < len(version_a) and not version_a[index_a].isalnum() and version_a[index_a] not in '~^':
+                index_a += 1
+            while index_b < len(version_b) and not version_b[index_b].isalnum() and version_b[index_b] not in '~^':
+                index_b += 1
+
+            char_a = version_a[index_a] if index_a < len(version_a) else ''
+            char_b = version_b[index_b] if index_b < len(version_b) else ''
+            if char_a == '~' or char_b == '~':
+                if char_a != '~':
+                    return 1
+                if char_b != '~':
+                    return -1
+                index_a += 1
+                index_b += 1
+                continue
+
+            if char_a == '^' or char_b == '^':
+                if char_a == '':
+                    return -1
+                if char_b == '':
+                    return 1
+                if char_a != '^':
+                    return 1
+                if char_b != '^':
+                    return -1
+                index_a += 1
+                index_b += 1
+                continue
+
+            if char_a == '' or char_b == '':
+                break
+
+            is_numeric = char_a.isdigit()
+            segment_match = re.compile(r'\d*' if is_numeric else r'[a-zA-Z]*')
+            segment_a = segment_match.match(version_a, index_a).group(0)
+            segment_b = segment_match.match(version_b, index_b).group(0)
+            index_a += len(segment_a)
+            index_b += len(segment_b)
+
+            if segment_b == '':
+                return 1 if is_numeric else -1   # numeric segments are always newer than alphabetic ones
+
+            if is_numeric:
+                segment_a = segment_a.lstrip('0')
+                segment_b = segment_b.lstrip('0')
+                if len(segment_a) != len(segment_b):
+                    return 1 if len(segment_a) > len(segment_b) else -1
+
+            if segment_a != segment_b:
+                return 1 if segment_a > segment_b else -1
+
+        if index_a >= len(version_a) and index_b >= len(version_b):
+            return 0
+        return -1 if index_a >= len(version_a) else 1
+    # endregion
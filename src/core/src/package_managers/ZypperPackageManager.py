@@ -15,8 +15,13 @@
 # Requires Python 2.7+
 
 """ZypperPackageManager for SUSE"""
+import io
 import re
+import xml.etree.ElementTree as et
+from core.src.package_managers.AssessmentResultCache import AssessmentResultCache
+from core.src.package_managers.InstalledPackageSnapshot import InstalledPackageSnapshot
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.RepoRefreshCoordinator import RepoRefreshCoordinator
 from core.src.bootstrap.Constants import Constants
 
 
@@ -28,18 +33,28 @@ class ZypperPackageManager(PackageManager):
         # Repo refresh
         self.repo_clean = 'sudo zypper clean -a'
         self.repo_refresh = 'sudo zypper refresh'
+        self.repo_refresh_coordinator = RepoRefreshCoordinator(composite_logger)
 
         # Support to get updates and their dependencies
         self.zypper_check = 'sudo LANG=en_US.UTF8 zypper list-updates'
         self.zypper_check_security = 'sudo LANG=en_US.UTF8 zypper list-patches --category security'
         self.single_package_check_versions = 'LANG=en_US.UTF8 zypper search -s <PACKAGE-NAME>'
+        self.installed_packages_query_cmd = "rpm -qa --queryformat '%{NAME}\\t%|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
+        self.installed_package_snapshot = InstalledPackageSnapshot(env_layer, composite_logger, self.installed_packages_query_cmd, ['/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal'])
+        self.assessment_result_cache = AssessmentResultCache(composite_logger, ['/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal', '/var/cache/zypp/raw', '/var/cache/zypp/solv', '/etc/zypp/repos.d'])
         self.single_package_upgrade_simulation_cmd = 'sudo LANG=en_US.UTF8 zypper --non-interactive update --dry-run '
         self.zypper_install_security_patches_simulate = 'sudo LANG=en_US.UTF8 zypper --non-interactive patch --category security --dry-run'
 
+        self.zypper_xml_output_option = '--xmlout '  # machine-readable output; used when PKG_MGR_SETTING_XML_OUTPUT is set
+
         # Install update
         self.single_package_upgrade_cmd = 'sudo zypper --non-interactive update '
         self.zypper_install_security_patches = 'sudo zypper --non-interactive patch --category security'
 
+        # Download update (into the package cache, without installing)
+        self.download_only_cmd = 'sudo zypper --non-interactive update --download-only '
+        self.package_cache_paths = ['/var/cache/zypp/packages']
+
         # Package manager exit code(s)
         self.zypper_exitcode_ok = 0
         self.zypper_exitcode_zypper_updated = 103
@@ -47,19 +62,27 @@ class ZypperPackageManager(PackageManager):
         # Support to check for processes requiring restart
         self.zypper_ps = "sudo zypper ps -s"
 
+        # Read-only queries run at most once between package state changes
+        self.zypper_read_only_query_markers = [' list-updates', ' list-patches', ' search ', ' --dry-run']
+        self.read_only_query_cache = {}  # command -> (code, output)
+
         # Miscellaneous
         self.set_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY, Constants.ZYPPER)
 
-    def refresh_repo(self):
+    def refresh_repo(self, force=False, security_only=False):
+        self.repo_refresh_coordinator.refresh(self.__refresh_repo, self.get_repo_refresh_ttl_in_minutes(), force)
+
+    def __refresh_repo(self):
         self.composite_logger.log("Refreshing local repo...")
         # self.invoke_package_manager(self.repo_clean)  # purges local metadata for rebuild - addresses a possible customer environment error
         self.invoke_package_manager(self.repo_refresh)
+        self.invalidate_package_state_caches()
 
     # region Get Available Updates
-    def invoke_package_manager(self, command):
-        """Get missing updates using the command input"""
+    def invoke_package_manager(self, command, output_parser=None):
+        """Get missing updates using the command input. Read-only query results are cached, so output is buffered rather than streamed and an output parser runs on the full output."""
         self.composite_logger.log_debug('\nInvoking package manager using: ' + command)
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_command_output_or_cached(command)
         if code not in [self.zypper_exitcode_ok, self.zypper_exitcode_zypper_updated]:  # more known return codes should be added as appropriate
             self.composite_logger.log('[ERROR] Package manager was invoked using: ' + command)
             self.composite_logger.log_warning(" - Return code from package manager: " + str(code))
@@ -77,7 +100,28 @@ class ZypperPackageManager(PackageManager):
         if code == self.zypper_exitcode_zypper_updated:
             self.composite_logger.log_debug(" - Package manager update detected. Patch installation run will be repeated.")
             self.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, True)
-        return out
+        return output_parser(out) if output_parser is not None else out
+
+    def run_command_output_or_cached(self, command):
+        """Returns the cached result of a read-only query if the package state has not changed since it was run. Any other command is treated as a state change."""
+        if not self.is_read_only_query(command):
+            self.invalidate_read_only_query_cache()
+            return self.run_command_output_or_prefetched(command)
+
+        if command in self.read_only_query_cache:
+            self.composite_logger.log_debug(" - Returning cached result of read-only query.")
+            return self.read_only_query_cache[command]
+
+        code, out = self.run_command_output_or_prefetched(command)
+        if code in [self.zypper_exitcode_ok, self.zypper_exitcode_zypper_updated]:
+            self.read_only_query_cache[command] = (code, out)
+        return code, out
+
+    def is_read_only_query(self, command):
+        return any(marker in command for marker in self.zypper_read_only_query_markers)
+
+    def invalidate_read_only_query_cache(self):
+        self.read_only_query_cache = {}
 
     # region Classification-based (incl. All) update check
     def get_all_updates(self, cached=False):
@@ -87,20 +131,30 @@ class ZypperPackageManager(PackageManager):
             self.composite_logger.log_debug(" - Returning cached package data.")
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.zypper_check)
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES)
+        if cached_result is not None:
+            self.all_updates_cached, self.all_update_versions_cached = cached_result
+            return self.all_updates_cached, self.all_update_versions_cached
+
+        out = self.invoke_package_manager(self.get_zypper_command(self.zypper_check))
         self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_ALL_UPDATES, (self.all_updates_cached, self.all_update_versions_cached))
         self.composite_logger.log_debug("Discovered " + str(len(self.all_updates_cached)) + " package entries.")
         return self.all_updates_cached, self.all_update_versions_cached
 
     def get_security_updates(self):
         """Get missing security updates"""
         self.composite_logger.log_debug("\nDiscovering 'security' packages...")
+        cached_result = self.get_cached_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES)
+        if cached_result is not None:
+            return cached_result
+
         security_packages = []
         security_package_versions = []
 
         # Get all security packages
-        out = self.invoke_package_manager(self.zypper_install_security_patches_simulate)
-        packages_from_patch_data = self.extract_packages_from_patch_data(out)
+        out = self.invoke_package_manager(self.get_zypper_command(self.zypper_install_security_patches_simulate))
+        packages_from_patch_data = set(self.extract_packages_from_patch_data(out))  # membership checks only
 
         # Correlate and enrich with versions from all package data
         all_packages, all_package_versions = self.get_all_updates(True)
@@ -111,6 +165,7 @@ class ZypperPackageManager(PackageManager):
                 security_package_versions.append(all_package_versions[index])
                 self.composite_logger.log_debug(" - " + str(package) + " [" + str(all_package_versions[index]) + "]")
 
+        self.cache_assessment_result(Constants.ASSESSMENT_RESULT_SECURITY_UPDATES, (security_packages, security_package_versions))
         self.composite_logger.log_debug("Discovered " + str(len(security_packages)) + " 'security' package entries.\n")
         return security_packages, security_package_versions
 
@@ -121,8 +176,8 @@ class ZypperPackageManager(PackageManager):
         other_package_versions = []
 
         # Get all security packages
-        out = self.invoke_package_manager(self.zypper_install_security_patches_simulate)
-        packages_from_patch_data = self.extract_packages_from_patch_data(out)
+        out = self.invoke_package_manager(self.get_zypper_command(self.zypper_install_security_patches_simulate))
+        packages_from_patch_data = set(self.extract_packages_from_patch_data(out))  # membership checks only
 
         # SPECIAL CONDITION IF ZYPPER UPDATE IS DETECTED - UNAVOIDABLE SECURITY UPDATE(S) WILL BE INSTALLED AND THE RUN REPEATED FOR 'OTHER".
         if self.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, True):
@@ -142,8 +197,13 @@ class ZypperPackageManager(PackageManager):
 
         self.composite_logger.log_debug("Discovered " + str(len(other_packages)) + " 'other' package entries.\n")
         return other_packages, other_package_versions
+
+    def prepare_concurrent_discovery(self):
+        """Every zypper invocation takes the libzypp lock, and a second one fails fast (exit code 7) instead of waiting, so discovery is never run concurrently"""
+        return []
     # endregion
 
+
     # region Output Parser(s)
     def extract_packages_and_versions(self, output):
         """Returns packages and versions from given output"""
@@ -156,12 +216,14 @@ class ZypperPackageManager(PackageManager):
         # v | SLES12-SP2-Updates | kernel-default     | 4.4.38-93.1     | 4.4.49-92.11.1    | x86_64
         # v | SLES12-SP2-Updates | libgoa-1_0-0       | 3.20.4-7.2      | 3.20.5-9.6        | x86_64
 
+        if hasattr(output, 'find') and self.is_xml_output(output):
+            return self.extract_packages_and_versions_from_xml(output)
+
         self.composite_logger.log_debug("\nExtracting package and version data...")
         packages = []
         versions = []
 
-        lines = output.strip().split('\n')
-        for line in lines:
+        for line in self.get_output_lines(output):
             line_split = line.split(' | ')
             if len(line_split) == 6 and line_split[1].strip() != 'Repository':
                 package = line_split[2].strip()
@@ -176,12 +238,14 @@ class ZypperPackageManager(PackageManager):
 
     def extract_packages_from_patch_data(self, output):
         """Returns packages (sometimes with version information embedded) from patch data"""
+        if hasattr(output, 'find') and self.is_xml_output(output):
+            return self.extract_packages_from_patch_data_xml(output)
+
         self.composite_logger.log_debug("\nExtracting package entries from security patch data...")
         packages = []
         parser_seeing_packages_flag = False
 
-        lines = output.strip().split('\n')
-        for line in lines:
+        for line in self.get_output_lines(output):
             if "Warning: One of the installed patches affects the package manager itself. Run this command once more to install any other needed patches." in line:
                 self.composite_logger.log_debug(" - Package manager requires restart. Patch installation run will be repeated.")
                 self.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, True)
@@ -209,6 +273,80 @@ class ZypperPackageManager(PackageManager):
         self.composite_logger.log_debug("\nExtracted " + str(len(packages)) + " prospective package entries from security patch data.\n")
         return packages
     # endregion
+
+    # region XML Output Parser(s)
+    def get_zypper_command(self, cmd):
+        """Adds the XML output option to a zypper command if XML output is enabled"""
+        if not self.get_package_manager_setting(Constants.PKG_MGR_SETTING_XML_OUTPUT, False):
+            return cmd
+        return cmd.replace('zypper ', 'zypper ' + self.zypper_xml_output_option, 1)
+
+    @staticmethod
+    def is_xml_output(output):
+        """True if the output is a zypper XML stream. Table output (e.g. from older recordings) is parsed by the table parsers instead."""
+        return output.find('<?xml') > -1 and output.find('<stream>') > -1
+
+    def iterparse_xml_output(self, output, events=('end',)):
+        """Streams (event, element) pairs from zypper XML output. Anything ahead of the XML declaration (e.g. sudo warnings) is skipped."""
+        output = output[output.find('<?xml'):]
+        xml_stream = io.BytesIO(output if isinstance(output, bytes) else output.encode('utf-8'))
+        return et.iterparse(xml_stream, events=events)
+
+    def extract_packages_and_versions_from_xml(self, output):
+        """Returns packages and versions from 'zypper --xmlout list-updates' output"""
+        # <update kind="package" name="kernel-default" edition="4.4.49-92.11.1" arch="x86_64" edition-old="4.4.38-93.1"> ... </update>
+        packages = []
+        versions = []
+        for event, element in self.iterparse_xml_output(output):
+            if element.tag == 'update' and element.get('kind', 'package') == 'package':
+                packages.append(element.get('name'))
+                versions.append(element.get('edition'))
+                element.clear()
+
+        self.composite_logger.log_debug("\nExtracted " + str(len(packages)) + " package entries from XML output.")
+        return packages, versions
+
+    def extract_packages_from_patch_data_xml(self, output):
+        """Returns packages from 'zypper --xmlout patch --dry-run' output"""
+        for event, element in self.iterparse_xml_output(output):
+            if element.tag == 'message' and element.text is not None and 'affects the package manager itself' in element.text:
+                self.composite_logger.log_debug(" - Package manager requires restart. Patch installation run will be repeated.")
+                self.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, True)
+
+        packages = self.extract_packages_from_install_summary_xml(output)
+        self.composite_logger.log_debug("\nExtracted " + str(len(packages)) + " prospective package entries from security patch XML data.\n")
+        return packages
+
+    def extract_packages_from_install_summary_xml(self, output):
+        """Returns the packages a zypper install summary is going to install or upgrade"""
+        # <install-summary ...><to-upgrade><solvable type="package" name="man" edition="2.6.6-5.1" arch="x86_64" edition-old="2.6.6-4.1"/></to-upgrade></install-summary>
+        packages = []
+        section_depth = 0
+        for event, element in self.iterparse_xml_output(output, ('start', 'end')):
+            if element.tag in ('to-install', 'to-upgrade'):
+                section_depth += 1 if event == 'start' else -1
+            elif event == 'end' and element.tag == 'solvable':
+                if section_depth > 0 and element.get('type', 'package') == 'package' and element.get('name') not in packages:
+                    packages.append(element.get('name'))
+                element.clear()
+        return packages
+
+    def extract_package_versions_from_search_xml(self, output, package_name, include_installed, include_available):
+        """Returns versions of a package from 'zypper --xmlout search -s' output"""
+        # <solvable status="installed" name="bash" kind="package" edition="4.3-78.39" arch="x86_64" repository="SLES12-SP2-Pool"/>
+        package_versions = []
+        for event, element in self.iterparse_xml_output(output):
+            if element.tag != 'solvable':
+                continue
+            is_installed = element.get('status') == 'installed'
+            if element.get('name') == package_name and element.get('kind', 'package') == 'package' and \
+                    ((is_installed and include_installed) or (not is_installed and include_available)):
+                package_versions.append(element.get('edition'))
+            element.clear()
+
+        self.composite_logger.log_debug(" - Found " + str(len(package_versions)) + " matching versions in XML output: " + ", ".join(package_versions))
+        return package_versions
+    # endregion
     # endregion
 
     # region Install Update
@@ -227,6 +365,11 @@ class ZypperPackageManager(PackageManager):
     def is_package_version_installed(self, package_name, package_version):
         """ Returns true if the specific package version is installed """
         self.composite_logger.log_debug("\nCHECKING PACKAGE INSTALL STATUS FOR: " + str(package_name) + "(" + str(package_version) + ")")
+
+        is_installed = self.get_install_status_from_snapshot(package_name, package_version)
+        if is_installed is not None:
+            return is_installed
+
         installed_package_versions = self.get_all_available_versions_of_package_ex(package_name, include_installed=True, include_available=False)
         for version in installed_package_versions:
             if version == package_version:
@@ -247,10 +390,12 @@ class ZypperPackageManager(PackageManager):
         package_versions = []
 
         self.composite_logger.log_debug("\nGetting all available versions of package '" + package_name + "' [Installed=" + str(include_installed) + ", Available=" + str(include_available) + "]...")
-        cmd = self.single_package_check_versions.replace('<PACKAGE-NAME>', package_name)
+        cmd = self.get_zypper_command(self.single_package_check_versions.replace('<PACKAGE-NAME>', package_name))
         output = self.invoke_package_manager(cmd)
-        lines = output.strip().split('\n')
+        if self.is_xml_output(output):
+            return self.extract_package_versions_from_search_xml(output, package_name, include_installed, include_available)
 
+        lines = output.strip().split('\n')
         packages_list_flag = False
         for line in lines:
             if not packages_list_flag:  # keep going until the packages list starts
@@ -290,7 +435,7 @@ class ZypperPackageManager(PackageManager):
 
         return package_versions
 
-    def get_dependent_list(self, package_name):
+    def get_dependent_list(self, package_names):
         # Sample output for the cmd
         # 'sudo  LANG=en_US.UTF8 zypper --non-interactive update --dry-run man' is :
         #
@@ -313,12 +458,20 @@ class ZypperPackageManager(PackageManager):
         # After the operation, additional 85.1 MiB will be used.
         # Continue? [y/n/? shows all options] (y): y
 
-        self.composite_logger.log_debug("\nRESOLVING DEPENDENCIES USING COMMAND:: " + str(self.single_package_upgrade_simulation_cmd + package_name))
+        if type(package_names) is str:
+            package_names = [package_names]
+
+        cmd = self.get_zypper_command(self.single_package_upgrade_simulation_cmd + ' '.join(package_names))
+        self.composite_logger.log_debug("\nRESOLVING DEPENDENCIES USING COMMAND:: " + str(cmd))
         dependent_updates = []
 
-        output = self.invoke_package_manager(self.single_package_upgrade_simulation_cmd + package_name)
-        lines = output.strip().split('\n')
+        output = self.invoke_package_manager(cmd)
+        if self.is_xml_output(output):
+            dependent_updates = [package for package in self.extract_packages_from_install_summary_xml(output) if package not in package_names]
+            self.composite_logger.log_debug(str(len(dependent_updates)) + " dependent updates were found for package(s) '" + ', '.join(package_names) + "'.")
+            return dependent_updates
 
+        lines = output.strip().split('\n')
         for line in lines:
             if line.find(" going to be ") < 0:
                 self.composite_logger.log_debug(" - Inapplicable line: " + str(line))
@@ -327,11 +480,11 @@ class ZypperPackageManager(PackageManager):
             updates_line = lines[lines.index(line) + 1]
             dependent_package_names = re.split(r'\s+', updates_line)
             for dependent_package_name in dependent_package_names:
-                if len(dependent_package_name) != 0 and dependent_package_name != package_name:
+                if len(dependent_package_name) != 0 and dependent_package_name not in package_names:
                     self.composite_logger.log_debug(" - Dependency detected: " + dependent_package_name)
                     dependent_updates.append(dependent_package_name)
 
-        self.composite_logger.log_debug(str(len(dependent_updates)) + " dependent updates were found for package '" + package_name + "'.")
+        self.composite_logger.log_debug(str(len(dependent_updates)) + " dependent updates were found for package(s) '" + ', '.join(package_names) + "'.")
         return dependent_updates
 
     def get_product_name(self, package_name):
@@ -0,0 +1,123 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""In-memory patch records of a status summary, indexed by patch id"""
+import json
+
+
+class PatchStatusRecord(object):
+    """One entry of the 'patches' list of an assessment or installation summary"""
+    __slots__ = ('patch_id', 'name', 'version', 'classifications', 'state', 'json_fragment', 'escaped_json_fragment')
+
+    def __init__(self, patch_id, name, version, classifications, state=None):
+        self.patch_id = patch_id
+        self.name = name
+        self.version = version
+        self.classifications = classifications
+        self.state = state      # None if the record has no state field (assessment records only get one once updated)
+
+        # Serialized forms, cached until the record changes
+        self.json_fragment = None
+        self.escaped_json_fragment = None   # json_fragment as it reads inside a json string, e.g. a summary embedded in the status file
+
+    def update(self, classifications=None, state=None):
+        """ Updates the given fields. Records must only be changed through here, so cached serialized forms are dropped. """
+        if classifications is not None:
+            self.classifications = classifications
+        if state is not None:
+            self.state = state
+        self.json_fragment = None
+        self.escaped_json_fragment = None
+
+    def to_json(self, state_key):
+        """ Fields are in the order they have always been written """
+        patch = {
+            "patchId": self.patch_id,
+            "name": self.name,
+            "version": self.version,
+            "classifications": self.classifications
+        }
+        if self.state is not None:
+            patch[state_key] = self.state
+        return patch
+
+
+class PatchStatusRecords(object):
+    """Ordered patch records with a patch id index, so bulk status updates do not rescan the records for every package"""
+
+    def __init__(self, state_key):
+        self.state_key = state_key      # name of the state field in the status file, e.g. 'patchInstallationState'
+        self.json_placeholder = "{patches:" + state_key + "}"    # stands in for the records in a summary until they are inserted as json fragments
+        self.__records = []
+        self.__index_by_patch_id = {}   # patch id -> record
+
+    # region Access
+    def get(self, patch_id):
+        return self.__index_by_patch_id.get(patch_id)
+
+    def add(self, patch_id, name, version, classifications, state=None):
+        """ Appends a new record. Callers are expected to check get() first; patch ids are unique. """
+        record = PatchStatusRecord(patch_id, name, version, classifications, state)
+        self.__records.append(record)
+        self.__index_by_patch_id[patch_id] = record
+        return record
+
+    def clear(self):
+        self.__records = []
+        self.__index_by_patch_id = {}
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __iter__(self):
+        return iter(self.__records)
+    # endregion
+
+    # region Status file representation
+    def load(self, patches_json):
+        """ Replaces the records with the 'patches' list of a persisted summary """
+        self.clear()
+        for patch in patches_json:
+            if patch['patchId'] in self.__index_by_patch_id:
+                continue
+            self.add(patch['patchId'], patch['name'], patch['version'], patch['classifications'], patch.get(self.state_key))
+
+    def to_json(self):
+        """ Returns the 'patches' list of a summary, in insertion order """
+        return [record.to_json(self.state_key) for record in self.__records]
+
+    def get_json_fragment(self, escaped=False):
+        """ Returns the 'patches' list of a summary as serialized by json.dumps, assembled from the cached fragments of each record. Only records changed since the last call are serialized.
+            If escaped, the list is returned as it reads inside a json string, as summaries are embedded in the status file as strings. """
+        fragments = []
+        for record in self.__records:
+            if record.json_fragment is None:
+                record.json_fragment = json.dumps(record.to_json(self.state_key))
+            if escaped:
+                if record.escaped_json_fragment is None:
+                    record.escaped_json_fragment = json.dumps(record.json_fragment)[1:-1]
+                fragments.append(record.escaped_json_fragment)
+            else:
+                fragments.append(record.json_fragment)
+        return '[' + ', '.join(fragments) + ']'
+
+    def insert_escaped_json_fragment(self, document):
+        """ Summaries are embedded in the status file as json strings, so each patch record would be encoded and then escaped again on every write.
+            Instead, a summary carries json_placeholder for its patches, which is replaced here with the already escaped json fragments of the records. """
+        escaped_placeholder = json.dumps('"patches": ' + json.dumps(self.json_placeholder))[1:-1]
+        escaped_patches = json.dumps('"patches": ')[1:-1] + self.get_json_fragment(escaped=True)
+        return document.replace(escaped_placeholder, escaped_patches, 1)
+    # endregion
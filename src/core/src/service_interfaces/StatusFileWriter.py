@@ -0,0 +1,75 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Coalesces status file writes so that bursts of status updates reach the disk at a bounded rate"""
+import hashlib
+import os
+import shutil
+import time
+from core.src.service_interfaces.StatusDocumentCache import StatusDocumentCache
+
+
+class StatusFileWriter(object):
+    """Defers status file writes requested within the minimum write interval of the last one. Only the latest state is written once the interval has passed, or when a flush is forced."""
+
+    def __init__(self, env_layer, composite_logger, status_file_path, min_write_interval_in_seconds):
+        self.env_layer = env_layer
+        self.composite_logger = composite_logger
+        self.status_file_path = status_file_path
+        self.min_write_interval_in_seconds = min_write_interval_in_seconds    # 0 or less writes on every request
+
+        self.__pending_compose_delegate = None  # composes the status file content from the latest in-memory state; None if nothing is pending
+        self.__last_write_time = None
+        self.__last_written_content_hash = None
+
+        # Counters of avoided writes
+        self.write_count = 0
+        self.coalesced_write_count = 0  # requests superseded by a later request before being written
+        self.unchanged_write_count = 0  # writes skipped as the file already holds the same content
+
+    def write(self, compose_delegate, force=False):
+        """ Marks the status file as out of date. It is written right away if forced (e.g. on terminal transitions) or if the minimum write interval has passed since the last write. """
+        if self.__pending_compose_delegate is not None:
+            self.coalesced_write_count += 1
+        self.__pending_compose_delegate = compose_delegate
+
+        if force or self.__last_write_time is None or time.time() - self.__last_write_time >= self.min_write_interval_in_seconds:
+            self.flush()
+
+    def flush(self):
+        """ Writes out any pending status, unless the content is unchanged from what was last written """
+        if self.__pending_compose_delegate is None:
+            return
+
+        content = self.__pending_compose_delegate()
+        self.__pending_compose_delegate = None
+        content_hash = hashlib.sha256(content if isinstance(content, bytes) else content.encode('utf-8')).hexdigest()
+        if content_hash == self.__last_written_content_hash and os.path.isfile(self.status_file_path):
+            self.unchanged_write_count += 1
+            return
+
+        if os.path.isdir(self.status_file_path):
+            self.composite_logger.log_error("Core state file path returned a directory. Attempting to reset.")
+            shutil.rmtree(self.status_file_path)
+
+        self.env_layer.file_system.write_with_retry_using_temp_file(self.status_file_path, content, mode='w+')
+        StatusDocumentCache.invalidate(self.status_file_path)
+        self.__last_write_time = time.time()
+        self.__last_written_content_hash = content_hash
+        self.write_count += 1
+
+    def is_write_pending(self):
+        return self.__pending_compose_delegate is not None
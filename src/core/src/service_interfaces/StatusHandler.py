@@ -17,9 +17,11 @@
 import json
 import os
 import re
-import shutil
 import time
 from core.src.bootstrap.Constants import Constants
+from core.src.service_interfaces.PatchStatusRecords import PatchStatusRecords
+from core.src.service_interfaces.StatusDocumentCache import StatusDocumentCache
+from core.src.service_interfaces.StatusFileWriter import StatusFileWriter
 
 
 class StatusHandler(object):
@@ -33,6 +35,7 @@ class StatusHandler(object):
         self.telemetry_writer = telemetry_writer    # not used immediately but need to know if there are issues persisting status
         self.status_file_path = self.execution_config.status_file_path
         self.__log_file_path = self.execution_config.log_file_path
+        self.status_file_writer = StatusFileWriter(env_layer, composite_logger, self.status_file_path, Constants.STATUS_FILE_MIN_WRITE_INTERVAL_IN_SECONDS)
 
         # Status components
         self.__high_level_status_message = ""
@@ -40,7 +43,7 @@ class StatusHandler(object):
         # Internal in-memory representation of Patch Installation data
         self.__installation_substatus_json = None
         self.__installation_summary_json = None
-        self.__installation_packages = []
+        self.__installation_packages = PatchStatusRecords('patchInstallationState')
         self.__installation_errors = []
         self.__installation_total_error_count = 0  # All errors during install, includes errors not in error objects due to size limit
         self.__maintenance_window_exceeded = False
@@ -49,9 +52,11 @@ class StatusHandler(object):
         # Internal in-memory representation of Patch Assessment data
         self.__assessment_substatus_json = None
         self.__assessment_summary_json = None
-        self.__assessment_packages = []
+        self.__assessment_packages = PatchStatusRecords('patchState')
         self.__assessment_errors = []
         self.__assessment_total_error_count = 0  # All errors during assess, includes errors not in error objects due to size limit
+        self.__assessment_prestaged_downloads = None
+        self.__assessment_snapshot = None
 
         # Internal in-memory representation of Patch Metadata for HealthStore
         self.__metadata_for_healthstore_substatus_json = None
@@ -87,29 +92,37 @@ class StatusHandler(object):
     # region - Package Data
     def reset_assessment_data(self):
         """ Externally available method to wipe out any assessment package records in memory. """
-        self.__assessment_packages = []
+        self.__assessment_packages.clear()
+        self.__assessment_prestaged_downloads = None
+        self.__assessment_snapshot = None
+
+    def set_prestaged_downloads(self, package_count, byte_count):
+        """ Externally available method to record the update payloads pre-staged into the package cache during assessment. Written with the next assessment substatus. """
+        self.composite_logger.log_debug("Setting pre-staged downloads. [PackageCount={0}][Bytes={1}]".format(str(package_count), str(byte_count)))
+        self.__assessment_prestaged_downloads = {
+            "packageCount": package_count,
+            "bytes": byte_count
+        }
+
+    def set_assessment_snapshot(self, is_cache_hit, age_in_seconds):
+        """ Externally available method to record whether the assessment was answered from the snapshot persisted by an earlier operation. Written with the next assessment substatus. """
+        self.composite_logger.log_debug("Setting assessment snapshot. [CacheHit={0}][AgeInSeconds={1}]".format(str(is_cache_hit), str(age_in_seconds)))
+        self.__assessment_snapshot = {
+            "cacheHit": is_cache_hit,
+            "ageInSeconds": age_in_seconds
+        }
 
     def set_package_assessment_status(self, package_names, package_versions, classification="Other", status="Available"):
         """ Externally available method to set assessment status for one or more packages of the **SAME classification and status** """
         self.composite_logger.log_debug("Setting package assessment status in bulk. [Count={0}]".format(str(len(package_names))))
         for package_name, package_version in zip(package_names, package_versions):
-            patch_already_saved = False
             patch_id = self.__get_patch_id(package_name, package_version)
-            for i in range(0, len(self.__assessment_packages)):
-                if patch_id == self.__assessment_packages[i]['patchId']:
-                    patch_already_saved = True
-                    self.__assessment_packages[i]['classifications'] = [classification]
-                    self.__assessment_packages[i]['patchState'] = status
-
-            if patch_already_saved is False:
-                record = {
-                    "patchId": str(patch_id),
-                    "name": str(package_name),
-                    "version": str(package_version),
-                    "classifications": [classification]
-                    # "patchState": str(status) # Allows for capturing 'Installed' packages in addition to 'Available', when commented out, if spec changes
-                }
-                self.__assessment_packages.append(record)
+            record = self.__assessment_packages.get(patch_id)
+            if record is not None:
+                record.update([classification], status)
+            else:
+                # status is not recorded for new records (state=str(status) allows for capturing 'Installed' packages in addition to 'Available', if spec changes)
+                self.__assessment_packages.add(str(patch_id), str(package_name), str(package_version), [classification])
 
         self.set_assessment_substatus_json()
 
@@ -127,26 +140,14 @@ class StatusHandler(object):
 
         for package_name, package_version in zip(package_names, package_versions):
             self.composite_logger.log_debug("Logging progress [Package: " + package_name + "; Status: " + status + "]")
-            patch_already_saved = False
             patch_id = self.__get_patch_id(package_name, package_version)
-            for i in range(0, len(self.__installation_packages)):
-                if patch_id == self.__installation_packages[i]['patchId']:
-                    patch_already_saved = True
-                    if classification is not None:
-                        self.__installation_packages[i]['classifications'] = [classification]
-                    self.__installation_packages[i]['patchInstallationState'] = status
-
-            if patch_already_saved is False:
+            record = self.__installation_packages.get(patch_id)
+            if record is not None:
+                record.update([classification] if classification is not None else None, status)
+            else:
                 if classification is None:
                     classification = "Other"
-                record = {
-                    "patchId": str(patch_id),
-                    "name": str(package_name),
-                    "version": str(package_version),
-                    "classifications": [classification],
-                    "patchInstallationState": str(status)
-                }
-                self.__installation_packages.append(record)
+                self.__installation_packages.add(str(patch_id), str(package_name), str(package_version), [classification], str(status))
 
         self.set_installation_substatus_json()
 
@@ -184,6 +185,8 @@ class StatusHandler(object):
         self.composite_logger.log_debug("Setting new installation reboot status. [NewRebootStatus={0}] [CurrentRebootStatus={1}]".format(str(new_reboot_status), self.__installation_reboot_status))
         self.__installation_reboot_status = new_reboot_status
         self.set_installation_substatus_json()
+        if new_reboot_status == Constants.RebootStatus.STARTED:
+            self.flush_status_file()    # the machine is about to go down
 
     def __refresh_installation_reboot_status(self):
         """ Discovers if the system needs a reboot. Never allows going back to NotNeeded (deliberate). ONLY called internally. """
@@ -210,16 +213,16 @@ class StatusHandler(object):
         """ Prepare the assessment substatus json including the message containing assessment summary """
         self.composite_logger.log_debug("Setting assessment substatus. [Substatus={0}]".format(str(status)))
 
-        # Wrap patches into assessment summary
+        # Wrap patches into assessment summary (patches are inserted from their cached json fragments when the status file is composed)
         self.__assessment_summary_json = self.__new_assessment_summary_json(self.__assessment_packages)
 
         # Wrap assessment summary into assessment substatus
         self.__assessment_substatus_json = self.__new_substatus_json_for_operation(Constants.PATCH_ASSESSMENT_SUMMARY, status, code, json.dumps(self.__assessment_summary_json))
 
-        # Update status on disk
-        self.__write_status_file()
+        # Update status on disk (right away for terminal substatus)
+        self.__write_status_file(force=(status != Constants.STATUS_TRANSITIONING))
 
-    def __new_assessment_summary_json(self, assessment_packages_json):
+    def __new_assessment_summary_json(self, assessment_packages):
         """ Called by: set_assessment_substatus_json
             Purpose: This composes the message inside the patch assessment summary substatus:
                 Root --> Status --> Substatus [name: "PatchAssessmentSummary"] --> FormattedMessage --> **Message** """
@@ -227,39 +230,44 @@ class StatusHandler(object):
         # Calculate summary
         critsec_patch_count = 0
         other_patch_count = 0
-        for i in range(0, len(assessment_packages_json)):
-            classifications = assessment_packages_json[i]['classifications']
+        for record in assessment_packages:
+            classifications = record.classifications
             if "Critical" in classifications or "Security" in classifications:
                 critsec_patch_count += 1
             else:
                 other_patch_count += 1
 
         # Compose substatus message
-        return {
+        assessment_summary_json = {
             "assessmentActivityId": str(self.execution_config.activity_id),
             "rebootPending": self.is_reboot_pending,
             "criticalAndSecurityPatchCount": critsec_patch_count,
             "otherPatchCount": other_patch_count,
-            "patches": assessment_packages_json,
+            "patches": assessment_packages.json_placeholder,
             "startTime": str(self.execution_config.start_time),
             "lastModifiedTime": str(self.env_layer.datetime.timestamp()),
             "errors": self.__set_errors_json(self.__assessment_total_error_count, self.__assessment_errors)
         }
+        if self.__assessment_prestaged_downloads is not None:
+            assessment_summary_json["prestagedDownloads"] = self.__assessment_prestaged_downloads
+        if self.__assessment_snapshot is not None:
+            assessment_summary_json["assessmentSnapshot"] = self.__assessment_snapshot
+        return assessment_summary_json
 
     def set_installation_substatus_json(self, status=Constants.STATUS_TRANSITIONING, code=0):
         """ Prepare the deployment substatus json including the message containing deployment summary """
         self.composite_logger.log_debug("Setting installation substatus. [Substatus={0}]".format(str(status)))
 
-        # Wrap patches into installation summary
+        # Wrap patches into installation summary (patches are inserted from their cached json fragments when the status file is composed)
         self.__installation_summary_json = self.__new_installation_summary_json(self.__installation_packages)
 
         # Wrap deployment summary into installation substatus
         self.__installation_substatus_json = self.__new_substatus_json_for_operation(Constants.PATCH_INSTALLATION_SUMMARY, status, code, json.dumps(self.__installation_summary_json))
 
-        # Update status on disk
-        self.__write_status_file()
+        # Update status on disk (right away for terminal substatus)
+        self.__write_status_file(force=(status != Constants.STATUS_TRANSITIONING))
 
-    def __new_installation_summary_json(self, installation_packages_json):
+    def __new_installation_summary_json(self, installation_packages):
         """ Called by: set_installation_substatus_json
             Purpose: This composes the message inside the patch installation summary substatus:
                 Root --> Status --> Substatus [name: "PatchInstallationSummary"] --> FormattedMessage --> **Message** """
@@ -270,8 +278,8 @@ class StatusHandler(object):
         pending_patch_count = 0
         installed_patch_count = 0
         failed_patch_count = 0
-        for i in range(0, len(installation_packages_json)):
-            patch_installation_state = installation_packages_json[i]['patchInstallationState']
+        for record in installation_packages:
+            patch_installation_state = record.state
             if patch_installation_state == Constants.NOT_SELECTED:
                 not_selected_patch_count += 1
             elif patch_installation_state == Constants.EXCLUDED:
@@ -298,7 +306,7 @@ class StatusHandler(object):
             "pendingPatchCount": pending_patch_count,
             "installedPatchCount": installed_patch_count,
             "failedPatchCount": failed_patch_count,
-            "patches": installation_packages_json,
+            "patches": installation_packages.json_placeholder,
             "startTime": str(self.execution_config.start_time),
             "lastModifiedTime": str(self.env_layer.datetime.timestamp()),
             "errors": self.__set_errors_json(self.__installation_total_error_count, self.__installation_errors)
@@ -314,8 +322,8 @@ class StatusHandler(object):
         # Wrap healthstore summary into healthstore substatus
         self.__metadata_for_healthstore_substatus_json = self.__new_substatus_json_for_operation(Constants.PATCH_METADATA_FOR_HEALTHSTORE, status, code, json.dumps(self.__metadata_for_healthstore_summary_json))
 
-        # Update status on disk
-        self.__write_status_file()
+        # Update status on disk (right away if HealthStore is going to read it)
+        self.__write_status_file(force=(status != Constants.STATUS_TRANSITIONING or wait_after_update))
 
         # wait period required in cases where we need to ensure HealthStore reads the status from GA
         if wait_after_update:
@@ -349,6 +357,7 @@ class StatusHandler(object):
     # region - Status generation
     def __reset_status_file(self):
         self.env_layer.file_system.write_with_retry(self.status_file_path, '[{0}]'.format(json.dumps(self.__new_basic_status_json())), mode='w+')
+        StatusDocumentCache.invalidate(self.status_file_path)
 
     def __new_basic_status_json(self):
         return {
@@ -378,12 +387,14 @@ class StatusHandler(object):
         # Initializing records safely
         self.__installation_substatus_json = None
         self.__installation_summary_json = None
-        self.__installation_packages = []
+        self.__installation_packages.clear()
         self.__installation_errors = []
         self.__assessment_substatus_json = None
         self.__assessment_summary_json = None
-        self.__assessment_packages = []
+        self.__assessment_packages.clear()
         self.__assessment_errors = []
+        self.__assessment_prestaged_downloads = None
+        self.__assessment_snapshot = None
         self.__metadata_for_healthstore_substatus_json = None
         self.__metadata_for_healthstore_summary_json = None
 
@@ -392,17 +403,9 @@ class StatusHandler(object):
             self.__reset_status_file()
             return
 
-        # Read the status file - raise exception on persistent failure
-        for i in range(0, Constants.MAX_FILE_OPERATION_RETRY_COUNT):
-            try:
-                with self.env_layer.file_system.open(self.status_file_path, 'r') as file_handle:
-                    status_file_data_raw = json.load(file_handle)[0]    # structure is array of 1
-            except Exception as error:
-                if i < Constants.MAX_FILE_OPERATION_RETRY_COUNT:
-                    time.sleep(i + 1)
-                else:
-                    self.composite_logger.log_error("Unable to read status file (retries exhausted). Error: {0}.".format(repr(error)))
-                    raise
+        # Read the status file, unless it is unchanged since it was last loaded - raise exception on persistent failure
+        status_file_document, status_file_messages = StatusDocumentCache.load(self.status_file_path, self.__read_status_file)
+        status_file_data_raw = status_file_document[0]    # structure is array of 1
 
         # Load status data and sanity check structure - raise exception if data loss risk is detected on corrupt data
         try:
@@ -421,47 +424,72 @@ class StatusHandler(object):
             name = status_file_data['status']['substatus'][i]['name']
             if name == Constants.PATCH_INSTALLATION_SUMMARY:     # if it exists, it must be to spec, or an exception will get thrown
                 message = status_file_data['status']['substatus'][i]['formattedMessage']['message']
-                self.__installation_summary_json = json.loads(message)
-                self.__installation_packages = self.__installation_summary_json['patches']
+                self.__installation_summary_json = status_file_messages[name] if name in status_file_messages else json.loads(message)
+                self.__installation_packages.load(self.__installation_summary_json['patches'])
                 self.__maintenance_window_exceeded = bool(self.__installation_summary_json['maintenanceWindowExceeded'])
                 self.__installation_reboot_status = self.__installation_summary_json['rebootStatus']
                 errors = self.__installation_summary_json['errors']
                 if errors is not None and errors['details'] is not None:
-                    self.__installation_errors = errors['details']
+                    self.__installation_errors = list(errors['details'])    # the loaded status is shared through StatusDocumentCache
                     self.__installation_total_error_count = self.__get_total_error_count_from_prev_status(errors['message'])
             if name == Constants.PATCH_ASSESSMENT_SUMMARY:     # if it exists, it must be to spec, or an exception will get thrown
                 message = status_file_data['status']['substatus'][i]['formattedMessage']['message']
-                self.__assessment_summary_json = json.loads(message)
-                self.__assessment_packages = self.__assessment_summary_json['patches']
+                self.__assessment_summary_json = status_file_messages[name] if name in status_file_messages else json.loads(message)
+                self.__assessment_packages.load(self.__assessment_summary_json['patches'])
+                self.__assessment_prestaged_downloads = self.__assessment_summary_json.get('prestagedDownloads')
+                self.__assessment_snapshot = self.__assessment_summary_json.get('assessmentSnapshot')
                 errors = self.__assessment_summary_json['errors']
                 if errors is not None and errors['details'] is not None:
-                    self.__assessment_errors = errors['details']
+                    self.__assessment_errors = list(errors['details'])    # the loaded status is shared through StatusDocumentCache
                     self.__assessment_total_error_count = self.__get_total_error_count_from_prev_status(errors['message'])
             if name == Constants.PATCH_METADATA_FOR_HEALTHSTORE:     # if it exists, it must be to spec, or an exception will get thrown
                 message = status_file_data['status']['substatus'][i]['formattedMessage']['message']
-                self.__metadata_for_healthstore_summary_json = json.loads(message)
+                self.__metadata_for_healthstore_summary_json = status_file_messages[name] if name in status_file_messages else json.loads(message)
 
-    def __write_status_file(self):
-        """ Composes and writes the status file from **already up-to-date** in-memory data.
-            This is usually the final call to compose and persist after an in-memory data update in a specialized method.
+    def __read_status_file(self):
+        """ Reads and parses the status file - raises an exception on persistent failure """
+        for i in range(0, Constants.MAX_FILE_OPERATION_RETRY_COUNT):
+            try:
+                with self.env_layer.file_system.open(self.status_file_path, 'r') as file_handle:
+                    return json.load(file_handle)
+            except Exception as error:
+                if i < Constants.MAX_FILE_OPERATION_RETRY_COUNT - 1:
+                    time.sleep(i + 1)
+                else:
+                    self.composite_logger.log_error("Unable to read status file (retries exhausted). Error: {0}.".format(repr(error)))
+                    raise
+
+    def flush_status_file(self, log_write_counts=False):
+        """ Externally available method to write out status updates deferred by the status file writer. Called ahead of long-running package manager commands and on exit. """
+        self.status_file_writer.flush()
+        if log_write_counts:
+            self.composite_logger.log_debug("Status file writes. [Written={0}][Coalesced={1}][Unchanged={2}]".format(str(self.status_file_writer.write_count), str(self.status_file_writer.coalesced_write_count), str(self.status_file_writer.unchanged_write_count)))
+
+    def __write_status_file(self, force=False):
+        """ Requests a status file write. Writes within STATUS_FILE_MIN_WRITE_INTERVAL_IN_SECONDS of the last one are coalesced, unless forced. """
+        self.status_file_writer.write(self.__compose_status_file, force)
+
+    def __compose_status_file(self):
+        """ Composes the status file from **already up-to-date** in-memory data.
+            Called by the status file writer when a write goes out, so deferred writes always carry the latest in-memory data.
 
             Pseudo-composition (including steps prior):
             [__new_basic_status_json()]
                 assessment_substatus_json == set_assessment_substatus_json()
                     __new_substatus_json_for_operation()
                     __new_assessment_summary_json() with external data --
-                        assessment_packages
+                        assessment_packages (as a placeholder, see PatchStatusRecords.insert_escaped_json_fragment)
                         errors
 
                 installation_substatus_json == set_installation_substatus_json
                     __new_substatus_json_for_operation
                     __new_installation_summary_json with external data --
-                        installation_packages
+                        installation_packages (as a placeholder, see PatchStatusRecords.insert_escaped_json_fragment)
                         maintenance_window_exceeded
                         __refresh_installation_reboot_status
                         errors
 
-        :return: None
+        :return: Status file content
         """
         status_file_payload = self.__new_basic_status_json()
         status_file_payload['status']['formattedMessage']['message'] = str(self.__high_level_status_message)
@@ -472,11 +500,13 @@ class StatusHandler(object):
             status_file_payload['status']['substatus'].append(self.__installation_substatus_json)
         if self.__metadata_for_healthstore_substatus_json is not None:
             status_file_payload['status']['substatus'].append(self.__metadata_for_healthstore_substatus_json)
-        if os.path.isdir(self.status_file_path):
-            self.composite_logger.log_error("Core state file path returned a directory. Attempting to reset.")
-            shutil.rmtree(self.status_file_path)
 
-        self.env_layer.file_system.write_with_retry_using_temp_file(self.status_file_path, '[{0}]'.format(json.dumps(status_file_payload)), mode='w+')
+        status_file_content = '[{0}]'.format(json.dumps(status_file_payload))
+        if self.__assessment_substatus_json is not None:
+            status_file_content = self.__assessment_packages.insert_escaped_json_fragment(status_file_content)
+        if self.__installation_substatus_json is not None:
+            status_file_content = self.__installation_packages.insert_escaped_json_fragment(status_file_content)
+        return status_file_content
     # endregion
 
     # region - Error objects
@@ -15,6 +15,7 @@
 # Requires Python 2.7+
 import json
 import os
+import shutil
 import unittest
 from core.src.bootstrap.Constants import Constants
 from core.tests.library.ArgumentComposer import ArgumentComposer
@@ -35,6 +36,13 @@ class TestAptitudePackageManager(unittest.TestCase):
     def mock_write_with_retry_raise_exception(self):
         raise Exception
 
+    def mock_run_command_output_installed_packages_query(self, cmd, no_output=False, chk_err=True):
+        self.installed_packages_query_count += 1
+        return 0, "mysql-server\t5.7.25-0ubuntu0.16.04.2\tinstall ok installed\tamd64\n" + \
+                  "mysql-client\t5.7.25-0ubuntu0.16.04.2\tdeinstall ok config-files\tamd64\n" + \
+                  "libc6\t2.23-0ubuntu10\thold ok installed\tamd64\n" + \
+                  "libc6\t2.23-0ubuntu9\tinstall ok installed\ti386\n"
+
     def test_package_manager_no_updates(self):
         """Unit test for aptitude package manager with no updates"""
         self.runtime.set_legacy_test_type('SadPath')
@@ -80,6 +88,223 @@ class TestAptitudePackageManager(unittest.TestCase):
         self.assertEqual(package_versions[1], '4.3-14ubuntu1.2')
         self.assertEqual(package_versions[2], '4.3-14ubuntu1')
 
+    def test_classification_by_origin(self):
+        """Unit test for security/other classification from a single dist-upgrade simulation"""
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+        self.assertFalse(package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, False))   # opt-in
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, True)
+
+        output = "Inst coreutils [8.25-2ubuntu2] (8.25-2ubuntu3~16.10 Ubuntu:16.10/yakkety-updates [amd64])\n" + \
+                 "Inst python3-update-manager [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-updates, Ubuntu:16.10/yakkety-security [all]) [update-manager-core:amd64 ]\n" + \
+                 "Inst update-manager-core [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-security [all])\n"
+        packages, versions, origins = package_manager.extract_packages_versions_and_origins(output)
+        self.assertEqual(packages, ["coreutils", "python3-update-manager", "update-manager-core"])
+        self.assertEqual(versions, ["8.25-2ubuntu3~16.10", "1:16.10.8", "1:16.10.8"])
+        self.assertFalse(package_manager.is_security_origin(origins[0]))
+        self.assertTrue(package_manager.is_security_origin(origins[1]))
+        self.assertTrue(package_manager.is_security_origin(origins[2]))
+
+        # all packages in the simulation come from a security pocket
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        self.assertEqual(len(security_packages), 3)
+        self.assertEqual(security_package_versions[0], "2:4.4.5+dfsg-2ubuntu5.4")
+        other_packages, other_package_versions = package_manager.get_other_updates()
+        self.assertEqual(len(other_packages), 0)
+
+    def test_security_updates_by_newer_origins(self):
+        package_manager = self.container.get('package_manager')
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CLASSIFY_BY_ORIGIN, True)
+        package_manager.all_updates_cached = ["coreutils", "update-manager-core", "libc6:i386"]
+        package_manager.all_update_versions_cached = ["8.25-2ubuntu3~16.10", "1:16.10.8", "2.23-0ubuntu10"]
+        package_manager.all_update_origins_cached = ["Ubuntu:16.10/yakkety-updates", "Ubuntu:16.10/yakkety-security", "Ubuntu:16.10/yakkety-updates"]
+        policy_output = "coreutils:\n  Installed: 8.25-2ubuntu2\n  Candidate: 8.25-2ubuntu3~16.10\n  Version table:\n" + \
+                        "     8.25-2ubuntu3~16.10 500\n        500 http://archive.ubuntu.com/ubuntu yakkety-updates/main amd64 Packages\n" + \
+                        "     8.25-2ubuntu2.1 500\n        500 http://security.ubuntu.com/ubuntu yakkety-security/main amd64 Packages\n" + \
+                        " *** 8.25-2ubuntu2 100\n        100 /var/lib/dpkg/status\n" + \
+                        "libc6:i386:\n  Installed: 2.23-0ubuntu9\n  Candidate: 2.23-0ubuntu10\n  Version table:\n" + \
+                        "     2.23-0ubuntu10 500\n        500 http://archive.ubuntu.com/ubuntu yakkety-updates/main i386 Packages\n" + \
+                        " *** 2.23-0ubuntu9 100\n        100 /var/lib/dpkg/status\n" + \
+                        "     2.23-0ubuntu3 500\n        500 http://security.ubuntu.com/ubuntu yakkety-security/main i386 Packages\n"
+        commands = []
+        self.runtime.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=True: commands.append(cmd) or (0, policy_output)
+
+        # a candidate from elsewhere still brings in the fix of a newer security version, but an older one does not count
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        self.assertEqual(security_packages, ["coreutils", "update-manager-core"])
+        self.assertEqual(commands, ["LANG=en_US.UTF8 apt-cache policy coreutils libc6:i386"])
+
+    def test_security_sources_from_deb822(self):
+        package_manager = self.container.get('package_manager')
+        self.runtime.write_to_file(os.path.join(self.runtime.execution_config.config_folder, "ubuntu.sources"),
+                                   "# comment\nTypes: deb\nURIs: http://archive.ubuntu.com/ubuntu\nSuites: noble noble-updates\nComponents: main universe\n" +
+                                   "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n\n" +
+                                   "Types: deb deb-src\nURIs: http://security.ubuntu.com/ubuntu\nSuites: noble-security\nComponents: main universe\n" +
+                                   "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\nArchitectures: amd64 i386\n\n" +
+                                   "Enabled: no\nTypes: deb\nURIs: http://security.ubuntu.com/ubuntu\nSuites: jammy-security\nComponents: main\n")
+        self.runtime.write_to_file(os.path.join(self.runtime.execution_config.config_folder, "vendor.sources"),
+                                   "Types: deb\nURIs: https://vendor.example.com/security\nSuites: ./\nSigned-By:\n -----BEGIN PGP PUBLIC KEY BLOCK-----\n .\n -----END PGP PUBLIC KEY BLOCK-----\n")
+        self.runtime.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=True: (1, "")     # no one-line security entries
+
+        self.assertTrue(package_manager.prepare_security_sources_list())
+        with open(package_manager.security_sources_list, 'r') as file_handle:
+            entries = [line for line in file_handle.read().splitlines() if line != ""]
+        self.assertEqual(entries, ["deb [arch=amd64,i386 signed-by=/usr/share/keyrings/ubuntu-archive-keyring.gpg] http://security.ubuntu.com/ubuntu noble-security main universe",
+                                   "deb-src [arch=amd64,i386 signed-by=/usr/share/keyrings/ubuntu-archive-keyring.gpg] http://security.ubuntu.com/ubuntu noble-security main universe",
+                                   "deb https://vendor.example.com/security ./"])
+
+        package_manager.deb822_sources_path_pattern = os.path.join(self.runtime.execution_config.config_folder, "*.missing")
+        self.assertFalse(package_manager.prepare_security_sources_list())
+
+    def test_compare_debian_versions(self):
+        package_manager = self.container.get('package_manager')
+        compare_versions = package_manager.native_assessment_engine.compare_versions
+
+        self.assertEqual(compare_versions('1.0-1', '1.0-1'), 0)
+        self.assertEqual(compare_versions('1.0', '1.0-0'), 0)
+        self.assertEqual(compare_versions('1:1.0', '2.0'), 1)
+        self.assertEqual(compare_versions('1.10', '1.9'), 1)
+        self.assertEqual(compare_versions('1.0~rc1', '1.0'), -1)
+        self.assertEqual(compare_versions('1.0a', '1.0+'), -1)
+        self.assertEqual(compare_versions('1.0-1ubuntu1', '1.0-1'), 1)
+        self.assertEqual(compare_versions('8.25-2ubuntu3~16.10', '8.25-2ubuntu2'), 1)
+        self.assertEqual(compare_versions('2.23-0ubuntu10', '2.23-0ubuntu9'), 1)
+        self.assertEqual(compare_versions('007', '7'), 0)
+        self.assertEqual(compare_versions('1.0a1', '1.0ab'), -1)
+        self.assertEqual(compare_versions('2.0b1', '2.0be'), -1)
+        self.assertEqual(compare_versions('1.0+dfsg1', '1.0+dfsga'), -1)
+        self.assertEqual(compare_versions('1.0ab', '1.0a1'), 1)
+
+    def test_native_assessment(self):
+        package_manager = self.container.get('package_manager')
+        test_folder = os.path.join(self.runtime.execution_config.config_folder, "native_assessment")
+        lists_folder = os.path.join(test_folder, "lists")
+        os.makedirs(lists_folder)
+        package_manager.native_assessment_engine.dpkg_status_path = os.path.join(test_folder, "status")
+        package_manager.native_assessment_engine.apt_lists_path = lists_folder
+        package_manager.native_assessment_engine.apt_preferences_paths = [os.path.join(test_folder, "preferences"), os.path.join(test_folder, "preferences.d")]
+
+        self.runtime.write_to_file(package_manager.native_assessment_engine.dpkg_status_path,
+                                   "Package: dpkg\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1.18.4ubuntu1\n\n" +
+                                   "Package: coreutils\nStatus: install ok installed\nArchitecture: amd64\nVersion: 8.25-2ubuntu2\nDescription: GNU core utilities\n This package contains the basic utilities.\n\n" +
+                                   "Package: update-manager-core\nStatus: install ok installed\nArchitecture: all\nVersion: 1:16.10.7\n\n" +
+                                   "Package: libc6\nStatus: install ok installed\nArchitecture: i386\nVersion: 2.23-0ubuntu9\n\n" +
+                                   "Package: mysql-server\nStatus: hold ok installed\nArchitecture: amd64\nVersion: 5.7.21-1ubuntu1\n\n" +
+                                   "Package: removed-package\nStatus: deinstall ok config-files\nArchitecture: amd64\nVersion: 1.0\n")
+        self.runtime.write_to_file(os.path.join(lists_folder, "archive.ubuntu.com_ubuntu_dists_yakkety-updates_main_binary-amd64_Packages"),
+                                   "Package: coreutils\nArchitecture: amd64\nVersion: 8.25-2ubuntu3~16.10\n\n" +
+                                   "Package: update-manager-core\nArchitecture: all\nVersion: 1:16.10.8\n\n" +
+                                   "Package: mysql-server\nArchitecture: amd64\nVersion: 5.7.25-0ubuntu0.16.04.2\n\n" +
+                                   "Package: removed-package\nArchitecture: amd64\nVersion: 2.0\n")
+        self.runtime.write_to_file(os.path.join(lists_folder, "security.ubuntu.com_ubuntu_dists_yakkety-security_main_binary-amd64_Packages"),
+                                   "Package: update-manager-core\nArchitecture: all\nVersion: 1:16.10.8\n\n" +
+                                   "Package: coreutils\nArchitecture: amd64\nVersion: 8.25-2ubuntu2\n")
+        self.runtime.write_to_file(os.path.join(lists_folder, "archive.ubuntu.com_ubuntu_dists_yakkety_main_binary-i386_Packages"),
+                                   "Package: libc6\nArchitecture: i386\nVersion: 2.23-0ubuntu10\n")
+        self.runtime.write_to_file(os.path.join(lists_folder, "archive.ubuntu.com_ubuntu_dists_yakkety-backports_main_binary-amd64_Packages"),
+                                   "Package: coreutils\nArchitecture: amd64\nVersion: 8.26-1\n")
+        self.runtime.write_to_file(os.path.join(lists_folder, "archive.ubuntu.com_ubuntu_dists_yakkety-backports_InRelease"),
+                                   "-----BEGIN PGP SIGNED MESSAGE-----\nHash: SHA256\n\nOrigin: Ubuntu\nSuite: yakkety-backports\nNotAutomatic: yes\nButAutomaticUpgrades: yes\n")
+
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, True)
+        packages, package_versions = package_manager.get_all_updates()
+        self.assertEqual(packages, ["coreutils", "libc6:i386", "update-manager-core"])
+        self.assertEqual(package_versions, ["8.25-2ubuntu3~16.10", "2.23-0ubuntu10", "1:16.10.8"])
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        self.assertEqual(security_packages, ["update-manager-core"])
+
+        # the cross-check keeps the simulation authoritative and reports the difference
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, True)
+        packages, package_versions = package_manager.get_all_updates()
+        self.assertEqual(len(packages), 3)
+        self.assertEqual(package_versions[0], "2:4.4.5+dfsg-2ubuntu5.4")
+        self.assertFalse(package_manager.cross_check_native_assessment(["coreutils"], ["8.25-2ubuntu3~16.10"]))
+        self.assertTrue(package_manager.cross_check_native_assessment(packages, package_versions))
+
+        shutil.rmtree(test_folder)
+
+    def test_native_assessment_new_dependencies(self):
+        package_manager = self.container.get('package_manager')
+        engine = package_manager.native_assessment_engine
+        test_folder = os.path.join(self.runtime.execution_config.config_folder, "native_assessment")
+        lists_folder = os.path.join(test_folder, "lists")
+        os.makedirs(os.path.join(test_folder, "preferences.d"))
+        os.makedirs(lists_folder)
+        engine.dpkg_status_path = os.path.join(test_folder, "status")
+        engine.apt_lists_path = lists_folder
+        engine.apt_preferences_paths = [os.path.join(test_folder, "preferences"), os.path.join(test_folder, "preferences.d")]
+
+        self.runtime.write_to_file(engine.dpkg_status_path,
+                                   "Package: dpkg\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1.18.4ubuntu1\n\n" +
+                                   "Package: linux-image-generic\nStatus: install ok installed\nArchitecture: amd64\nVersion: 4.8.0.22.23\nDepends: linux-image-4.8.0-22-generic\n\n" +
+                                   "Package: linux-image-4.8.0-22-generic\nStatus: install ok installed\nArchitecture: amd64\nVersion: 4.8.0-22.24\n\n" +
+                                   "Package: cdebconf\nStatus: install ok installed\nArchitecture: amd64\nVersion: 0.198\nProvides: debconf-2.0\n\n" +
+                                   "Package: kmod\nStatus: hold ok installed\nArchitecture: amd64\nVersion: 22-1ubuntu5\n\n" +
+                                   "Package: libfoo\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1.0\nRecommends: foo-doc\n")
+        updates_list_path = os.path.join(lists_folder, "archive.ubuntu.com_ubuntu_dists_yakkety-updates_main_binary-amd64_Packages")
+        updates_list = ("Package: linux-image-generic\nArchitecture: amd64\nVersion: 4.8.0.26.30\nDepends: linux-image-4.8.0-26-generic (= 4.8.0-26.28), debconf (>= 0.5) | debconf-2.0\n\n" +
+                        "Package: linux-image-4.8.0-26-generic\nArchitecture: amd64\nVersion: 4.8.0-26.28\nDepends: kmod, linux-firmware | linux-firmware-nonfree\n\n" +
+                        "Package: linux-image-4.8.0-26-generic\nArchitecture: i386\nVersion: 4.8.0-26.28\n\n" +
+                        "Package: linux-firmware\nArchitecture: all\nVersion: 1.161\n\n" +
+                        "Package: libfoo\nArchitecture: amd64\nVersion: 1.1\nRecommends: foo-doc, foo-extra [amd64]\n\n" +
+                        "Package: foo-doc\nArchitecture: all\nVersion: 1.1\n\n" +
+                        "Package: foo-extra\nArchitecture: amd64\nVersion: 1.1\n")
+        self.runtime.write_to_file(updates_list_path, updates_list)
+
+        # packages that the upgrades newly need are installed by dist-upgrade, so they are assessed too; recommendations removed before are not reinstated
+        packages, package_versions, origins = engine.get_upgradable_packages()
+        self.assertEqual(packages, ["foo-extra", "libfoo", "linux-firmware", "linux-image-4.8.0-26-generic", "linux-image-generic"])
+        self.assertEqual(package_versions, ["1.1", "1.1", "1.161", "4.8.0-26.28", "4.8.0.26.30"])
+        self.assertEqual(origins[3], "archive.ubuntu.com_ubuntu_dists_yakkety-updates_main_binary-amd64")
+
+        # package states that need apt's own policy or resolver are left to apt
+        self.runtime.write_to_file(updates_list_path, updates_list.replace("Version: 1.161\n", "Version: 1.161\nPhased-Update-Percentage: 10\n"))
+        self.assertRaises(Exception, engine.get_upgradable_packages)
+        self.runtime.write_to_file(updates_list_path, updates_list.replace("linux-firmware | linux-firmware-nonfree", "linux-firmware-virtual"))
+        self.assertRaises(Exception, engine.get_upgradable_packages)
+        self.runtime.write_to_file(updates_list_path, updates_list)
+        self.runtime.write_to_file(os.path.join(test_folder, "preferences.d", "pin-updates"), "Package: *\nPin: release a=yakkety-updates\nPin-Priority: 100\n")
+        self.assertRaises(Exception, engine.get_upgradable_packages)
+        os.remove(os.path.join(test_folder, "preferences.d", "pin-updates"))
+        self.runtime.write_to_file(updates_list_path + ".lz4", "")
+        self.assertRaises(Exception, engine.get_upgradable_packages)
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, True)
+        self.assertIsNone(package_manager.get_all_updates_from_native_engine())
+
+        shutil.rmtree(test_folder)
+
+    def test_assessment_result_cache(self):
+        package_manager = self.container.get('package_manager')
+        database_path = os.path.join(self.runtime.execution_config.config_folder, "dpkg_status")
+        self.runtime.write_to_file(database_path, "Package: mysql-server")
+        package_manager.assessment_result_cache.fingerprint_paths = [database_path]
+        self.runtime.set_legacy_test_type('HappyPath')
+        commands = []
+        legacy_run_command_output = self.runtime.env_layer.run_command_output
+        self.runtime.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=True: commands.append(cmd) or legacy_run_command_output(cmd, no_output, chk_err)
+
+        # an unchanged package state answers from the cache, with results that callers cannot alter
+        packages, package_versions = package_manager.get_all_updates()
+        packages.pop(0)
+        cached_packages, cached_package_versions = package_manager.get_all_updates()
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(len(cached_packages), len(packages) + 1)
+        self.assertEqual(package_manager.assessment_result_cache.hit_count, 1)
+
+        # a change to the package database invalidates it
+        self.runtime.write_to_file(database_path, "Package: mysql-server\nStatus: install ok installed")
+        package_manager.get_all_updates()
+        self.assertEqual(len(commands), 2)
+
+        # as does a repo refresh or an install, even if the fingerprint misses it
+        package_manager.get_all_updates()
+        package_manager.refresh_repo(force=True)
+        package_manager.get_all_updates()
+        package_manager.install_update_and_dependencies('mysql-server', '5.7.25-0ubuntu0.16.04.2')
+        package_manager.get_all_updates()
+        self.assertEqual(len([command for command in commands if '-s dist-upgrade' in command]), 4)
+        os.remove(database_path)
+
     def test_install_package_success(self):
         self.runtime.set_legacy_test_type('SuccessInstallPath')
 
@@ -99,6 +324,100 @@ class TestAptitudePackageManager(unittest.TestCase):
         self.assertEquals(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'), True)
         self.assertEquals(package_manager.is_package_version_installed('mysql-client', '5.7.25-0ubuntu0.16.04.2'), False)
 
+    def test_is_installed_check_with_snapshot(self):
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+
+        database_path = os.path.join(self.runtime.execution_config.config_folder, "dpkg_status")
+        self.runtime.write_to_file(database_path, "Package: mysql-server")
+        package_manager.installed_package_snapshot.database_paths = [database_path]
+        self.installed_packages_query_count = 0
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_installed_packages_query
+
+        # a single query answers for every package
+        self.assertTrue(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertTrue(package_manager.is_package_version_installed('libc6', '2.23-0ubuntu10'))
+        self.assertFalse(package_manager.is_package_version_installed('mysql-server', '5.7.21-1ubuntu1'))
+        self.assertFalse(package_manager.is_package_version_installed('mysql-client', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertEqual(self.installed_packages_query_count, 1)
+
+        # multi-arch: foreign architecture packages are looked up by their arch-qualified names, as apt lists them
+        self.assertTrue(package_manager.is_package_version_installed('libc6:i386', '2.23-0ubuntu9'))
+        self.assertFalse(package_manager.is_package_version_installed('libc6:i386', '2.23-0ubuntu10'))
+        self.assertTrue(package_manager.is_package_version_installed('libc6:amd64', '2.23-0ubuntu10'))
+        self.assertFalse(package_manager.is_package_version_installed('mysql-client:amd64', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertEqual(self.installed_packages_query_count, 1)
+
+        # a change to the package database refreshes the snapshot
+        self.runtime.write_to_file(database_path, "Package: mysql-server\nStatus: install ok installed")
+        self.assertTrue(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertEqual(self.installed_packages_query_count, 2)
+
+        os.remove(database_path)
+
+    def test_refresh_repo_ttl(self):
+        package_manager = self.container.get('package_manager')
+        self.refresh_count = 0
+        self.refresh_commands = []
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_repo_refresh
+
+        # a refresh within this operation is not repeated unless forced
+        package_manager.refresh_repo()
+        package_manager.refresh_repo()
+        self.assertEqual(self.refresh_count, 1)
+        package_manager.refresh_repo(force=True)
+        self.assertEqual(self.refresh_count, 2)
+        self.assertEqual(package_manager.repo_refresh_coordinator.skipped_refresh_count, 1)
+
+        # a new operation always refreshes on its first request, however recently the metadata on disk was refreshed
+        self.runtime.stop()
+        self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        package_manager = self.runtime.package_manager
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_repo_refresh
+        package_manager.refresh_repo()
+        self.assertEqual(self.refresh_count, 3)
+
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES, 0)
+        package_manager.refresh_repo()
+        self.assertEqual(self.refresh_count, 4)
+        self.assertEqual(package_manager.repo_refresh_coordinator.skipped_refresh_count, 0)
+
+    def test_refresh_repo_security_only(self):
+        package_manager = self.container.get('package_manager')
+        self.refresh_count = 0
+        self.refresh_commands = []
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_repo_refresh
+
+        # only the security sources are refreshed, and that does not make a full refresh skippable
+        package_manager.refresh_repo(security_only=True)
+        self.assertEqual(self.refresh_commands, ['sudo apt-get -q update -oDir::Etc::Sourcelist=' + package_manager.security_sources_list + ' -oDir::Etc::SourceParts=- -oAPT::Get::List-Cleanup=0'])
+        package_manager.refresh_repo(security_only=True)
+        self.assertEqual(len(self.refresh_commands), 1)
+        package_manager.refresh_repo()
+        self.assertEqual(self.refresh_count, 1)
+
+        # a full refresh covers the security sources
+        package_manager.refresh_repo(security_only=True)
+        self.assertEqual(len(self.refresh_commands), 2)
+
+    def test_install_updates_refreshes_security_sources_only(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.classifications_to_include = ["Security", "Critical"]
+        self.runtime.stop()
+        self.runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        refresh_requests = []
+        self.runtime.package_manager.refresh_repo = lambda force=False, security_only=False: refresh_requests.append(security_only)
+        self.runtime.set_legacy_test_type('SuccessInstallPath')
+        self.runtime.patch_installer.install_updates(self.runtime.maintenance_window, self.runtime.package_manager, simulate=True)
+        self.assertEqual(refresh_requests, [True])
+
+    def mock_run_command_output_repo_refresh(self, cmd, no_output=False, chk_err=True):
+        if cmd.startswith('sudo apt-get -q update'):
+            self.refresh_commands.append(cmd)
+        if cmd == 'sudo apt-get -q update':
+            self.refresh_count += 1
+        return 0, ""
+
     def test_install_package_failure(self):
         self.runtime.set_legacy_test_type('FailInstallPath')
 
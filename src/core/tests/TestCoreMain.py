@@ -15,6 +15,7 @@
 # Requires Python 2.7+
 import datetime
 import json
+import os
 import unittest
 from core.src.CoreMain import CoreMain
 from core.src.bootstrap.Constants import Constants
@@ -107,6 +108,33 @@ class TestCoreMain(unittest.TestCase):
         self.assertTrue(substatus_file_data_patch_metadata_summary["shouldReportToHealthStore"])
         runtime.stop()
 
+    def test_package_manager_settings_from_configuration(self):
+        # opt-in settings are off by default
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        self.assertEqual(runtime.execution_config.package_manager_settings, {})
+        self.assertFalse(runtime.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_BATCH_INSTALLATION, False))
+        runtime.stop()
+
+        # they are read from internal settings, with the environment taking precedence; anything else is ignored
+        argument_composer = ArgumentComposer()
+        argument_composer.internal_settings = json.dumps({Constants.PKG_MGR_SETTING_BATCH_INSTALLATION: True, Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH: True, "UnknownSetting": True})
+        os.environ[Constants.LPE_PKG_MGR_SETTINGS_VARIABLE] = json.dumps({Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH: False, Constants.PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES: 10})
+        try:
+            runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        finally:
+            os.environ.pop(Constants.LPE_PKG_MGR_SETTINGS_VARIABLE)
+        self.assertEqual(runtime.execution_config.package_manager_settings, {Constants.PKG_MGR_SETTING_BATCH_INSTALLATION: True, Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH: False, Constants.PKG_MGR_SETTING_REPO_REFRESH_TTL_IN_MINUTES: 10})
+        self.assertTrue(runtime.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_BATCH_INSTALLATION, False))
+        self.assertFalse(runtime.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH, False))
+        self.assertEqual(runtime.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY), Constants.APT)
+        runtime.stop()
+
+        # internal settings that are not a json object are ignored
+        argument_composer.internal_settings = "test"
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        self.assertEqual(runtime.execution_config.package_manager_settings, {})
+        runtime.stop()
+
     def test_invalid_maintenance_run_id(self):
         # test with empty string for maintenence run id
         argument_composer = ArgumentComposer()
@@ -0,0 +1,101 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.DownloadPrefetcher import DownloadPrefetcher
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestDownloadPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        self.package_manager = self.runtime.package_manager
+        self.downloads = []
+        self.cache_size = 0
+        self.free_space = None
+
+        self.package_manager.download_updates = self.mock_download_updates
+        self.package_manager.get_package_cache_size = lambda: self.cache_size
+        self.package_manager.get_package_cache_free_space = lambda: self.free_space
+        self.prefetcher = DownloadPrefetcher(self.runtime.composite_logger, self.runtime.telemetry_writer, self.package_manager)
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def mock_download_updates(self, packages, package_versions, timeout=None):
+        self.downloads.append((packages, timeout))
+        if "package3" in packages:
+            return 100
+        self.cache_size += 1000 * len(packages)
+        return 0
+
+    def test_prefetch(self):
+        packages = ["package" + str(index) for index in range(0, Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE + 5)]
+        prefetched_packages, bytes_fetched, duration = self.prefetcher.prefetch(packages, ["1.0"] * len(packages), 600)
+
+        # the chunk holding the failed download is not counted as prefetched
+        self.assertEqual(len(self.downloads), 2)
+        self.assertTrue(0 < self.downloads[0][1] <= 600)
+        self.assertEqual(prefetched_packages, packages[Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE:])
+        self.assertEqual(bytes_fetched, 5000)
+
+    def test_prefetch_stops_at_budgets(self):
+        packages = ["package" + str(index) for index in range(0, 5)]
+        prefetched_packages, bytes_fetched, duration = self.prefetcher.prefetch(packages, ["1.0"] * len(packages), 0)
+        self.assertEqual(len(self.downloads), 0)
+        self.assertEqual(prefetched_packages, [])
+
+        self.free_space = Constants.DOWNLOAD_PREFETCH_MIN_FREE_DISK_SPACE_IN_MB * 1024 * 1024 - 1
+        prefetched_packages, bytes_fetched, duration = self.prefetcher.prefetch(packages, ["1.0"] * len(packages), 600)
+        self.assertEqual(len(self.downloads), 0)
+        self.assertEqual(bytes_fetched, 0)
+
+        # the byte budget is checked between chunks
+        self.free_space = None
+        packages = ["package" + str(index) for index in range(4, 2 * Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE + 4)]
+        prefetched_packages, bytes_fetched, duration = self.prefetcher.prefetch(packages, ["1.0"] * len(packages), 600, 1)
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(prefetched_packages, packages[0:Constants.DOWNLOAD_PREFETCH_CHUNK_SIZE])
+
+    def test_prefetch_during_installation(self):
+        self.runtime.set_legacy_test_type('SuccessInstallPath')
+        self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_DOWNLOAD_PREFETCH, True)
+        self.runtime.maintenance_window.get_remaining_time_in_minutes = lambda *args, **kwargs: 100
+        telemetry_info = []
+        legacy_send_info = self.runtime.telemetry_writer.send_info
+        self.runtime.telemetry_writer.send_info = lambda message, *args, **kwargs: telemetry_info.append(message) or legacy_send_info(message, *args, **kwargs)
+        installed_update_count, update_run_successful, maintenance_window_exceeded = self.runtime.patch_installer.install_updates(self.runtime.maintenance_window, self.package_manager, simulate=False)
+        self.assertEqual(len(self.downloads), 1)
+        self.assertTrue(update_run_successful)
+
+        # prefetch may use the window up to the cutoff for package installs, and its duration is reported next to the install duration
+        self.assertTrue(0 < self.downloads[0][1] <= (100 - self.runtime.maintenance_window.get_package_install_cutoff_time_in_minutes()) * 60)
+        self.assertTrue(any("[DownloadDuration=" in message and "[InstallDuration=" in message for message in telemetry_info))
+
+        self.runtime.maintenance_window.get_remaining_time_in_minutes = lambda *args, **kwargs: self.runtime.maintenance_window.get_package_install_cutoff_time_in_minutes()
+        self.runtime.patch_installer.install_updates(self.runtime.maintenance_window, self.package_manager, simulate=False)
+        self.assertEqual(len(self.downloads), 1)
+
+    def test_download_updates(self):
+        del self.package_manager.download_updates
+        self.runtime.set_legacy_test_type('SuccessInstallPath')
+        self.assertEqual(self.package_manager.download_updates(["selinux-policy"], ["3.13.1-102.el7_3.16"], 60), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import subprocess
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestEnvLayer(unittest.TestCase):
+    def setUp(self):
+        self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        self.env_layer = self.runtime.env_layer
+
+    def tearDown(self):
+        self.env_layer.set_shell_coprocess_enabled(False)
+        self.runtime.stop()
+
+    def run_command_output(self, cmd, no_output=False, timeout=None):
+        # bypasses the legacy mode mock to run real commands
+        return type(self.env_layer).run_command_output(self.env_layer, cmd, no_output, False, timeout)
+
+    def test_shell_coprocess(self):
+        commands = ["echo one; echo two", "printf 'no line break'", "echo failed; exit 3", "cd / && pwd", "pwd", "cat"]
+        expected_results = [self.run_command_output(cmd) for cmd in commands]
+        expected_syntax_error_code = self.run_command_output("echo \"unbalanced")[0]
+
+        self.env_layer.set_shell_coprocess_enabled(True)
+        self.assertEqual([self.run_command_output(cmd) for cmd in commands], expected_results)
+        self.assertEqual(self.run_command_output("echo quiet", True), (0, None))
+        self.assertEqual(self.run_command_output("echo \"unbalanced")[0], expected_syntax_error_code)   # syntax errors stay in the subshell
+        self.assertEqual(self.run_command_output("echo after"), (0, "after\n"))
+        self.assertEqual(self.env_layer.shell_coprocess.command_count, len(commands) + 3)
+
+        # a timeout takes the shell down with the command; the next command starts a new one
+        code, out = self.run_command_output("sleep 60", timeout=1)
+        self.assertEqual(code, Constants.EnvLayer.TIMED_OUT_COMMAND_CODE)
+        self.assertTrue(self.env_layer.shell_coprocess.process is None)
+        self.assertEqual(self.run_command_output("echo again"), (0, "again\n"))
+
+    def test_shell_coprocess_fallback(self):
+        self.env_layer.set_shell_coprocess_enabled(True)
+        self.env_layer.shell_coprocess.shell_path = "/nonexistent/sh"
+        self.assertEqual(self.run_command_output("echo fresh process"), (0, "fresh process\n"))
+        self.assertEqual(self.env_layer.shell_coprocess.command_count, 0)
+
+
+    def test_concurrent_commands(self):
+        check_output, called_process_error = getattr(subprocess, 'check_output', None), subprocess.CalledProcessError
+        self.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=False, timeout=None: self.run_command_output(cmd, no_output, timeout)
+        timed_out_commands = []
+        self.env_layer.set_command_timeout_provider(lambda: 3, lambda cmd, timeout: timed_out_commands.append(cmd))
+
+        # exit codes, outputs and timeouts stay with their own commands
+        cmds = ["echo one; exit 100", "sleep 1; echo two", "sleep 60", "echo three; exit 1", "echo four"]
+        results = self.env_layer.run_command_outputs_concurrently(cmds)
+        self.assertEqual(results[0:2] + results[3:], [(100, "one\n"), (0, "two\n"), (1, "three\n"), (0, "four\n")])
+        self.assertEqual(results[2][0], Constants.EnvLayer.TIMED_OUT_COMMAND_CODE)
+        self.assertEqual(timed_out_commands, ["sleep 60"])
+        self.assertTrue(getattr(subprocess, 'check_output', None) is check_output and subprocess.CalledProcessError is called_process_error)
+
+        # the shell coprocess runs one command at a time; the others run in fresh processes
+        self.env_layer.set_command_timeout_provider(None)
+        self.env_layer.set_shell_coprocess_enabled(True)
+        self.assertEqual(self.env_layer.run_command_outputs_concurrently(["sleep 1; echo " + str(index) for index in range(0, 4)]), [(0, str(index) + "\n") for index in range(0, 4)])
+        self.assertTrue(1 <= self.env_layer.shell_coprocess.command_count < 4)
+
+if __name__ == '__main__':
+    unittest.main()
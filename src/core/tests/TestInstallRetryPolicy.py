@@ -0,0 +1,77 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import datetime
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.InstallRetryPolicy import InstallRetryPolicy
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestInstallRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.start_time = (datetime.datetime.utcnow() - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        argument_composer.maximum_duration = "PT1H"
+        self.runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.YUM)
+        self.install_retry_policy = InstallRetryPolicy(self.runtime.composite_logger, self.runtime.maintenance_window)
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def install_with_retries(self, install_results, code_path):
+        install_results = list(install_results)
+        return self.install_retry_policy.install_with_retries(lambda: install_results.pop(0), lambda: code_path)
+
+    def test_retries(self):
+        # success ends the attempts
+        install_result, attempts = self.install_with_retries([Constants.FAILED, Constants.INSTALLED], "| Install > Package NOT installed. (failed)")
+        self.assertEqual(install_result, Constants.INSTALLED)
+        self.assertEqual([result for result, duration in attempts], [Constants.FAILED, Constants.INSTALLED])
+
+        install_result, attempts = self.install_with_retries([Constants.FAILED] * 5, "| Install > Package NOT installed. (failed)")
+        self.assertEqual(install_result, Constants.FAILED)
+        self.assertEqual(len(attempts), Constants.MAX_INSTALLATION_RETRY_COUNT)
+
+        # terminal failures are not retried
+        install_result, attempts = self.install_with_retries([Constants.FAILED] * 5, "| Install > Timed out > Package NOT installed. (failed)")
+        self.assertEqual(len(attempts), 1)
+        install_result, attempts = self.install_with_retries([Constants.PENDING] * 5, "| Install > Package has no prior version. (no operation; return 'not started')")
+        self.assertEqual((install_result, len(attempts)), (Constants.PENDING, 1))
+
+    def test_retry_delay(self):
+        self.assertEqual([InstallRetryPolicy.get_retry_delay_in_seconds(attempt_count) for attempt_count in range(1, 7)], [2, 4, 8, 16, 30, 30])
+
+    def test_no_retry_past_maintenance_window(self):
+        self.runtime.maintenance_window.get_remaining_time_in_minutes = lambda: Constants.REBOOT_BUFFER_IN_MINUTES + Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES + 0.01
+        install_result, attempts = self.install_with_retries([Constants.FAILED] * 5, "| Install > Package NOT installed. (failed)")
+        self.assertEqual(len(attempts), 1)
+
+    def test_install_updates_single_attempt_on_success(self):
+        self.runtime.set_legacy_test_type('SuccessInstallPath')
+        package_manager = self.runtime.package_manager
+        install_calls = []
+        install_update_and_dependencies = package_manager.install_update_and_dependencies
+        package_manager.install_update_and_dependencies = lambda *args: install_calls.append(args[0]) or install_update_and_dependencies(*args)
+
+        installed_update_count, update_run_successful, maintenance_window_exceeded = self.runtime.patch_installer.install_updates(self.runtime.maintenance_window, package_manager, simulate=True)
+        self.assertTrue(update_run_successful)
+        self.assertEqual(len(install_calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
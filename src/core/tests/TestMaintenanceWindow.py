@@ -16,6 +16,7 @@
 
 import datetime
 import unittest
+from core.src.bootstrap.Constants import Constants
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
 
@@ -79,5 +80,38 @@ class TestMaintenanceWindow(unittest.TestCase):
         self.assertEqual(runtime.maintenance_window.is_package_install_time_available(), False)
         runtime.stop()
 
+    def test_command_timeout(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.start_time = (datetime.datetime.utcnow() - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        argument_composer.maximum_duration = "PT1H"
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True)
+        self.assertAlmostEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), 25 * 60, delta=5)    # ahead of the reboot buffer
+        runtime.stop()
+
+        argument_composer.maximum_duration = "PT4H"
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True)
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), Constants.MAX_COMMAND_TIMEOUT_IN_MINUTES * 60)
+        runtime.stop()
+
+        argument_composer.maximum_duration = "PT10M"
+        argument_composer.start_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True)
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES * 60)
+        runtime.stop()
+
+        # never beyond the end of the window, and computed without logging as it is done for every command
+        argument_composer.start_time = (datetime.datetime.utcnow() - datetime.timedelta(minutes=7)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True)
+        debug_messages = []
+        runtime.maintenance_window.composite_logger.log_debug = lambda message, *args, **kwargs: debug_messages.append(message)
+        self.assertAlmostEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), 3 * 60, delta=5)
+        self.assertEqual(debug_messages, [])
+        runtime.stop()
+
+        argument_composer.start_time = (datetime.datetime.utcnow() - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True)
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), Constants.MIN_COMMAND_TIMEOUT_IN_MINUTES * 60)
+        runtime.stop()
+
 if __name__ == '__main__':
     unittest.main()
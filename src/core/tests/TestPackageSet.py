@@ -0,0 +1,47 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import unittest
+from core.src.package_managers.PackageSet import PackageSet
+
+
+class TestPackageSet(unittest.TestCase):
+    def setUp(self):
+        self.package_set = PackageSet(["libgcc.x86_64", "libgcc.i686", "tuned.noarch", "libgcc.x86_64"], ["4.8.5-36.el7", "4.8.5-36.el7", "2.9.0-1.el7", "4.8.5-28.el7"])
+
+    def test_ordered_lookups(self):
+        # the first version of a package wins, as in dedupe_update_packages
+        self.assertEqual(self.package_set.to_lists(), (["libgcc.x86_64", "libgcc.i686", "tuned.noarch"], ["4.8.5-36.el7", "4.8.5-36.el7", "2.9.0-1.el7"]))
+        self.assertEqual(len(self.package_set), 3)
+        self.assertTrue("tuned.noarch" in self.package_set)
+        self.assertFalse("tuned" in self.package_set)
+        self.assertEqual(self.package_set.get_version("tuned.noarch"), "2.9.0-1.el7")
+        self.assertEqual(self.package_set.get_version("kernel.x86_64", "Unspecified"), "Unspecified")
+        self.assertEqual(self.package_set.get_packages_with_base_name("libgcc"), ["libgcc.x86_64", "libgcc.i686"])
+        self.assertEqual(list(self.package_set)[2], ("tuned.noarch", "2.9.0-1.el7"))
+        self.assertFalse(self.package_set.add("tuned.noarch", "2.10.0-1.el7"))
+
+    def test_set_algebra(self):
+        self.assertEqual(self.package_set.difference(["libgcc.i686"]).get_packages(), ["libgcc.x86_64", "tuned.noarch"])
+        self.assertEqual(self.package_set.intersection(PackageSet(["tuned.noarch"], ["2.10.0-1.el7"])).to_lists(), (["tuned.noarch"], ["2.9.0-1.el7"]))
+        union = self.package_set.union(PackageSet(["kernel.x86_64", "tuned.noarch"], ["3.10.0-862.el7", "2.10.0-1.el7"]))
+        self.assertEqual(union.get_packages(), ["libgcc.x86_64", "libgcc.i686", "tuned.noarch", "kernel.x86_64"])
+        self.assertEqual(union.get_version("tuned.noarch"), "2.9.0-1.el7")
+        self.assertEqual(len(self.package_set), 3)    # operands are not modified
+
+
+if __name__ == '__main__':
+    unittest.main()
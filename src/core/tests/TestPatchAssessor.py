@@ -15,7 +15,9 @@
 # Requires Python 2.7+
 
 import json
+import os
 import unittest
+from core.src.bootstrap.Constants import Constants
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
 
@@ -46,11 +48,70 @@ class TestPatchAssessor(unittest.TestCase):
     def test_assessment_fail_with_status_update(self):
         self.runtime.package_manager.refresh_repo = self.mock_refresh_repo
         self.runtime.set_legacy_test_type('UnalignedPath')
-        self.runtime.patch_assessor.start_assessment()
+        self.assertRaises(Exception, self.runtime.patch_assessor.start_assessment)
         with open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
             file_contents = json.loads(file_handle.read())
             self.assertTrue('Unexpected return code (100) from package manager on command: LANG=en_US.UTF8 sudo apt-get -s dist-upgrade' in str(file_contents))
 
+    def test_assessment_prestage_downloads(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.operation = Constants.ASSESSMENT
+        self.runtime.stop()
+        self.runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), legacy_mode=True)
+        package_manager = self.runtime.package_manager
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_PRESTAGE_DOWNLOADS, True)
+        package_manager.download_updates = lambda packages, package_versions, timeout=None: 0
+        package_manager.get_package_cache_free_space = lambda: None
+        cache_sizes = [1000, 5000]
+        package_manager.get_package_cache_size = lambda: cache_sizes.pop(0) if len(cache_sizes) > 1 else cache_sizes[0]
+
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        with open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+        self.assertEqual(substatus_file_data["status"], Constants.STATUS_SUCCESS.lower())
+        prestaged_downloads = json.loads(substatus_file_data["formattedMessage"]["message"])["prestagedDownloads"]
+        self.assertTrue(prestaged_downloads["packageCount"] > 0)
+        self.assertEqual(prestaged_downloads["bytes"], 4000)
+
+    def test_assessment_snapshot(self):
+        database_path = os.path.join(self.runtime.execution_config.config_folder, "dpkg_status")
+        self.runtime.write_to_file(database_path, "Package: mysql-server")
+        package_manager = self.runtime.package_manager
+        package_manager.assessment_result_cache.fingerprint_paths = [database_path]
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_ASSESSMENT_SNAPSHOT, True)
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        assessment_summary = self.get_assessment_summary()
+        self.assertFalse(assessment_summary["assessmentSnapshot"]["cacheHit"])
+
+        # a later operation on an unchanged package state reuses the persisted result
+        self.runtime.stop()
+        self.runtime = RuntimeCompositor(self.runtime.argv, legacy_mode=True)    # same config folder
+        package_manager = self.runtime.package_manager
+        package_manager.assessment_result_cache.fingerprint_paths = [database_path]
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_ASSESSMENT_SNAPSHOT, True)
+        package_manager.get_all_updates = None      # not to be called
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_PRESTAGE_DOWNLOADS, True)
+        self.runtime.execution_config.operation = Constants.ASSESSMENT
+        prestaged_packages = []
+        self.runtime.patch_assessor.prestage_downloads = lambda packages, package_versions: prestaged_packages.extend(packages)
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        snapshot_assessment_summary = self.get_assessment_summary()
+        self.assertTrue(snapshot_assessment_summary["assessmentSnapshot"]["cacheHit"])
+        self.assertTrue(snapshot_assessment_summary["assessmentSnapshot"]["ageInSeconds"] >= 0)
+        self.assertEqual(snapshot_assessment_summary["patches"], assessment_summary["patches"])
+        self.assertEqual(sorted(prestaged_packages), sorted(patch["name"] for patch in assessment_summary["patches"]))     # pre-staged from the snapshot too
+
+        # a change to the package state makes it out of date
+        self.runtime.write_to_file(database_path, "Package: mysql-server\nStatus: install ok installed")
+        self.assertIsNone(self.runtime.patch_assessor.load_assessment_snapshot())
+        os.remove(database_path)
+
+    def get_assessment_summary(self):
+        with open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+        self.assertEqual(substatus_file_data["name"], "PatchAssessmentSummary")
+        return json.loads(substatus_file_data["formattedMessage"]["message"])
+
     def mock_refresh_repo(self):
         pass
 
@@ -15,6 +15,7 @@
 # Requires Python 2.7+
 
 import datetime
+import json
 import unittest
 from core.src.bootstrap.Constants import Constants
 from core.tests.library.ArgumentComposer import ArgumentComposer
@@ -156,6 +157,198 @@ class TestPatchInstaller(unittest.TestCase):
         self.assertFalse(maintenance_window_exceeded)
         runtime.stop()
 
+    def test_batch_installation(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        package_manager = runtime.package_manager
+        packages = ["package" + str(index) for index in range(0, 8)]
+        installed_packages = []
+        transactions = []
+        timeouts = []
+
+        def install_updates_in_transaction(batch_packages, batch_package_versions, simulate=False, timeout=None):
+            # all or nothing, like a real transaction: any failing package fails the whole batch
+            transactions.append(batch_packages)
+            timeouts.append(timeout)
+            if "package5" in batch_packages:
+                return 100
+            installed_packages.extend(batch_packages)
+            return 0
+
+        package_manager.install_updates_in_transaction = install_updates_in_transaction
+        package_manager.is_package_version_installed = lambda package, version: package in installed_packages
+        batch_installed_packages = runtime.patch_installer.install_updates_in_batches(runtime.maintenance_window, package_manager, packages, ["1.0"] * len(packages))
+
+        # package5 is isolated with package4 left over; both are installed individually
+        self.assertEqual(sorted(batch_installed_packages), [package for package in packages if package not in ("package4", "package5")])
+        self.assertEqual(transactions, [packages, packages[0:4], packages[4:8], packages[4:6], packages[6:8]])
+
+        # transactions are bounded by a timeout that scales with the batch size
+        self.assertEqual(timeouts, [runtime.maintenance_window.get_command_timeout_in_seconds(len(transaction)) for transaction in transactions])
+        runtime.maintenance_window.get_remaining_time_in_minutes = lambda *args, **kwargs: 600
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(), Constants.MAX_COMMAND_TIMEOUT_IN_MINUTES * 60)
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(8), Constants.MAX_COMMAND_TIMEOUT_IN_MINUTES * 8 * 60)
+        self.assertEqual(runtime.maintenance_window.get_command_timeout_in_seconds(100), (600 - Constants.REBOOT_BUFFER_IN_MINUTES) * 60)    # still within the window
+
+        # simulations install nothing, so batches are not bisected
+        transactions = []
+        installed_packages = []
+        self.assertEqual(runtime.patch_installer.install_updates_in_batches(runtime.maintenance_window, package_manager, packages, ["1.0"] * len(packages), simulate=True), [])
+        self.assertEqual(transactions, [packages])
+        runtime.stop()
+
+    def test_batch_installation_package_telemetry(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        package_manager = runtime.package_manager
+        package_infos = []
+        runtime.telemetry_writer.send_package_info = lambda *args: package_infos.append(args)
+        package_manager.is_package_version_installed = lambda package, version: package != "selinux-policy"
+
+        # every package in a transaction is reported, as with individual installs
+        package_manager.install_updates_in_transaction(["sudo", "selinux-policy"], ["1.8.6p7-22.el7_3", "3.13.1-102.el7_3.16"])
+        self.assertEqual([(package_info[0], package_info[1], package_info[4]) for package_info in package_infos], [("sudo", "1.8.6p7-22.el7_3", Constants.INSTALLED), ("selinux-policy", "3.13.1-102.el7_3.16", Constants.FAILED)])
+
+        package_manager.install_updates_in_transaction(["sudo", "selinux-policy"], ["1.8.6p7-22.el7_3", "3.13.1-102.el7_3.16"], simulate=True)
+        self.assertEqual(len(package_infos), 2)
+        runtime.stop()
+
+    def test_batch_installation_install_updates(self):
+        current_time = datetime.datetime.utcnow()
+        argument_composer = ArgumentComposer()
+        argument_composer.maximum_duration = 'PT1H'
+        argument_composer.start_time = (current_time - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        runtime.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_BATCH_INSTALLATION, True)
+        individual_installs = []
+        runtime.package_manager.install_update_and_dependencies = lambda *args: individual_installs.append(args[0])
+
+        installed_update_count, update_run_successful, maintenance_window_exceeded = runtime.patch_installer.install_updates(runtime.maintenance_window, runtime.package_manager, simulate=True)
+        self.assertEqual(3, installed_update_count)
+        self.assertTrue(update_run_successful)
+        self.assertEqual(len(individual_installs), 0)
+        runtime.stop()
+
+    def test_deferred_status_written_before_install(self):
+        current_time = datetime.datetime.utcnow()
+        argument_composer = ArgumentComposer()
+        argument_composer.maximum_duration = 'PT1H'
+        argument_composer.start_time = (current_time - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        runtime.status_handler.status_file_writer.min_write_interval_in_seconds = 3600     # nothing is written on its own during the installation
+        patch_states_on_disk = []
+
+        def install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate=False):
+            with runtime.env_layer.file_system.open(runtime.execution_config.status_file_path, 'r') as file_handle:
+                substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+            patch_states_on_disk.append([patch["patchInstallationState"] for patch in json.loads(substatus_file_data["formattedMessage"]["message"])["patches"]])
+            return Constants.INSTALLED
+
+        runtime.package_manager.install_update_and_dependencies = install_update_and_dependencies
+        runtime.patch_installer.install_updates(runtime.maintenance_window, runtime.package_manager, simulate=True)
+
+        # each install sees the results of the ones before it on disk
+        self.assertEqual(len(patch_states_on_disk), 3)
+        for index, patch_states in enumerate(patch_states_on_disk):
+            self.assertEqual(patch_states.count(Constants.INSTALLED), index)
+            self.assertEqual(patch_states.count(Constants.PENDING), 3 - index)
+        runtime.stop()
+
+    def test_dependencies_resolved_between_installs(self):
+        current_time = datetime.datetime.utcnow()
+        argument_composer = ArgumentComposer()
+        argument_composer.maximum_duration = 'PT1H'
+        argument_composer.start_time = (current_time - datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%S.9999Z")
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        events = []
+        runtime.package_manager.get_dependent_list = lambda package_names: events.append(("resolve", package_names)) or []
+        runtime.package_manager.install_update_and_dependencies = lambda package_and_dependencies, package_and_dependency_versions, simulate=False: events.append(("install", package_and_dependencies[0])) or Constants.INSTALLED
+
+        # each package is resolved right before its install, with the maintenance window checked in between
+        runtime.patch_installer.install_updates(runtime.maintenance_window, runtime.package_manager, simulate=True)
+        packages = [event[1] for event in events if event[0] == "install"]
+        self.assertEqual(len(packages), 3)
+        self.assertEqual(events, [event for package in packages for event in (("resolve", package), ("install", package))])
+        runtime.stop()
+
+    def test_excluded_updates_dependency_screening(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        package_manager = runtime.package_manager
+        runtime.patch_installer.package_filter.installation_excluded_packages = ["kernel*"]
+        packages = ["kernel-tools", "libc6", "mysql-server", "mysql-client"]
+        dependencies = {"kernel-tools": ["kernel-image"], "libc6": [], "mysql-server": ["mysql-client"], "mysql-client": []}
+        simulations = []
+
+        def get_dependent_list(package_names):
+            simulations.append(package_names)
+            package_names = [package_names] if type(package_names) is str else package_names
+            return [dependency for package in package_names for dependency in dependencies[package] if dependency not in package_names]
+
+        # a single simulation of the candidates shows that none of them depends on an excluded package
+        package_manager.get_dependent_list = get_dependent_list
+        excluded_packages, excluded_package_versions = runtime.patch_installer.get_excluded_updates(package_manager, packages, ["1.0"] * len(packages))
+        self.assertEqual(excluded_packages, ["kernel-tools"])
+        self.assertEqual(simulations, [["libc6", "mysql-server", "mysql-client"]])
+
+        # otherwise the candidates are resolved individually to find the ones that do
+        dependencies["mysql-client"] = ["kernel-image"]
+        simulations = []
+        excluded_packages, excluded_package_versions = runtime.patch_installer.get_excluded_updates(package_manager, packages, ["1.0"] * len(packages))
+        self.assertEqual(excluded_packages, ["kernel-tools", "mysql-client"])
+        self.assertEqual(simulations, [["libc6", "mysql-server", "mysql-client"], "libc6", "mysql-server", "mysql-client"])
+        runtime.stop()
+
+    def test_incremental_status_reconciliation(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        package_manager = runtime.package_manager
+        package_manager.get_all_updates = None      # no full re-simulation
+        installed_packages = {"libc6": set(["2.23-0ubuntu10"]), "libgcc1": set(["1:6.0.1-0ubuntu1"]), "libgcc1:i386": set(["1:6.0.1-0ubuntu1"]), "mysql-server": set(["5.7.21-1ubuntu1"])}
+        package_manager.installed_package_snapshot.get_installed_packages = lambda: installed_packages
+        runtime.patch_installer.last_still_needed_packages = ["libc6", "libgcc1:i386", "mysql-server"]
+        runtime.patch_installer.last_still_needed_package_versions = ["2.23-0ubuntu11", "1:6.0.1-0ubuntu2", "5.7.25-0ubuntu0.16.04.2"]
+        runtime.patch_installer.reconciliation_baseline = installed_packages
+
+        # dependencies installed silently alongside a package are picked up from the installed package delta, regardless of the reconciliation rate
+        installed_packages = {"libc6": set(["2.23-0ubuntu11"]), "libgcc1": set(["1:6.0.1-0ubuntu1", "1:6.0.1-0ubuntu2"]), "libgcc1:i386": set(["1:6.0.1-0ubuntu2"]), "mysql-server": set(["5.7.21-1ubuntu1"])}
+        self.assertEqual(runtime.patch_installer.perform_status_reconciliation_conditionally(package_manager, False), 2)
+        self.assertEqual(runtime.patch_installer.last_still_needed_packages, ["mysql-server"])
+        self.assertEqual(runtime.patch_installer.perform_status_reconciliation_conditionally(package_manager, True), 0)
+        runtime.stop()
+
+    def test_command_timeout(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        timed_out_commands = []
+        runtime.env_layer.set_command_timeout_provider(lambda: 1, lambda cmd, timeout: timed_out_commands.append(cmd))
+
+        # a real process that hangs, along with a child of its own, is killed on expiry
+        run_command_output = type(runtime.env_layer).run_command_output
+        code, out = run_command_output(runtime.env_layer, "echo started; sleep 60 & sleep 60", False, False)
+        self.assertEqual(code, Constants.EnvLayer.TIMED_OUT_COMMAND_CODE)
+        self.assertTrue(out.startswith("started"))
+        self.assertEqual(timed_out_commands, ["echo started; sleep 60 & sleep 60"])
+
+        code, out = run_command_output(runtime.env_layer, "sleep 60", True, False, timeout=1)
+        self.assertEqual((code, out), (Constants.EnvLayer.TIMED_OUT_COMMAND_CODE, None))
+        self.assertEqual(len(timed_out_commands), 2)
+
+        runtime.patch_installer.report_command_timeout("sudo apt-get -y install hung-package", 1500)
+        runtime.env_layer.set_command_timeout_provider(None)
+
+        # the timeout only applies to the install phase, however it ends
+        command_timeout_providers = []
+
+        def install_updates(maintenance_window, package_manager, simulate=False):
+            command_timeout_providers.append(runtime.env_layer.command_timeout_provider)
+            raise Exception("Install failure")
+
+        runtime.patch_installer.install_updates = install_updates
+        self.assertRaises(Exception, runtime.patch_installer.start_installation, True)
+        self.assertEqual(command_timeout_providers, [runtime.maintenance_window.get_command_timeout_in_seconds])
+        self.assertIsNone(runtime.env_layer.command_timeout_provider)
+        runtime.stop()
+
 
 if __name__ == '__main__':
     unittest.main()
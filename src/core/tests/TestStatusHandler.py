@@ -13,10 +13,13 @@
 # limitations under the License.
 #
 # Requires Python 2.7+
+import collections
 import datetime
 import json
 import unittest
 from core.src.bootstrap.Constants import Constants
+from core.src.service_interfaces.PatchStatusRecords import PatchStatusRecords
+from core.src.service_interfaces.StatusDocumentCache import StatusDocumentCache
 from core.src.service_interfaces.StatusHandler import StatusHandler
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
@@ -71,6 +74,101 @@ class TestStatusHandler(unittest.TestCase):
         self.assertEqual(json.loads(substatus_file_data["formattedMessage"]["message"])["patches"][1]["name"], "samba-common-bin")
         self.assertEqual(json.loads(substatus_file_data["formattedMessage"]["message"])["patches"][1]["patchInstallationState"], Constants.INSTALLED)
 
+    def test_patch_records_reloaded_and_updated_in_place(self):
+        packages, package_versions = self.runtime.package_manager.get_all_updates()
+        self.runtime.status_handler.set_package_assessment_status(packages, package_versions)
+        self.runtime.status_handler.set_package_install_status(packages, package_versions)
+
+        # a new handler picks the records up from disk; updates keep record order and field order, and add no duplicates
+        status_handler = StatusHandler(self.runtime.env_layer, self.runtime.execution_config, self.runtime.composite_logger, self.runtime.telemetry_writer)
+        status_handler.status_file_writer.min_write_interval_in_seconds = 0
+        status_handler.set_package_assessment_status([packages[1]], [package_versions[1]], "Security")
+        status_handler.set_package_install_status([packages[2], packages[0]], [package_versions[2], package_versions[0]], Constants.INSTALLED)
+        with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.load(file_handle)[0]["status"]["substatus"]
+        assessment_summary = json.loads(substatus_file_data[0]["formattedMessage"]["message"])
+        self.assertEqual([patch["name"] for patch in assessment_summary["patches"]], ["python-samba", "samba-common-bin", "samba-libs"])
+        ordered_assessment_summary = json.loads(substatus_file_data[0]["formattedMessage"]["message"], object_pairs_hook=collections.OrderedDict)   # plain dicts do not keep key order on Python 2.7
+        self.assertEqual(list(ordered_assessment_summary["patches"][1].keys()), ["patchId", "name", "version", "classifications", "patchState"])
+        self.assertEqual(assessment_summary["patches"][1]["classifications"], ["Security"])
+        self.assertFalse("patchState" in assessment_summary["patches"][0])
+        self.assertEqual(assessment_summary["criticalAndSecurityPatchCount"], 1)
+        installation_summary = json.loads(substatus_file_data[1]["formattedMessage"]["message"])
+        self.assertEqual([patch["patchInstallationState"] for patch in installation_summary["patches"]], [Constants.INSTALLED, Constants.PENDING, Constants.INSTALLED])
+        self.assertEqual(installation_summary["installedPatchCount"], 2)
+        self.assertEqual(installation_summary["pendingPatchCount"], 1)
+
+    def test_patch_record_json_fragments(self):
+        patch_records = PatchStatusRecords('patchInstallationState')
+        patch_records.add('python-samba_2:4.4.5_Ubuntu_16.04', 'python-samba', '2:4.4.5', ["Other"], Constants.PENDING)
+        patch_records.add('quo"te\\_1.0_Ubuntu_16.04', 'quo"te\\', u'1.0\u00e9', ["Other"])
+        self.assertEqual(patch_records.get_json_fragment(), json.dumps(patch_records.to_json()))
+
+        # cached fragments are dropped on update
+        patch_records.get('python-samba_2:4.4.5_Ubuntu_16.04').update(["Security"], Constants.INSTALLED)
+        self.assertEqual(patch_records.get_json_fragment(), json.dumps(patch_records.to_json()))
+
+        document = json.dumps({"message": json.dumps({"count": 2, "patches": patch_records.json_placeholder, "errors": patch_records.json_placeholder})})
+        self.assertEqual(patch_records.insert_escaped_json_fragment(document), json.dumps({"message": json.dumps({"count": 2, "patches": patch_records.to_json(), "errors": patch_records.json_placeholder})}))
+
+    def test_status_file_load_cached(self):
+        self.runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        self.runtime.status_handler.add_error_to_status("Error one")
+        status_file_path = self.runtime.execution_config.status_file_path
+
+        def read_status_file():
+            with self.runtime.env_layer.file_system.open(status_file_path, 'r') as file_handle:
+                return json.load(file_handle)
+
+        # loaded status is shared until the file changes
+        StatusDocumentCache.load(status_file_path, read_status_file)
+        hit_count = StatusDocumentCache.hit_count
+        status_handler = StatusHandler(self.runtime.env_layer, self.runtime.execution_config, self.runtime.composite_logger, self.runtime.telemetry_writer)
+        self.assertEqual(StatusDocumentCache.hit_count, hit_count + 1)
+        status_document, messages = StatusDocumentCache.load(status_file_path, lambda: None)
+        self.assertEqual(len(messages[Constants.PATCH_INSTALLATION_SUMMARY]["errors"]["details"]), 1)
+
+        # changes made by a handler do not leak into the shared status, and a written status file is re-read
+        status_handler.status_file_writer.min_write_interval_in_seconds = 0
+        status_handler.set_current_operation(Constants.INSTALLATION)
+        status_handler.add_error_to_status("Error two")
+        self.assertEqual(len(messages[Constants.PATCH_INSTALLATION_SUMMARY]["errors"]["details"]), 1)
+        status_document, messages = StatusDocumentCache.load(status_file_path, read_status_file)
+        self.assertEqual(len(messages[Constants.PATCH_INSTALLATION_SUMMARY]["errors"]["details"]), 2)
+
+    def test_status_file_writes_coalesced(self):
+        status_file_writer = self.runtime.status_handler.status_file_writer
+        status_file_writer.min_write_interval_in_seconds = 3600
+        packages, package_versions = self.runtime.package_manager.get_all_updates()
+
+        # the first update goes out right away, transitioning updates after it are deferred
+        write_count = status_file_writer.write_count
+        self.runtime.status_handler.set_package_install_status(packages, package_versions)
+        self.runtime.status_handler.set_package_install_status(packages[0], package_versions[0], Constants.INSTALLED)
+        self.runtime.status_handler.set_package_install_status(packages[1], package_versions[1], Constants.INSTALLED)
+        self.assertEqual(status_file_writer.write_count, write_count + 1)
+        self.assertEqual(status_file_writer.coalesced_write_count, 1)
+        self.assertTrue(status_file_writer.is_write_pending())
+        with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+        self.assertEqual(json.loads(substatus_file_data["formattedMessage"]["message"])["pendingPatchCount"], 3)
+
+        # terminal transitions are written right away, with the latest data
+        self.runtime.status_handler.set_installation_substatus_json(status=Constants.STATUS_SUCCESS)
+        self.assertEqual(status_file_writer.write_count, write_count + 2)
+        self.assertFalse(status_file_writer.is_write_pending())
+        with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+        self.assertEqual(substatus_file_data["status"], Constants.STATUS_SUCCESS.lower())
+        self.assertEqual(json.loads(substatus_file_data["formattedMessage"]["message"])["installedPatchCount"], 2)
+
+        # unchanged content is not rewritten
+        status_file_writer.write(lambda: "[]", force=True)
+        status_file_writer.write(lambda: "[]", force=True)
+        self.assertEqual(status_file_writer.write_count, write_count + 3)
+        self.assertEqual(status_file_writer.unchanged_write_count, 1)
+        self.runtime.status_handler.flush_status_file()
+
     def test_set_installation_reboot_status(self):
         self.assertRaises(Exception, self.runtime.status_handler.set_installation_reboot_status, "INVALID_STATUS")
 
@@ -14,6 +14,7 @@
 #
 # Requires Python 2.7+
 
+import os
 import unittest
 from core.src.bootstrap.Constants import Constants
 from core.tests.library.ArgumentComposer import ArgumentComposer
@@ -28,6 +29,10 @@ class TestYumPackageManager(unittest.TestCase):
     def tearDown(self):
         self.runtime.stop()
 
+    def mock_run_command_output_with_history(self, cmd, no_output=False, chk_err=True):
+        self.command_history.append(cmd)
+        return self.runtime.legacy_env_layer_extensions.run_command_output(cmd, no_output, chk_err)
+
     def test_package_manager_no_updates(self):
         """Unit test for yum package manager with no updates"""
         # Path change
@@ -42,6 +47,49 @@ class TestYumPackageManager(unittest.TestCase):
         self.assertEqual(len(available_updates), 0)
         self.assertEqual(len(package_versions), 0)
 
+    def test_concurrent_discovery(self):
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+        self.command_history = []
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_with_history
+
+        # not opted in
+        package_manager.prefetch_discovery_outputs()
+        self.assertEqual(len(package_manager.prefetched_command_outputs), 0)
+
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CONCURRENT_DISCOVERY, True)
+        package_manager.prefetch_discovery_outputs()
+        self.assertEqual(sorted(package_manager.prefetched_command_outputs.keys()), sorted([package_manager.yum_check, package_manager.yum_check_security]))
+
+        packages, package_versions = package_manager.get_all_updates()
+        self.assertEqual(len(packages), 5)
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        self.assertEqual(len(security_packages), 1)
+        self.assertEqual(len(package_manager.prefetched_command_outputs), 0)
+        self.assertEqual(self.command_history.count(package_manager.yum_check), 1)
+        self.assertEqual(self.command_history.count(package_manager.yum_check_security), 1)
+
+    def test_streamed_output_parsing(self):
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+        code, output = self.runtime.env_layer.run_command_output(package_manager.yum_check, False, False)
+        expected_packages, expected_package_versions = package_manager.extract_packages_and_versions(output)
+
+        # replay the recorded output through a real process, so that it is parsed as it is read from the pipe
+        output_path = os.path.join(self.runtime.execution_config.config_folder, "check-update.out")
+        self.runtime.write_to_file(output_path, output)
+        self.runtime.env_layer.run_command_stream = lambda cmd: type(self.runtime.env_layer).run_command_stream(self.runtime.env_layer, "cat " + output_path + "; exit 100")
+        packages, package_versions = package_manager.get_all_updates()
+        self.assertEqual(packages, expected_packages)
+        self.assertEqual(package_versions, expected_package_versions)
+        os.remove(output_path)
+
+        # only the tail of a streamed output is kept
+        output_stream = self.runtime.env_layer.CommandOutputStream.from_output(1, "\n".join(str(index) for index in range(0, 1000)))
+        self.assertEqual(output_stream.read_to_end(), 1)
+        self.assertEqual(len(output_stream.tail), Constants.COMMAND_OUTPUT_TAIL_LINE_COUNT)
+        self.assertTrue(output_stream.get_tail().endswith("\n999"))
+
     def test_package_manager_unaligned_updates(self):
         """Unit test for yum package manager with multi-line updates"""
         # Path change
@@ -163,6 +211,37 @@ class TestYumPackageManager(unittest.TestCase):
         else:
             self.assertFalse(1 != 2, 'Exception did not occur and test failed.')
 
+    def test_resolve_dependency_graph(self):
+        """Unit test for bulk dependency resolution"""
+        self.runtime.set_legacy_test_type('HappyPath')
+
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+
+        simulations = []
+        get_dependent_list = package_manager.get_dependent_list
+        package_manager.get_dependent_list = lambda package_names: simulations.append(package_names) or get_dependent_list(package_names)
+
+        dependency_graph = package_manager.resolve_dependency_graph(["selinux-policy.noarch", "kmod-kvdo.x86_64"])
+        self.assertEqual(len(dependency_graph), 2)
+        self.assertEqual(dependency_graph["selinux-policy.noarch"], ["selinux-policy-targeted.noarch"])
+        self.assertEqual(dependency_graph["kmod-kvdo.x86_64"], ["kernel.x86_64"])
+        self.assertEqual(len(simulations), 2)
+
+        # dependencies on each other are kept, and packages resolved before are not simulated again
+        dependency_graph = package_manager.resolve_dependency_graph(["selinux-policy.noarch", "selinux-policy-targeted.noarch"])
+        self.assertEqual(len(dependency_graph), 2)
+        self.assertEqual(dependency_graph["selinux-policy.noarch"], ["selinux-policy-targeted.noarch"])
+        self.assertEqual(dependency_graph["selinux-policy-targeted.noarch"], ["selinux-policy.noarch"])
+        self.assertEqual(simulations, ["selinux-policy.noarch", "kmod-kvdo.x86_64", "selinux-policy-targeted.noarch"])
+
+        # a change to the package state invalidates resolved dependencies
+        package_manager.install_updates_in_transaction(["selinux-policy.noarch"], ["3.13.1-102.el7_3.16"])
+        package_manager.resolve_dependency_graph(["selinux-policy.noarch"])
+        self.assertEqual(len(simulations), 4)
+
+        self.assertEqual(package_manager.resolve_dependency_graph([]), {})
+
     def test_install_package_success(self):
         """Unit test for install package success"""
         self.runtime.set_legacy_test_type('HappyPath')
@@ -211,6 +290,18 @@ class TestYumPackageManager(unittest.TestCase):
         # test for unsuccessfully installing a package
         self.assertEquals(package_manager.install_update_and_dependencies('python-rhsm.x86_64', '1.19.10-1.el7_4', simulate=True), Constants.INSTALLED)
 
+    def test_installed_package_snapshot_epoch(self):
+        package_manager = self.container.get('package_manager')
+        query_output = "selinux-policy.noarch\t0:3.13.1-102.el7_3.16\nlibgcc.i686\t4.8.5-11.el7\nbind-utils.x86_64\t32:9.9.4-50.el7_3.1\n"
+        self.runtime.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=True: (0, query_output) if cmd == package_manager.installed_packages_query_cmd else (1, "")
+
+        # rpm prints an explicit epoch of 0, which yum leaves out of its versions
+        self.assertTrue(package_manager.get_install_status_from_snapshot("selinux-policy.noarch", "3.13.1-102.el7_3.16"))
+        self.assertTrue(package_manager.get_install_status_from_snapshot("selinux-policy.noarch", "0:3.13.1-102.el7_3.16"))
+        self.assertTrue(package_manager.get_install_status_from_snapshot("libgcc.i686", "0:4.8.5-11.el7"))
+        self.assertTrue(package_manager.get_install_status_from_snapshot("bind-utils.x86_64", "32:9.9.4-50.el7_3.1"))
+        self.assertFalse(package_manager.get_install_status_from_snapshot("bind-utils.x86_64", "9.9.4-50.el7_3.1"))
+
     def test_get_product_name(self):
         """Unit test for retrieving product Name"""
         package_manager = self.container.get('package_manager')
@@ -0,0 +1,163 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import gzip
+import os
+import shutil
+import sqlite3
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.src.package_managers.YumRepodataIndex import YumRepodataIndex
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestYumRepodataIndex(unittest.TestCase):
+    # Recorded machine state: 'rpm -qa' output, the cached repodata of each repo and what 'yum -q check-update' reported for them
+    INSTALLED_PACKAGES = "selinux-policy.noarch\t3.13.1-102.el7_3.15\n" + \
+                         "selinux-policy-targeted.noarch\t3.13.1-102.el7_3.15\n" + \
+                         "kernel.x86_64\t3.10.0-514.el7\n" + \
+                         "kernel.x86_64\t3.10.0-862.el7\n" + \
+                         "libgcc.x86_64\t4.8.5-28.el7\n" + \
+                         "libgcc.i686\t4.8.5-28.el7\n" + \
+                         "tuned.noarch\t2.9.0-1.el7\n" + \
+                         "2ping.noarch\t1:3.2.1-1.el7\n" + \
+                         "gpg-pubkey.(none)\tf4a80eb5-53a7ab1c\n"
+    BASE_REPO_PACKAGES = [("selinux-policy", "noarch", "0", "3.13.1", "102.el7_3.16"),
+                          ("selinux-policy", "noarch", "0", "3.13.1", "102.el7_3.15"),
+                          ("selinux-policy-targeted", "noarch", "0", "3.13.1", "102.el7_3.16"),
+                          ("kernel", "x86_64", "0", "3.10.0", "862.3.2.el7"),
+                          ("kernel", "x86_64", "0", "3.10.0", "693.el7"),
+                          ("kernel", "src", "0", "3.10.0", "957.el7"),
+                          ("libgcc", "x86_64", "0", "4.8.5", "36.el7"),
+                          ("libgcc", "i686", "0", "4.8.5", "36.el7"),
+                          ("2ping", "noarch", "0", "4.0", "1.el7"),
+                          ("not-installed", "x86_64", "0", "1.0", "1.el7")]
+    UPDATES_REPO_PACKAGES = [("tuned", "noarch", "0", "2.9.0", "1.el7_5.2"),
+                             ("kernel", "x86_64", "0", "3.10.0", "862.14.4.el7")]
+    DISABLED_REPO_PACKAGES = [("tuned", "noarch", "0", "2.10.0", "1.el7")]
+    RECORDED_CHECK_UPDATE = "\n" + \
+                            "kernel.x86_64                                                     3.10.0-862.14.4.el7                                      updates\n" + \
+                            "libgcc.i686                                                       4.8.5-36.el7                                             base\n" + \
+                            "libgcc.x86_64                                                     4.8.5-36.el7                                             base\n" + \
+                            "selinux-policy.noarch                                             3.13.1-102.el7_3.16                                      base\n" + \
+                            "selinux-policy-targeted.noarch                                    3.13.1-102.el7_3.16                                      base\n" + \
+                            "tuned.noarch                                                      2.9.0-1.el7_5.2                                          updates\n"
+
+    def setUp(self):
+        self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.YUM)
+        self.container = self.runtime.container
+        self.package_manager = self.container.get('package_manager')
+
+        self.test_folder = os.path.join(self.runtime.execution_config.config_folder, "repodata_index")
+        self.repo_config_path = os.path.join(self.test_folder, "yum.repos.d")
+        self.yum_cache_root = os.path.join(self.test_folder, "cache", "yum")
+        self.dnf_cache_root = os.path.join(self.test_folder, "cache", "dnf")
+        os.makedirs(self.repo_config_path)
+        self.runtime.write_to_file(os.path.join(self.repo_config_path, "CentOS-Base.repo"), "[base]\nname=CentOS-7 - Base\n\n[updates]\nname=CentOS-7 - Updates\nenabled=1\n\n[extras]\nenabled=0\n")
+
+        self.package_manager.native_assessment_engine.cache_roots = (self.yum_cache_root, self.dnf_cache_root)
+        self.package_manager.native_assessment_engine.repo_config_path = self.repo_config_path
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output
+
+    def tearDown(self):
+        shutil.rmtree(self.test_folder)
+        self.runtime.stop()
+
+    def mock_run_command_output(self, cmd, no_output=False, chk_err=True):
+        if cmd.find("rpm -qa") > -1:
+            return 0, self.INSTALLED_PACKAGES
+        if cmd.find("check-update") > -1:
+            return 100, self.RECORDED_CHECK_UPDATE
+        return 0, ""
+
+    @staticmethod
+    def write_primary_xml(path, packages):
+        os.makedirs(os.path.dirname(path))
+        entries = ""
+        for name, arch, epoch, version, release in packages:
+            entries += '<package type="rpm"><name>{0}</name><arch>{1}</arch><version epoch="{2}" ver="{3}" rel="{4}"/>' \
+                       '<description>Not read</description></package>\n'.format(name, arch, epoch, version, release)
+        with gzip.open(path, "wb") as file_handle:
+            file_handle.write(('<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{0}">\n'
+                               '{1}</metadata>\n').format(len(packages), entries).encode('utf-8'))
+
+    @staticmethod
+    def write_primary_sqlite(path, packages):
+        os.makedirs(os.path.dirname(path))
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, name TEXT, arch TEXT, epoch TEXT, version TEXT, release TEXT)")
+        connection.executemany("INSERT INTO packages (name, arch, epoch, version, release) VALUES (?, ?, ?, ?, ?)", packages)
+        connection.commit()
+        connection.close()
+
+    def assert_matches_recorded_check_update(self):
+        expected_packages, expected_versions = self.package_manager.extract_packages_and_versions(self.RECORDED_CHECK_UPDATE)
+        packages, versions = self.package_manager.native_assessment_engine.get_upgradable_packages()
+        self.assertEqual(packages, expected_packages)
+        self.assertEqual(versions, expected_versions)
+
+    def test_rpmvercmp(self):
+        # vectors from rpm's own rpmvercmp test suite
+        vectors = [("1.0", "1.0", 0), ("1.0", "2.0", -1), ("2.0.1", "2.0.1a", -1), ("5.5p1", "5.5p2", -1), ("5.5p10", "5.5p1", 1),
+                   ("10xyz", "10.1xyz", -1), ("xyz10", "xyz10.1", -1), ("xyz.4", "8", -1), ("1.0aa", "1.0a", 1), ("2.0", "2_0", 0),
+                   ("1.0010", "1.9", 1), ("1.05", "1.5", 0), ("1b.fc17", "1.fc17", -1), ("6.0.rc1", "6.0", 1),
+                   ("1.0~rc1", "1.0", -1), ("1.0~rc1", "1.0~rc2", -1), ("1.0~rc1~git123", "1.0~rc1", -1),
+                   ("1.0^", "1.0", 1), ("1.0^git1", "1.0^git2", -1), ("1.0^git1", "1.01", -1), ("1.0~rc1^git1", "1.0~rc1", 1)]
+        for version_a, version_b, expected in vectors:
+            self.assertEqual(YumRepodataIndex.rpmvercmp(version_a, version_b), expected, version_a + " vs " + version_b)
+            self.assertEqual(YumRepodataIndex.rpmvercmp(version_b, version_a), -expected, version_b + " vs " + version_a)
+
+        self.assertEqual(YumRepodataIndex.compare_evr(YumRepodataIndex.split_version("1:1.0-1"), YumRepodataIndex.split_version("2.0-1")), 1)
+        self.assertEqual(YumRepodataIndex.join_version(YumRepodataIndex.split_version("0:2.0-1.el7")), "2.0-1.el7")
+        self.assertEqual(YumRepodataIndex.join_version(YumRepodataIndex.split_version("2:2.0-1.el7")), "2:2.0-1.el7")
+
+    def test_yum_sqlite_repodata(self):
+        self.write_primary_sqlite(os.path.join(self.yum_cache_root, "x86_64", "7", "base", "gen", "primary_db.sqlite"), self.BASE_REPO_PACKAGES)
+        self.write_primary_sqlite(os.path.join(self.yum_cache_root, "x86_64", "7", "updates", "1a2b3c-primary.sqlite"), self.UPDATES_REPO_PACKAGES)
+        self.write_primary_xml(os.path.join(self.yum_cache_root, "x86_64", "7", "updates", "repodata", "1a2b3c-primary.xml.gz"), [])
+        self.write_primary_sqlite(os.path.join(self.yum_cache_root, "x86_64", "7", "extras", "4d5e6f-primary.sqlite"), self.DISABLED_REPO_PACKAGES)
+        self.assert_matches_recorded_check_update()
+
+    def test_dnf_xml_repodata(self):
+        self.write_primary_xml(os.path.join(self.dnf_cache_root, "base-0123456789abcdef", "repodata", "1a2b3c-primary.xml.gz"), self.BASE_REPO_PACKAGES)
+        self.write_primary_xml(os.path.join(self.dnf_cache_root, "updates-fedcba9876543210", "repodata", "4d5e6f-primary.xml.gz"), self.UPDATES_REPO_PACKAGES)
+        self.write_primary_xml(os.path.join(self.dnf_cache_root, "extras-0123456789abcdef", "repodata", "7a8b9c-primary.xml.gz"), self.DISABLED_REPO_PACKAGES)
+        self.assert_matches_recorded_check_update()
+
+    def test_get_all_updates_with_native_assessment(self):
+        self.write_primary_xml(os.path.join(self.dnf_cache_root, "base-0123456789abcdef", "repodata", "1a2b3c-primary.xml.gz"), self.BASE_REPO_PACKAGES)
+        self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_NATIVE_ASSESSMENT, True)
+        packages, versions = self.package_manager.get_all_updates()
+        self.assertEqual(packages, ["kernel.x86_64", "libgcc.i686", "libgcc.x86_64", "selinux-policy.noarch", "selinux-policy-targeted.noarch"])
+        self.assertEqual(versions[0], "3.10.0-862.3.2.el7")
+
+        # the cross-check keeps check-update authoritative; the missing 'updates' repo shows up as a mismatch
+        self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, True)
+        packages, versions = self.package_manager.get_all_updates()
+        self.assertEqual(len(packages), 6)
+        self.assertFalse(self.package_manager.cross_check_native_assessment(*self.package_manager.native_assessment_engine.get_upgradable_packages()))
+
+        # without a usable installed package snapshot, check-update is used
+        self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_CROSS_CHECK_NATIVE_ASSESSMENT, False)
+        self.INSTALLED_PACKAGES = ""
+        self.package_manager.installed_package_snapshot.invalidate()
+        packages, versions = self.package_manager.get_all_updates()
+        self.assertEqual(len(packages), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
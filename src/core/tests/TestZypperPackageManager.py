@@ -28,6 +28,38 @@ class TestZypperPackageManager(unittest.TestCase):
     def tearDown(self):
         self.runtime.stop()
 
+    def mock_run_command_output_with_history(self, cmd, no_output=False, chk_err=True):
+        self.command_history.append(cmd)
+        return self.runtime.legacy_env_layer_extensions.run_command_output(cmd, no_output, chk_err)
+
+    def mock_run_command_output_xml(self, cmd, no_output=False, chk_err=True):
+        self.assertTrue(cmd.find("zypper --xmlout ") > -1)
+        if cmd.find("list-updates") > -1:
+            return 0, "<?xml version='1.0'?>\n<stream>\n<message type=\"info\">Loading repository data...</message>\n<update-status version=\"0.6\">\n<update-list>\n" + \
+                      "<update kind=\"package\" name=\"kernel-default\" edition=\"4.4.49-92.11.1\" arch=\"x86_64\" edition-old=\"4.4.38-93.1\"><summary>The Linux Kernel</summary><source url=\"\" alias=\"SLES12-SP2-Updates\"/></update>\n" + \
+                      "<update kind=\"package\" name=\"libgoa-1_0-0\" edition=\"3.20.5-9.6\" arch=\"x86_64\" edition-old=\"3.20.4-7.2\"><summary>Introspection bindings</summary></update>\n" + \
+                      "<update kind=\"package\" name=\"libgoa-1_0-0\" edition=\"3.20.5-9.6\" arch=\"x86_64\" edition-old=\"3.20.4-7.2\"></update>\n" + \
+                      "</update-list>\n</update-status>\n</stream>\n"
+        if cmd.find("patch --category security --dry-run") > -1:
+            return 0, "<?xml version='1.0'?>\n<stream>\n<message type=\"info\">Resolving package dependencies...</message>\n" + \
+                      "<install-summary download-size=\"1024\" space-usage-diff=\"0\" packages-to-change=\"2\">\n" + \
+                      "<to-install><solvable type=\"patch\" name=\"SUSE-SLE-SERVER-12-SP2-2017-390\" edition=\"1\" arch=\"noarch\"/></to-install>\n" + \
+                      "<to-upgrade><solvable type=\"package\" name=\"kernel-default\" edition=\"4.4.49-92.11.1\" arch=\"x86_64\" edition-old=\"4.4.38-93.1\"/></to-upgrade>\n" + \
+                      "</install-summary>\n</stream>\n"
+        if cmd.find("zypper --xmlout search -s bash") > -1:
+            return 0, "<?xml version='1.0'?>\n<stream>\n<search-result version=\"0.0\">\n<solvable-list>\n" + \
+                      "<solvable status=\"other-version\" name=\"bash\" kind=\"package\" edition=\"4.3-83.5.2\" arch=\"x86_64\" repository=\"SLES12-SP2-Updates\"/>\n" + \
+                      "<solvable status=\"installed\" name=\"bash\" kind=\"package\" edition=\"4.3-78.39\" arch=\"x86_64\" repository=\"SLES12-SP2-Pool\"/>\n" + \
+                      "<solvable status=\"not-installed\" name=\"bash\" kind=\"srcpackage\" edition=\"4.3-83.5.2\" arch=\"noarch\" repository=\"SLES12-SP2-Updates\"/>\n" + \
+                      "<solvable status=\"installed\" name=\"bash-doc\" kind=\"package\" edition=\"4.3-78.39\" arch=\"noarch\" repository=\"SLES12-SP2-Pool\"/>\n" + \
+                      "</solvable-list>\n</search-result>\n</stream>\n"
+        if cmd.find("update --dry-run kernel-default") > -1:
+            return 0, "<?xml version='1.0'?>\n<stream>\n<install-summary packages-to-change=\"2\">\n" + \
+                      "<to-install><solvable type=\"package\" name=\"kernel-firmware\" edition=\"20170530-21.1\" arch=\"noarch\"/></to-install>\n" + \
+                      "<to-upgrade><solvable type=\"package\" name=\"kernel-default\" edition=\"4.4.49-92.11.1\" arch=\"x86_64\"/></to-upgrade>\n" + \
+                      "</install-summary>\n</stream>\n"
+        return 0, ""
+
     def test_package_manager_no_updates(self):
         """Unit test for zypper package manager with no updates"""
         # Path change
@@ -142,6 +174,50 @@ class TestZypperPackageManager(unittest.TestCase):
         else:
             self.assertFalse(1 != 2, 'Exception did not occur and test failed.')
 
+    def test_package_manager_xml_output(self):
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_XML_OUTPUT, True)
+        package_manager.set_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False)
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_xml
+
+        packages, package_versions = package_manager.get_all_updates()
+        self.assertEqual(packages, ["kernel-default", "libgoa-1_0-0", "libgoa-1_0-0"])
+        self.assertEqual(package_versions, ["4.4.49-92.11.1", "3.20.5-9.6", "3.20.5-9.6"])
+
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        self.assertEqual(security_packages, ["kernel-default"])
+        self.assertEqual(security_package_versions, ["4.4.49-92.11.1"])
+        other_packages, other_package_versions = package_manager.get_other_updates()
+        self.assertEqual(other_packages, ["libgoa-1_0-0", "libgoa-1_0-0"])
+
+        self.assertEqual(package_manager.get_all_available_versions_of_package("bash"), ["4.3-83.5.2"])
+        self.assertEqual(package_manager.get_all_available_versions_of_package_ex("bash", include_installed=True, include_available=False), ["4.3-78.39"])
+        self.assertEqual(package_manager.get_dependent_list(["kernel-default"]), ["kernel-firmware"])
+
+    def test_read_only_query_cache(self):
+        self.runtime.set_legacy_test_type('HappyPath')
+        package_manager = self.container.get('package_manager')
+        self.assertIsNotNone(package_manager)
+        self.command_history = []
+        self.runtime.env_layer.run_command_output = self.mock_run_command_output_with_history
+
+        security_packages, security_package_versions = package_manager.get_security_updates()
+        other_packages, other_package_versions = package_manager.get_other_updates()
+        package_manager.get_all_available_versions_of_package("bash")
+        package_manager.get_all_available_versions_of_package("bash")
+        self.assertEqual(self.command_history.count(package_manager.zypper_install_security_patches_simulate), 1)
+        self.assertEqual(self.command_history.count(package_manager.zypper_check), 1)
+        self.assertEqual(self.command_history.count(package_manager.single_package_check_versions.replace('<PACKAGE-NAME>', 'bash')), 1)
+
+        # installs and other state changing commands invalidate the cache
+        package_manager.install_update_and_dependencies('selinux-policy', '3.13.1-102.el7_3.16')
+        package_manager.get_all_available_versions_of_package("bash")
+        self.assertEqual(self.command_history.count(package_manager.single_package_check_versions.replace('<PACKAGE-NAME>', 'bash')), 2)
+        package_manager.refresh_repo()
+        package_manager.get_all_available_versions_of_package("bash")
+        self.assertEqual(self.command_history.count(package_manager.single_package_check_versions.replace('<PACKAGE-NAME>', 'bash')), 3)
+
     def test_do_processes_require_restart(self):
         self.runtime.set_legacy_test_type('HappyPath')
 
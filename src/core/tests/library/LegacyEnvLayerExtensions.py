@@ -48,7 +48,7 @@ class LegacyEnvLayerExtensions():
         return True
 
     # To be deprecated over time
-    def run_command_output(self, cmd, no_output=False, chk_err=True):
+    def run_command_output(self, cmd, no_output=False, chk_err=True, timeout=None):
         if no_output:
             return 0, None
         else:
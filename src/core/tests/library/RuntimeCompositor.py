@@ -48,10 +48,15 @@ class RuntimeCompositor(object):
         self.file_logger = bootstrapper.file_logger
         self.composite_logger = bootstrapper.composite_logger
         self.lifecycle_manager, self.telemetry_writer, self.status_handler = bootstrapper.build_core_components(self.container)
+        self.status_handler.status_file_writer.min_write_interval_in_seconds = 0    # tests inspect the status file right after each update
 
         # Business logic components
         self.execution_config = self.container.get('execution_config')
         self.package_manager = self.container.get('package_manager')
+        self.package_manager.assessment_result_cache.fingerprint_paths = []     # the package state of the machine running the tests must not make mocked assessments cacheable
+        if package_manager_name == Constants.APT:
+            self.package_manager.deb822_sources_path_pattern = os.path.join(self.execution_config.config_folder, "*.sources")     # nor can its sources end up in mocked discovery
+            self.package_manager.security_sources_list = os.path.join(self.execution_config.config_folder, "az-update-security.list")
         self.reboot_manager = self.container.get('reboot_manager')
         self.reconfigure_reboot_manager()
         self.package_filter = self.container.get('package_filter')
@@ -87,8 +92,14 @@ class RuntimeCompositor(object):
         self.env_layer.platform = self.legacy_env_layer_extensions.LegacyPlatform()
         self.env_layer.set_legacy_test_mode()
         self.env_layer.run_command_output = self.legacy_env_layer_extensions.run_command_output
+        self.env_layer.run_command_stream = self.run_command_stream
         self.env_layer.check_sudo_status = self.legacy_env_layer_extensions.check_sudo_status
 
+    def run_command_stream(self, cmd):
+        # streams whatever run_command_output is mocked with at the time of the call
+        code, output = self.env_layer.run_command_output(cmd, False, False)
+        return self.env_layer.CommandOutputStream.from_output(code, output)
+
     def reconfigure_reboot_manager(self):
         self.reboot_manager.start_reboot = self.start_reboot
 
@@ -16,8 +16,10 @@
 
 import datetime
 import json
+import os
 import re
 from extension.src.Constants import Constants
+from extension.src.file_handlers.StatusDocumentCache import StatusDocumentCache
 
 '''
 <SequenceNumber>.status
@@ -71,6 +73,7 @@ class ExtOutputStatusHandler(object):
             status_file_payload['status']['substatus'].append(self.__nooperation_substatus_json)
 
         self.json_file_handler.write_to_json_file(self.__dir_path, file_name, [status_file_payload])
+        StatusDocumentCache.invalidate(os.path.join(self.__dir_path, file_name))
 
     def __new_basic_status_json(self, operation, status):
         return {
@@ -98,7 +101,8 @@ class ExtOutputStatusHandler(object):
         self.__nooperation_summary_json = None
         self.__nooperation_errors = []
 
-        status_json = self.json_file_handler.get_json_file_content(file_name, self.__dir_path)
+        # parsed structures are shared through StatusDocumentCache and are only re-read if the file changed on disk
+        status_json, status_messages = StatusDocumentCache.load(os.path.join(self.__dir_path, file_name), lambda: self.json_file_handler.get_json_file_content(file_name, self.__dir_path))
         if status_json is None:
             return None
 
@@ -106,10 +110,10 @@ class ExtOutputStatusHandler(object):
             name = status_json[0]['status']['substatus'][i]['name']
             if name == Constants.PATCH_NOOPERATION_SUMMARY:     # if it exists, it must be to spec, or an exception will get thrown
                 message = status_json[0]['status']['substatus'][i]['formattedMessage']['message']
-                self.__nooperation_summary_json = json.loads(message)
+                self.__nooperation_summary_json = status_messages[name] if name in status_messages else json.loads(message)
                 errors = self.__nooperation_summary_json['errors']
                 if errors is not None and errors['details'] is not None:
-                    self.__nooperation_errors = errors['details']
+                    self.__nooperation_errors = list(errors['details'])
                     self.__nooperation_total_error_count = self.__get_total_error_count_from_prev_status(errors['message'])
 
         return status_json
@@ -134,10 +138,15 @@ class ExtOutputStatusHandler(object):
             if status_json is None:
                 self.logger.log_error("Error processing file. [File={0}]".format(file_name))
                 return
+
+            # the document read is shared through StatusDocumentCache, so only copies of the levels being updated are modified
+            status_json = [dict(status_json[0])]
+            status_json[0][self.file_keys.status] = dict(status_json[0][self.file_keys.status])
             self.update_key_value_safely(status_json, self.file_keys.status_status, self.status.Transitioning.lower(), self.file_keys.status_status)
             self.update_key_value_safely(status_json, self.file_keys.status_code, 0, self.file_keys.status_status)
             self.update_key_value_safely(status_json, self.file_keys.timestamp_utc, str(datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")))
             self.json_file_handler.write_to_json_file(dir_path, file_name, status_json)
+            StatusDocumentCache.invalidate(os.path.join(dir_path, file_name))
         except Exception as error:
             error_message = "Error in status file creation: " + repr(error)
             self.logger.log_error(error_message)
@@ -0,0 +1,72 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Process-wide cache of parsed status files, including the json summaries embedded in their substatus messages. Mirrors StatusDocumentCache in core."""
+import json
+import os
+
+
+class StatusDocumentCache(object):
+    """Status files are only re-read and re-parsed when they change on disk. Returned structures are shared between callers and must not be modified."""
+    __documents = {}    # file path -> (file fingerprint, status document, substatus name -> parsed message)
+    hit_count = 0
+    miss_count = 0
+
+    @classmethod
+    def load(cls, file_path, read_delegate):
+        """ Returns (status document, substatus name -> parsed message) for the status file. read_delegate reads and parses the file; it is only called if the file changed since it was last loaded.
+            Messages that are not valid json are left out, for callers to handle as they see fit. Returns (None, None) if read_delegate returns None. """
+        fingerprint = cls.get_file_fingerprint(file_path)
+        cached_document = cls.__documents.get(file_path)
+        if fingerprint is not None and cached_document is not None and cached_document[0] == fingerprint:
+            cls.hit_count += 1
+            return cached_document[1], cached_document[2]
+
+        cls.miss_count += 1
+        cls.__documents.pop(file_path, None)
+        status_document = read_delegate()
+        if status_document is None:
+            return None, None
+
+        messages = {}
+        try:
+            for substatus in status_document[0]['status']['substatus']:
+                try:
+                    messages[substatus['name']] = json.loads(substatus['formattedMessage']['message'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+        except (IndexError, KeyError, TypeError):
+            pass    # malformed status documents are left to callers to detect
+
+        if fingerprint is not None and fingerprint == cls.get_file_fingerprint(file_path):   # not cached if the file changed while being read
+            cls.__documents[file_path] = (fingerprint, status_document, messages)
+        return status_document, messages
+
+    @classmethod
+    def invalidate(cls, file_path=None):
+        if file_path is None:
+            cls.__documents = {}
+        else:
+            cls.__documents.pop(file_path, None)
+
+    @staticmethod
+    def get_file_fingerprint(file_path):
+        """ Returns (mtime, size, inode) of the file, or None if it cannot be read. The inode changes when a file is replaced through a temp file. """
+        try:
+            stat = os.stat(file_path)
+            return stat.st_mtime, stat.st_size, stat.st_ino
+        except OSError:
+            return None
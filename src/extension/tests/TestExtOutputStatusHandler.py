@@ -21,6 +21,7 @@ import tempfile
 import unittest
 from extension.src.Constants import Constants
 from extension.src.file_handlers.ExtOutputStatusHandler import ExtOutputStatusHandler
+from extension.src.file_handlers.StatusDocumentCache import StatusDocumentCache
 from extension.src.local_loggers.FileLogger import FileLogger
 from extension.tests.helpers.RuntimeComposer import RuntimeComposer
 from extension.tests.helpers.VirtualTerminal import VirtualTerminal
@@ -92,6 +93,25 @@ class TestExtOutputStatusHandler(unittest.TestCase):
         self.assertEqual(updated_status_json[0][self.status_file_fields.status][self.status_file_fields.status_status], self.status.Transitioning.lower())
         shutil.rmtree(dir_path)
 
+    def test_read_file_cached(self):
+        file_name = "test"
+        dir_path = tempfile.mkdtemp()
+        ext_output_status_handler = ExtOutputStatusHandler(self.logger, self.utility, self.json_file_handler, dir_path)
+        ext_output_status_handler.write_status_file("Assessment", file_name, self.status.Success.lower())
+
+        # an unchanged file is only parsed once
+        status_json = ext_output_status_handler.read_file(file_name)
+        hit_count = StatusDocumentCache.hit_count
+        self.assertTrue(ext_output_status_handler.read_file(file_name) is status_json)
+        self.assertEqual(StatusDocumentCache.hit_count, hit_count + 1)
+
+        # updating the file does not modify the shared document, and the updated file is re-read
+        ext_output_status_handler.update_file(file_name, dir_path)
+        self.assertEqual(status_json[0][self.status_file_fields.status][self.status_file_fields.status_status], self.status.Success.lower())
+        updated_status_json = ext_output_status_handler.read_file(file_name)
+        self.assertEqual(updated_status_json[0][self.status_file_fields.status][self.status_file_fields.status_status], self.status.Transitioning.lower())
+        shutil.rmtree(dir_path)
+
     def test_add_error_to_status(self):
         file_name = "test"
         dir_path = tempfile.mkdtemp()
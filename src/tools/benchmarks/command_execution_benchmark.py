@@ -0,0 +1,52 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+""" Measures the per-command overhead of EnvLayer.run_command_output with fresh processes vs. the shell coprocess.
+    Usage: python command_execution_benchmark.py [command count] [command] """
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from core.src.bootstrap.EnvLayer import EnvLayer
+
+
+def time_commands(env_layer, command, count):
+    start = time.time()
+    for index in range(0, count):
+        env_layer.run_command_output(command, False, False)
+    return (time.time() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    command = sys.argv[2] if len(sys.argv) > 2 else "sudo dpkg -s dpkg > /dev/null"   # a short package query, as issued per package during installation
+
+    env_layer = EnvLayer(os.path.join(tempfile.mkdtemp(), "benchmark.record"))
+    fresh_process_time = time_commands(env_layer, command, count)
+    env_layer.set_shell_coprocess_enabled(True)
+    shell_coprocess_time = time_commands(env_layer, command, count)
+    env_layer.set_shell_coprocess_enabled(False)
+
+    print("Command: {0} [Count={1}]".format(command, str(count)))
+    print(" - Fresh processes: {0:.2f} ms per command".format(fresh_process_time * 1000))
+    print(" - Shell coprocess: {0:.2f} ms per command".format(shell_coprocess_time * 1000))
+    print(" - Overhead removed: {0:.2f} ms per command ({1:.1f}s over {2} commands)".format((fresh_process_time - shell_coprocess_time) * 1000, (fresh_process_time - shell_coprocess_time) * count, str(count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+""" Compares the parallel list handling that PackageSet replaced with PackageSet, over a yum-style update list.
+    Usage: python package_set_benchmark.py [package count] """
+from __future__ import print_function
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from core.src.core_logic.PackageFilter import PackageFilter
+from core.src.package_managers.PackageSet import PackageSet
+
+
+def get_packages(count):
+    """ Half the packages come in two architectures, as multilib packages do """
+    packages = []
+    for index in range(0, count):
+        packages.append("package{0}.{1}".format(str(index // 2), 'x86_64' if index % 2 == 0 else ('i686' if index % 4 == 1 else 'noarch')))
+    return packages, ["1.0-{0}.el7".format(str(index)) for index in range(0, count)]
+
+
+def dedupe_with_lists(packages, package_versions):
+    deduped_packages = []
+    deduped_package_versions = []
+    for index, package in enumerate(packages):
+        if package in deduped_packages:
+            continue
+        deduped_packages.append(package)
+        deduped_package_versions.append(package_versions[index])
+    return deduped_packages, deduped_package_versions
+
+
+def difference_with_lists(packages, package_versions, excluded_packages):
+    return [package for package in packages if package not in excluded_packages], [version for package, version in zip(packages, package_versions) if package not in excluded_packages]
+
+
+def multilib_with_lists(packages, package_versions):
+    for package in packages:
+        package_name_without_arch = PackageFilter.get_product_name_without_arch(package)
+        [possible for possible, version in zip(packages, package_versions) if PackageFilter.get_product_name_without_arch(possible) == package_name_without_arch]
+        package_versions[packages.index(package)]
+
+
+def multilib_with_package_set(packages, package_versions):
+    update_set = PackageSet(packages, package_versions)
+    for package in packages:
+        update_set.get_packages_with_base_name(PackageSet.get_base_name(package))
+        update_set.get_version(package)
+
+
+def time_call(delegate, *args):
+    start = time.time()
+    delegate(*args)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    packages, package_versions = get_packages(count)
+    excluded_packages = packages[::3]
+
+    print("Packages: {0}".format(str(count)))
+    comparisons = [("Dedupe", lambda: dedupe_with_lists(packages, package_versions), lambda: PackageSet(packages, package_versions).to_lists()),
+                   ("Difference", lambda: difference_with_lists(packages, package_versions, excluded_packages), lambda: PackageSet(packages, package_versions).difference(excluded_packages).to_lists()),
+                   ("Install loop lookups (yum multilib)", lambda: multilib_with_lists(packages, package_versions), lambda: multilib_with_package_set(packages, package_versions))]
+    for name, list_delegate, package_set_delegate in comparisons:
+        list_time = time_call(list_delegate)
+        package_set_time = time_call(package_set_delegate)
+        print(" - {0}: lists {1:.3f}s, PackageSet {2:.3f}s ({3:.0f}x)".format(name, list_time, package_set_time, list_time / max(package_set_time, 1e-6)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+""" Measures loading a status file with assessment and installation summaries, parsing it on every load vs. through StatusDocumentCache.
+    Usage: python status_document_cache_benchmark.py [patch count] [load count] """
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from core.src.service_interfaces.StatusDocumentCache import StatusDocumentCache
+
+
+def write_status_file(status_file_path, patch_count):
+    """ Same nesting as the status file: summaries are embedded as json strings in the substatus messages """
+    substatus = []
+    for name, state_key, state in (("PatchAssessmentSummary", "patchState", "Available"), ("PatchInstallationSummary", "patchInstallationState", "Installed")):
+        patches = [{"patchId": "package{0}_1.0-{0}_Ubuntu_18.04".format(str(index)), "name": "package{0}".format(str(index)), "version": "1.0-{0}".format(str(index)), "classifications": ["Other"], state_key: state} for index in range(0, patch_count)]
+        summary = {"activityId": "00000000-0000-0000-0000-000000000000", "patches": patches, "errors": {"code": 0, "details": [], "message": "0 error/s reported."}}
+        substatus.append({"name": name, "status": "success", "code": 0, "formattedMessage": {"lang": "en-US", "message": json.dumps(summary)}})
+    with open(status_file_path, 'w') as file_handle:
+        file_handle.write(json.dumps([{"version": 1.0, "status": {"name": "Azure Patch Management", "formattedMessage": {"lang": "en-US", "message": ""}, "substatus": substatus}}]))
+
+
+def read_status_file(status_file_path):
+    with open(status_file_path, 'r') as file_handle:
+        return json.load(file_handle)
+
+
+def load_uncached(status_file_path):
+    status_document = read_status_file(status_file_path)
+    return status_document, dict((substatus['name'], json.loads(substatus['formattedMessage']['message'])) for substatus in status_document[0]['status']['substatus'])
+
+
+def time_loads(delegate, status_file_path, load_count):
+    start = time.time()
+    for index in range(0, load_count):
+        delegate(status_file_path)
+    return (time.time() - start) / load_count
+
+
+def main():
+    patch_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    load_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    working_folder = tempfile.mkdtemp()
+    status_file_path = os.path.join(working_folder, "0.status")
+    write_status_file(status_file_path, patch_count)
+
+    uncached_time = time_loads(load_uncached, status_file_path, load_count)
+    cached_time = time_loads(lambda file_path: StatusDocumentCache.load(file_path, lambda: read_status_file(file_path)), status_file_path, load_count)
+
+    print("Patches: {0} per summary [Loads={1}][StatusFileSize={2}]".format(str(patch_count), str(load_count), str(os.path.getsize(status_file_path))))
+    print(" - Parsed on every load: {0:.2f} ms per load".format(uncached_time * 1000))
+    print(" - StatusDocumentCache: {0:.3f} ms per load ({1} parses, {2} cache hits)".format(cached_time * 1000, str(StatusDocumentCache.miss_count), str(StatusDocumentCache.hit_count)))
+    shutil.rmtree(working_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+""" Measures the cost of a status file write during an installation (one patch changes per write), re-encoding every patch record vs. assembling cached record fragments.
+    Usage: python status_write_benchmark.py [patch count] [write count] """
+from __future__ import print_function
+import json
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from core.src.bootstrap.EnvLayer import EnvLayer
+from core.src.service_interfaces.PatchStatusRecords import PatchStatusRecords
+
+
+def get_patch_records(count):
+    patch_records = PatchStatusRecords('patchInstallationState')
+    for index in range(0, count):
+        patch_records.add("package{0}_1.0-{0}_Ubuntu_18.04".format(str(index)), "package{0}".format(str(index)), "1.0-{0}".format(str(index)), ["Other"], "Pending")
+    return patch_records
+
+
+def get_status_file_content(patch_records, patches):
+    """ Same nesting as the status file: the installation summary is embedded as a json string """
+    summary = {"installationActivityId": "00000000-0000-0000-0000-000000000000", "pendingPatchCount": len(patch_records), "patches": patches, "errors": None}
+    status = {"version": 1.0, "status": {"substatus": [{"name": "PatchInstallationSummary", "formattedMessage": {"lang": "en-US", "message": json.dumps(summary)}}]}}
+    return '[{0}]'.format(json.dumps(status))
+
+
+def time_writes(env_layer, status_file_path, patch_records, write_count, compose_delegate):
+    start = time.time()
+    for index in range(0, write_count):
+        patch_records.get("package{0}_1.0-{0}_Ubuntu_18.04".format(str(index))).update(state="Installed")
+        env_layer.file_system.write_with_retry_using_temp_file(status_file_path, compose_delegate(), mode='w+')
+    return (time.time() - start) / write_count
+
+
+def main():
+    patch_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    write_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    working_folder = tempfile.mkdtemp()
+    env_layer = EnvLayer(os.path.join(working_folder, "benchmark.record"))
+    status_file_path = os.path.join(working_folder, "0.status")
+
+    patch_records = get_patch_records(patch_count)
+    re_encoded_time = time_writes(env_layer, status_file_path, patch_records, write_count, lambda: get_status_file_content(patch_records, patch_records.to_json()))
+    re_encoded_content = get_status_file_content(patch_records, patch_records.to_json())
+
+    patch_records = get_patch_records(patch_count)
+    patch_records.get_json_fragment(escaped=True)   # the first write after loading encodes every record
+    fragment_time = time_writes(env_layer, status_file_path, patch_records, write_count, lambda: patch_records.insert_escaped_json_fragment(get_status_file_content(patch_records, patch_records.json_placeholder)))
+    fragment_content = patch_records.insert_escaped_json_fragment(get_status_file_content(patch_records, patch_records.json_placeholder))
+
+    print("Patches: {0} [Writes={1}][StatusFileSize={2}]".format(str(patch_count), str(write_count), str(len(fragment_content))))
+    print(" - Re-encoding every record: {0:.2f} ms per write".format(re_encoded_time * 1000))
+    print(" - Cached record fragments: {0:.2f} ms per write ({1:.1f}x)".format(fragment_time * 1000, re_encoded_time / max(fragment_time, 1e-9)))
+    print(" - Identical status file content: {0}".format(str(re_encoded_content == fragment_content)))
+
+
+if __name__ == '__main__':
+    main()